@@ -4,9 +4,10 @@ import sys
 import os
 import pandas as pd
 import numpy as np
-import csv
 import pickle
-from collections import Counter, defaultdict
+from results_io import write_typed
+from state_codec import missing_columns, encode, key_set
+from frequency_cube import load_frequency_counts
 from sklearn.preprocessing import LabelEncoder
 
 # Path to no_crashes dataset used to decide potential_crash_before/after
@@ -14,9 +15,6 @@ NO_CRASHES_PATH = "./Shared_CSVs/no_crashes.csv"
 # Path to complete database for frequency lookup
 COMPLETE_DB_PATH = "./Shared_CSVs/complete_DB_discrete.csv"
 
-# Tolerance for floating equality when detecting ties (equal probabilities)
-EPS = 1e-12
-
 def load_nb_model(rep_num, percentage, fold_num):
     """Load Naive Bayes model from pickle file"""
     model_path = f"./rep_{rep_num}/{percentage}/NB/NB_fold_{fold_num}.pkl"
@@ -90,8 +88,8 @@ def compute_probability_for_iaction(model_data, test_data):
         print(f"[Error] Computing probabilities: {e}")
         return None
 
-def process_nb_fold(rep_num, percentage, fold_num, no_crashes_df, frequency_dict):
-    """Process a single NB fold and generate results"""
+def process_nb_fold(rep_num, percentage, fold_num, no_crashes_set, frequency_counts):
+    """Process a single NB fold and generate results; no_crashes_set is the state_codec key_set of no_crashes.csv"""
     print(f"Processing NB rep {rep_num}, percentage {percentage}, fold {fold_num}")
     
     # Load test data
@@ -145,10 +143,10 @@ def process_nb_fold(rep_num, percentage, fold_num, no_crashes_df, frequency_dict
         print(f"  {row['iaction']}: prob={row['probability']:.6f}, rank={row['ranking']}")
     
     # Add frequency column
-    results = add_frequency_column(results, frequency_dict)
+    results = add_frequency_column(results, frequency_counts)
     
     # Calculate potential_crash_before and after intervention
-    results = calculate_crash_potential(results, no_crashes_df)
+    results = calculate_crash_potential(results, no_crashes_set)
     
     # Drop the original 'action' column after using it for crash calculation
     if 'action' in results.columns:
@@ -168,100 +166,37 @@ def process_nb_fold(rep_num, percentage, fold_num, no_crashes_df, frequency_dict
     
     return results
 
-def calculate_crash_potential(df, no_crashes_df):
-    """Calculate potential_crash_before and after intervention"""
-    # Identify columns to exclude for state-key
-    exclude_cols = set(['iaction', 'probability', 'elapsed_time', 'group_id', 'ranking', 'best_intervention', 'frequency'])
-    for to_ex in ['latent_collision', 'labeled_lc', 'orig_label_lc']:
-        if to_ex in df.columns:
-            exclude_cols.add(to_ex)
-
-    state_cols = [c for c in df.columns if c not in exclude_cols]
-
-    # Create lookup set for no_crashes keys
-    no_crashes_cols = [c for c in state_cols if c in no_crashes_df.columns]
-    if len(no_crashes_cols) == 0:
-        print("[Warning] No common columns with no_crashes data")
+def calculate_crash_potential(df, no_crashes_set):
+    """
+    Calculate potential_crash_before and after intervention; no_crashes_set
+    is the key_set of no_crashes.csv, None if it lacks state columns
+    """
+    # Keys of the (action, state) pairs; every state column must be in the results
+    missing = missing_columns(df)
+    if missing or no_crashes_set is None:
+        if missing:
+            print(f"[Warning] Columns {missing} missing in the results")
         df['potential_crash_before_intervention'] = 'True'
         df['potential_crash_after_intervention'] = 'True'
         return df
 
-    no_crashes_key = make_key_from_df(no_crashes_df[no_crashes_cols], no_crashes_cols)
-    no_crashes_set = set(no_crashes_key.values)
-
     # Before intervention - use the ORIGINAL action to determine crash potential
-    before_key_match = make_key_from_df(df[no_crashes_cols], no_crashes_cols)
-    df['potential_crash_before_intervention'] = np.where(before_key_match.isin(no_crashes_set), 'False', 'True')
+    df['potential_crash_before_intervention'] = np.where(no_crashes_set[encode(df)], 'False', 'True')
 
     # After intervention (given iaction)
-    df_after_keys = df[no_crashes_cols].copy()
-    if 'action' in df_after_keys.columns and 'iaction' in df.columns:
-        # Replace original action with iaction for after intervention
-        df_after_keys['action'] = df['iaction'].astype(str)
-    after_key = make_key_from_df(df_after_keys, no_crashes_cols)
-    df['potential_crash_after_intervention'] = np.where(after_key.isin(no_crashes_set), 'False', 'True')
+    df['potential_crash_after_intervention'] = np.where(no_crashes_set[encode(df, 'iaction')], 'False', 'True')
 
     return df
 
-def make_key_from_df(df, cols):
-    """Return a Series of string keys by concatenating values in cols (all cast to str)."""
-    return df[cols].astype(str).agg("_".join, axis=1)
-
-def load_frequency_data():
-    """Load and prepare frequency data from complete_DB_discrete.csv"""
-    print("Loading frequency data from:", COMPLETE_DB_PATH)
-    if not os.path.exists(COMPLETE_DB_PATH):
-        print(f"[Warning] Complete DB file not found at {COMPLETE_DB_PATH}. Frequency column will be NA.")
-        return None
-    
-    freq_df = pd.read_csv(COMPLETE_DB_PATH, dtype=str)
-    
-    # Create frequency mapping for action-state pairs
-    state_cols = ['curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W']
-    available_state_cols = [col for col in state_cols if col in freq_df.columns]
-    
-    if 'action' not in freq_df.columns:
-        print("[Warning] 'action' column not found in frequency data. Cannot compute frequencies.")
-        return None
-    
-    if not available_state_cols:
-        print("[Warning] No state columns found in frequency data. Cannot compute frequencies.")
-        return None
-    
-    print(f"Using state columns for frequency: {available_state_cols}")
-    
-    # Create key for frequency lookup (action + state)
-    freq_df['freq_key'] = make_key_from_df(freq_df[['action'] + available_state_cols], ['action'] + available_state_cols)
-    
-    # Count frequencies
-    freq_counts = freq_df.groupby('freq_key').size().reset_index(name='frequency')
-    
-    return freq_counts.set_index('freq_key')['frequency'].to_dict()
-
-def add_frequency_column(df, frequency_dict):
+def add_frequency_column(df, frequency_counts):
     """Add frequency column to dataframe based on action-state pairs"""
-    if frequency_dict is None:
-        df['frequency'] = 'NA'
-        return df
-    
-    state_cols = ['curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W']
-    available_state_cols = [col for col in state_cols if col in df.columns]
-    
     # Use iaction (given intervention action) for frequency calculation
-    if 'iaction' not in df.columns or not available_state_cols:
+    if frequency_counts is None or missing_columns(df, 'iaction'):
         df['frequency'] = 'NA'
         return df
     
-    # Create frequency key for each row using iaction (intervention action)
-    df['freq_key'] = make_key_from_df(df[['iaction'] + available_state_cols], ['iaction'] + available_state_cols)
-    
     # Map frequencies
-    df['frequency'] = df['freq_key'].map(
-        lambda x: str(frequency_dict.get(x, 0)) if pd.notna(x) else '0'
-    )
-    
-    # Remove temporary column
-    df.drop('freq_key', axis=1, inplace=True, errors='ignore')
+    df['frequency'] = frequency_counts[encode(df, 'iaction')].astype(str)
     
     return df
 
@@ -287,6 +222,7 @@ def save_nb_results(rep_num, percentage, all_results):
     
     # Save main results (equivalent to twin_networks_results.csv)
     combined_results.to_csv(input_csv, index=False)
+    write_typed(combined_results, input_csv)
     print(f"Saved NB results to {input_csv}")
     
     # For best_interventions, select only rows with best_intervention == '*'
@@ -298,6 +234,7 @@ def save_nb_results(rep_num, percentage, all_results):
     # data_sorted sorted by group_id and ranking
     combined_results_sorted = combined_results.sort_values(['group_id', 'ranking']).reset_index(drop=True)
     combined_results_sorted.to_csv(ds_csv, index=False)
+    write_typed(combined_results_sorted, ds_csv)
     
     # Generate contingency tables
     generate_contingency_tables(combined_results_sorted, ct_txt, ct_atom_txt, rep_num, percentage)
@@ -361,13 +298,10 @@ def generate_contingency_tables(df, ct_txt, ct_atom_txt, rep_num, percentage):
     
     print(f"Generated contingency tables for NB results")
 
-def process_nb_rep_perc(rep_num, perc, no_crashes_df):
+def process_nb_rep_perc(rep_num, perc, no_crashes_set, frequency_counts):
     """Process all NB folds for a given repetition and percentage"""
     print(f"\nProcessing NB rep: {rep_num} percentage: {perc}")
     
-    # Load frequency data
-    frequency_dict = load_frequency_data()
-    
     # Find how many test folds exist
     test_dir = f"./rep_{rep_num}/test_data"
     if not os.path.exists(test_dir):
@@ -386,7 +320,7 @@ def process_nb_rep_perc(rep_num, perc, no_crashes_df):
     # Process each fold
     for fold_num in range(1, num_folds + 1):
         try:
-            results = process_nb_fold(rep_num, perc, fold_num, no_crashes_df, frequency_dict)
+            results = process_nb_fold(rep_num, perc, fold_num, no_crashes_set, frequency_counts)
             if results is not None:
                 all_results.append(results)
                 print(f"  Fold {fold_num}/{num_folds} processed successfully")
@@ -416,12 +350,22 @@ def main():
         print(f"[Error] no_crashes file not found at {NO_CRASHES_PATH}")
         sys.exit(1)
     no_crashes_df = pd.read_csv(NO_CRASHES_PATH, dtype=str)
+    # Keys of the (action, state) pairs, built once for every fold
+    missing = missing_columns(no_crashes_df)
+    if missing:
+        print(f"[Warning] no_crashes.csv lacks columns {missing}; potential_crash_* set to True")
+        no_crashes_set = None
+    else:
+        no_crashes_set = key_set(encode(no_crashes_df))
+
+    # Frequencies of complete_DB_discrete.csv, counted once into the cached frequency cube
+    frequency_counts = load_frequency_counts(COMPLETE_DB_PATH)
 
     # Process NB results
     for rep in range(1, num_reps + 1):
         for perc in percentages:
             try:
-                process_nb_rep_perc(rep, perc, no_crashes_df)
+                process_nb_rep_perc(rep, perc, no_crashes_set, frequency_counts)
             except Exception as e:
                 print(f"[Error] processing NB rep {rep} perc {perc}: {e}", flush=True)
 
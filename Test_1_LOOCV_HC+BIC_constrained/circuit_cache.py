@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache of compiled twin networks.
+
+Compiled circuits are keyed by a hash of the normalized program text plus the
+query/evidence/intervention signature, so byte-identical (or only
+differently formatted) cBN_i.pl files share one entry across folds, reps and
+the three Test_1 variants. Parametric keys mask the probabilities as well, so
+that every program with the same DAG structure maps to one entry. Entries are
+pickles stored under CACHE_DIR; the least recently used ones are evicted once
+the cache exceeds MAX_CACHE_BYTES.
+"""
+
+import os
+import re
+import hashlib
+import pickle
+import tempfile
+
+# Shared by every variant so cross-variant runs reuse each other's circuits
+CACHE_DIR = os.path.expanduser("~/.cache/counterfactuals_evaluation/circuits")
+# Size bound of the cache directory
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Bump when the pickled circuit layout changes to invalidate old entries
+CACHE_VERSION = 2
+
+NUMBER_RE = re.compile(r"(?<![\w.])\d+\.\d+(?:[eE][-+]?\d+)?")
+
+
+def normalize_program(text, parametric=False):
+    """
+    Drop comments and blank lines, collapse whitespace and canonicalize
+    probabilities; with parametric=True probabilities become placeholders.
+    """
+    lines = []
+    for line in text.splitlines():
+        line = line.split("%", 1)[0].strip()
+        if not line:
+            continue
+        line = re.sub(r"\s+", " ", line)
+        if parametric:
+            line = NUMBER_RE.sub("?", line)
+        else:
+            line = NUMBER_RE.sub(lambda m: repr(float(m.group(0))), line)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def cache_key(text, signature, parametric=False):
+    """Return the cache key of a program text and a query signature (a tuple of strings)."""
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}{'p' if parametric else ''}\n".encode())
+    digest.update(repr(tuple(signature)).encode())
+    digest.update(b"\n")
+    digest.update(normalize_program(text, parametric).encode())
+    return digest.hexdigest()
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, key[:2], key + ".pkl")
+
+
+def load_circuit(key, cache_dir=CACHE_DIR):
+    """Return the cached circuit for key, or None on a miss."""
+    path = _entry_path(key, cache_dir)
+    try:
+        with open(path, "rb") as f:
+            circuit = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        print(f"[Warning] Discarding unreadable cache entry {path}: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    # Refresh the entry's mtime: eviction is least recently used first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return circuit
+
+
+def store_circuit(key, circuit, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Atomically write circuit under key, then evict old entries beyond max_bytes."""
+    path = _entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(circuit, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Remove least recently used entries until the cache fits in max_bytes."""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
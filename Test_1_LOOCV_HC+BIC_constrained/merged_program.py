@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Counterfactual programs with merged twin nodes.
+
+counterfactuals.CounterfactualProgram copies every derived atom of a program
+into an evidence world (name_e) next to the intervention world (name_i), so
+the knowledge compiler sees two copies of every variable. Atoms that do not
+depend on the intervened predicate are identical in both worlds, since both
+copies are derived from the same exogenous facts: in the cBN programs these
+are curr_lane and the free_* variables that are not descendants of action.
+MergedCounterfactualProgram keeps a single copy of them and only duplicates
+the atoms downstream of action, i.e. the action -> latent_collision chain.
+
+The stages of loading a program are charged to the phases of query_profile
+(parse, ground, twin, cnf); run_WhatIf_V4.stored_single_query charges the
+queries themselves to compile or evaluate.
+
+This module imports aspmc; run_WhatIf_V4.load_aspmc imports it on demand.
+"""
+
+from aspmc.programs.problogprogram import ProblogProgram
+from aspmc.programs.program import Rule
+from counterfactuals.counterfactualprogram import CounterfactualProgram
+
+from twin_network import INTERVENED_ATOM
+from query_profile import phase
+
+
+class MergedCounterfactualProgram(CounterfactualProgram):
+    """CounterfactualProgram that only duplicates the descendants of the intervened predicate."""
+
+    def __init__(self, program_str, program_files, intervened=INTERVENED_ATOM):
+        # CounterfactualProgram.__init__ duplicates every derived atom; the
+        # grounded program saved by _normalize is twinned again, selectively
+        with phase('parse'):
+            CounterfactualProgram.__init__(self, program_str, program_files)
+        self._program, self._deriv, self._nameMap, self._max = self._grounded
+
+        with phase('twin'):
+            self._build_twin(intervened)
+
+    def _ground(self, clingo_control, program):
+        with phase('ground'):
+            ProblogProgram._ground(self, clingo_control, program)
+
+    def _normalize(self, clingo_control):
+        with phase('ground'):
+            ProblogProgram._normalize(self, clingo_control)
+        self._grounded = (list(self._program), set(self._deriv), dict(self._nameMap), self._max)
+
+    def setup_sdd_manager(self, program):
+        with phase('cnf'):
+            return CounterfactualProgram.setup_sdd_manager(self, program)
+
+    def circuit_size(self):
+        """Size of the SDDs compiled so far (pysdd), or None."""
+        return self._sdd_manager.size() if self._sdd_manager is not None else None
+
+    def _build_twin(self, intervened):
+        # Derived atoms that depend on the intervened predicate
+        children = {}
+        for rule in self._program:
+            for atom in rule.body:
+                children.setdefault(abs(atom), set()).update(rule.head)
+        stack = [var for var in self._deriv if self._external_name(var).split("(", 1)[0] == intervened]
+        twinned = set()
+        while stack:
+            var = stack.pop()
+            if var not in twinned:
+                twinned.add(var)
+                stack.extend(children.get(var, ()))
+
+        # Evidence on a merged atom constrains its only copy
+        self.intervention_atoms = {self._external_name(var): var for var in self._deriv}
+        self.evidence_atoms = {name: var for name, var in self.intervention_atoms.items() if var not in twinned}
+
+        def to_external(atom):
+            cur_name = self._external_name(atom)
+            if cur_name not in self.evidence_atoms:
+                idx = cur_name.find("(")
+                if idx == -1:
+                    idx = len(cur_name)
+                new_var = self._new_var(cur_name[:idx] + "_e" + cur_name[idx:])
+                self.evidence_atoms[cur_name] = new_var
+                self._deriv.add(new_var)
+            return self.evidence_atoms[cur_name]
+
+        new_program = []
+        for rule in self._program:
+            new_program.append(rule)
+            if not any(abs(atom) in twinned for atom in rule.head + rule.body):
+                continue
+            new_head = [to_external(atom) for atom in rule.head]
+            new_body = []
+            for atom in rule.body:
+                if abs(atom) not in twinned:
+                    new_body.append(atom)
+                elif atom > 0:
+                    new_body.append(to_external(atom))
+                else:
+                    new_body.append(-to_external(-atom))
+            new_program.append(Rule(new_head, new_body))
+
+        # Only the duplicated atoms get an intervention-world name
+        for original_name, atom in self.intervention_atoms.items():
+            if atom in twinned:
+                idx = original_name.find("(")
+                if idx == -1:
+                    idx = len(original_name)
+                self._nameMap[atom] = original_name[:idx] + "_i" + original_name[idx:]
+
+        self.true = self._new_var("true")
+        self._deriv.add(self.true)
+        new_program.append(Rule([self.true], []))
+
+        self._program = new_program
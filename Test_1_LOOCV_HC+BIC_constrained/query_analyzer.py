@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Static analysis of counterfactual queries.
+
+Some queries P(latent_collision | evidence, do(action = iaction)) are fixed by
+the program graph alone and need no inference:
+
+- missing_action: iaction is not an action of the program; by convention
+  the probability is 1.0.
+- same_action: iaction is the observed action, so the counterfactual world
+  is the factual one and latent_collision keeps its observed value.
+- not_descendant: latent_collision is not a descendant of action in the DAG
+  of the program (the graph of cBN_i.dot), so no intervention changes it.
+- impossible_evidence: the observed action is not an action of the program,
+  so the evidence has probability zero and there is no counterfactual; the
+  probability is NaN.
+
+Every other query is answered by the twin network, the knowledge compiler or,
+for knowledge compiler answers of earlier runs, the result store
+(result_store.py); the answered_by column of twin_networks_results.csv tells
+which one it was.
+Inference can find other zero-probability evidence; those queries are tagged
+impossible_evidence as well.
+"""
+
+import numpy as np
+from twin_network import load_cbn, QUERY_ATOM, INTERVENED_ATOM
+
+ANSWER_MISSING_ACTION = "missing_action"
+ANSWER_SAME_ACTION = "same_action"
+ANSWER_NOT_DESCENDANT = "not_descendant"
+ANSWER_TWIN_NETWORK = "twin_network"
+ANSWER_COMPILER = "knowledge_compiler"
+ANSWER_STORED = "result_store"
+ANSWER_IMPOSSIBLE = "impossible_evidence"
+
+
+class QueryAnalyzer:
+    """Answers the queries of one program that its graph alone determines."""
+
+    def __init__(self, actions, model=None):
+        self.actions = list(actions)
+        # Without a parsed model the graph is unknown and assumed to connect them
+        self.query_depends = model is None or QUERY_ATOM in model.descendants(INTERVENED_ATOM)
+
+    @classmethod
+    def from_program(cls, input_cbn, actions):
+        """Builds the analyzer of a cBN_i.pl program whose actions are given."""
+        try:
+            model = load_cbn(input_cbn)
+        except (OSError, ValueError):
+            model = None
+        return cls(actions, model)
+
+    def answer_batch(self, action, latent_collision, iaction):
+        """
+        Vectorized answer(): takes arrays of CSV values and returns
+        (probabilities, tags) with NaN and None for the queries that need
+        inference.
+        """
+        action, iaction = np.asarray(action), np.asarray(iaction)
+        observed = (np.asarray(latent_collision) == "True").astype(float)
+        probs = np.full(len(iaction), np.nan)
+        tags = np.full(len(iaction), None, dtype=object)
+
+        unchanged = np.full(len(iaction), not self.query_depends)
+        tags[unchanged] = ANSWER_NOT_DESCENDANT
+        same = ~unchanged & (action == iaction)
+        tags[same] = ANSWER_SAME_ACTION
+        unchanged |= same
+        probs[unchanged] = observed[unchanged]
+
+        impossible = ~np.isin(action, self.actions)
+        probs[impossible] = np.nan
+        tags[impossible] = ANSWER_IMPOSSIBLE
+
+        missing = ~np.isin(iaction, self.actions)
+        probs[missing] = 1.0
+        tags[missing] = ANSWER_MISSING_ACTION
+        return probs, tags
+
+    def answer(self, row):
+        """Returns (probability, tag) for a test row (dict of CSV values), or None if it needs inference."""
+        probs, tags = self.answer_batch([row['action']], [row['latent_collision']], [row['iaction']])
+        if tags[0] is None:
+            return None
+        return float(probs[0]), tags[0]
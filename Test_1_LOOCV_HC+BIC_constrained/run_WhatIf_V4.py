@@ -1,93 +1,442 @@
 #!/usr/bin/env python3
 import csv
 import time
-from counterfactuals.counterfactualprogram import CounterfactualProgram
-import aspmc.config as config
-from aspmc.main import logger as aspmc_logger
+import tempfile
 import re
 import os
+from contextlib import contextmanager
+import numpy as np
+from twin_network import (parse_cbn, CompiledTwinNetwork, TwinNetworkStructure, stack_tables,
+                           QUERY_ATOM, INTERVENED_ATOM)
+import circuit_cache
+from program_slicer import slice_program
+from query_analyzer import QueryAnalyzer, ANSWER_TWIN_NETWORK, ANSWER_COMPILER, ANSWER_STORED, ANSWER_IMPOSSIBLE
+from query_profile import phase, QueryTimer, static_record
+from variables import EVIDENCE_KEYS, RESULT_KEYS, ACTIONS_LIST
 
-def run_whatif(input_csv, input_cbn, models_subdir, output_actions_found, fold):
+# Query/evidence/intervention signature of the cache and result store keys
+QUERY_SIGNATURE = [QUERY_ATOM, INTERVENED_ATOM] + EVIDENCE_KEYS
+
+# Strategy used to answer queries: a knowledge compiler passed to aspmc as
+# config.config["knowledge_compiler"], or NATIVE_STRATEGY for exact inference
+# in NumPy over the program's CPTs (twin_network), without aspmc at all
+# sharpsat-td is the compiler of the committed results; test_cBNs.py --strategy
+# pysdd answers from an in-process circuit instead (much faster, but
+# elapsed_time then no longer times sharpsat-td)
+KNOWLEDGE_COMPILER = "sharpsat-td"
+NATIVE_STRATEGY = "numpy"
+# Compilers that run inside this process: the program is compiled once and
+# every query re-uses the circuit (multi_query). The others (sharpsat-td,
+# d4, c2d, miniC2D) are external binaries spawned by every single_query.
+PERSISTENT_COMPILERS = ["pysdd"]
+# aspmc writes the CNF files of the external compilers through tempfile; they
+# go to a scratch directory in RAM (see scratch_dir) when there is one
+RAM_TEMP_ROOT = "/dev/shm"
+
+def load_aspmc(strategy):
+    """
+    Imports the aspmc toolchain, which is only needed when single_query is
+    used, configures it for strategy and returns the counterfactual program
+    class (MergedCounterfactualProgram, see merged_program).
+    """
+    from merged_program import MergedCounterfactualProgram
+    import aspmc.config as config
+    from aspmc.main import logger as aspmc_logger
+    config.config["knowledge_compiler"] = strategy
+    aspmc_logger.setLevel("ERROR")
+    return MergedCounterfactualProgram
+
+@contextmanager
+def scratch_dir(strategy):
+    """
+    While the with block runs, points tempfile at a fresh directory under
+    RAM_TEMP_ROOT for the CNF files of an external compiler; the directory
+    and whatever aspmc left in it are removed afterwards.
+    """
+    if strategy in PERSISTENT_COMPILERS or not os.path.isdir(RAM_TEMP_ROOT):
+        yield
+        return
+    previous = tempfile.tempdir
+    with tempfile.TemporaryDirectory(dir=RAM_TEMP_ROOT, prefix="counterfactuals_") as path:
+        tempfile.tempdir = path
+        try:
+            yield
+        finally:
+            tempfile.tempdir = previous
+
+def read_actions(input_cbn):
+    """Returns the actions mentioned in a cBN program."""
+    with open(input_cbn, 'r') as file:
+        content = file.read()
+    actions_found = [a for a in ACTIONS_LIST if re.search(rf"{a}", content)]
+    return list(set(actions_found))
+
+def program_fingerprint(input_cbn):
+    """Returns the content fingerprint of a cBN program used by the result store."""
+    with open(input_cbn, 'r') as file:
+        return circuit_cache.cache_key(file.read(), QUERY_SIGNATURE)
+
+def make_evidence(row):
+    """
+    Builds the single_query evidence dict (atom -> phase) for a test row;
+    phase False means the atom was observed true. The observed action is
+    evidence that action(<value>) is true.
+    """
+    evidence = {}
+    for key in EVIDENCE_KEYS:
+        value = row[key]
+        if key == 'action':
+            evidence[f'action({value})'] = False
+        else:
+            evidence[key] = False if value == "True" else True
+    return evidence
+
+def make_interventions(actions, iaction):
+    """Builds the single_query interventions dict setting action to iaction."""
+    return {f'action({a})': (False if a == iaction else True) for a in actions}
+
+# Compiled structures of this process, by parametric cache key
+_structures = {}
+
+def compile_structure(content, model, use_cache=True):
+    """
+    Returns the parametric twin network structure of a program. Structures are
+    compiled once per distinct DAG structure (program text with probabilities
+    masked) and shared through memory and the on-disk circuit cache.
+    """
+    key = circuit_cache.cache_key(content, QUERY_SIGNATURE, parametric=True)
+    structure = _structures.get(key)
+    if structure is None and use_cache:
+        structure = circuit_cache.load_circuit(key)
+    if structure is None or not structure.matches(model):
+        structure = TwinNetworkStructure(model)
+        if use_cache:
+            circuit_cache.store_circuit(key, structure)
+    _structures[key] = structure
+    return structure
+
+def compile_cbn(input_cbn, use_cache=True):
+    """
+    Compiles the twin network of a cBN program once so that every query of the
+    fold is answered from it: the structure comes from compile_structure and
+    only the program's probabilities are plugged in. Returns None if the
+    program cannot be compiled; run_whatif then falls back to the knowledge
+    compiler.
+    """
+    try:
+        with phase('parse'):
+            with open(input_cbn, 'r') as file:
+                content = file.read()
+            model = parse_cbn(content)
+        with phase('twin'):
+            return CompiledTwinNetwork(model, structure=compile_structure(content, model, use_cache))
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not compile {input_cbn} ({e}), using the knowledge compiler")
+        return None
+
+def lazy_program(input_cbn, strategy=KNOWLEDGE_COMPILER):
+    """
+    Returns a callable that loads the CounterfactualProgram of input_cbn on
+    first use. The program is sliced to the clauses relevant to the queries
+    (see program_slicer) before aspmc grounds and compiles it.
+    """
+    loaded = []
+    def program():
+        if not loaded:
+            CounterfactualProgram = load_aspmc(strategy)
+            with phase('parse'):
+                with open(input_cbn, 'r') as file:
+                    sliced = slice_program(file.read(), EVIDENCE_KEYS)
+            loaded.append(CounterfactualProgram(sliced, []))
+        return loaded[0]
+    program.loaded = loaded
+    return program
+
+def stored_single_query(program, actions, row, result_store=None, fingerprint=None, strategy=KNOWLEDGE_COMPILER):
+    """
+    Answers one test row with the knowledge compiler, going through
+    result_store (a ResultStore) when given. program is a zero-argument
+    callable returning the loaded CounterfactualProgram, so it is only loaded
+    on a store miss. PERSISTENT_COMPILERS answer with multi_query, which
+    compiles the program on the first query and keeps the circuit.
+    Returns (probability, elapsed_time, stored); for stored results
+    elapsed_time is the time of the lookup, not of the original query.
+    """
+    iaction = row['iaction']
+    evidence_values = [row[key] for key in EVIDENCE_KEYS]
+    start_time = time.time()
+    if result_store is not None:
+        stored = result_store.get(fingerprint, strategy, evidence_values, iaction)
+        if stored is not None:
+            return stored[0], time.time() - start_time, True
+
+    loaded = program()
+    query = loaded.multi_query if strategy in PERSISTENT_COMPILERS else loaded.single_query
+    # Once a persistent compiler has its circuit, a query only evaluates it
+    evaluating = strategy in PERSISTENT_COMPILERS and loaded.circuit_size() is not None
+    with phase('evaluate' if evaluating else 'compile'), scratch_dir(strategy):
+        output_query = query(make_interventions(actions, iaction), make_evidence(row), ["latent_collision"],
+                             strategy=strategy)
+    prob = float(output_query[0])
+    elapsed_time = time.time() - start_time
+
+    # Zero-probability evidence has no answer to store
+    if result_store is not None and not np.isnan(prob):
+        result_store.put(fingerprint, strategy, evidence_values, iaction, prob, elapsed_time)
+    return prob, elapsed_time, False
+
+def native_query_rows(compiled, rows):
+    """
+    Answers test rows with the native backend in one vectorized sweep.
+    Queries it cannot answer (zero-probability evidence) have no
+    counterfactual and are left NaN. Returns (probabilities, elapsed_time per
+    row).
+    """
+    start_time = time.time()
+    evidence = {key: np.array([row[key] for row in rows]) for key in EVIDENCE_KEYS}
+    with phase('evaluate'):
+        probs = compiled.query_batch(evidence, np.array([row['iaction'] for row in rows]))
+    end_time = time.time()
+    return probs.tolist(), (end_time - start_time) / max(len(rows), 1)
+
+def report_impossible(count):
+    """Warns about queries left without a probability because their evidence is impossible."""
+    if count:
+        print(f"Warning: {int(count)} queries with impossible evidence, probability left as NaN")
+
+def run_whatif(input_csv, input_cbn, models_subdir, output_actions_found, fold, compile_once=False,
+               result_store=None, strategy=None, profile=None):
     """
     Runs all counterfactual queries in a single fold and returns a list of results.
     Each result is a tuple:
     (action, curr_lane, free_E, free_NE, free_NW, free_SE, free_SW, free_W,
-     orig_label_lc, latent_collision, iaction, probability, elapsed_time, fold)
+     orig_label_lc, latent_collision, iaction, probability, elapsed_time, fold,
+     answered_by)
+    Queries fixed by the program graph are answered by a QueryAnalyzer and
+    tagged accordingly (see query_analyzer); they take no time and are left
+    out of the returned elapsed times. Queries with zero-probability evidence
+    get probability NaN and the tag ANSWER_IMPOSSIBLE.
+    With compile_once=True the twin network is compiled once for the fold and
+    every query is evaluated against it; queries it cannot answer (e.g. an
+    observed action missing from the program) still go through single_query.
+    With a result_store (a ResultStore) single_query results are looked up
+    before and written back after each query; stored answers are tagged
+    ANSWER_STORED and take the time of the lookup. strategy defaults to
+    KNOWLEDGE_COMPILER; NATIVE_STRATEGY answers the whole fold from the
+    program's lookup table if there is one, otherwise in one NumPy sweep, and
+    never touches aspmc.
+    If profile is a list, a query_profile record per test row is appended to
+    it, in row order.
     """
+    strategy = strategy or KNOWLEDGE_COMPILER
+
     # Load actions
-    actions_list = ["change_to_left", "change_to_right", "cruise", "keep", "swerve_left", "swerve_right"]
     actions = []
 
     try:
-        with open(input_cbn, 'r') as file:
-            content = file.read()
-            actions_found = [a for a in actions_list if re.search(rf"{a}", content)]
-            actions = list(set(actions_found))
-            with open(output_actions_found, "a") as f:
-                f.write(str(actions) + "\n")
+        actions = read_actions(input_cbn)
+        with open(output_actions_found, "a") as f:
+            f.write(str(actions) + "\n")
     except FileNotFoundError:
         print(f"Warning: Could not read file {input_cbn}, using default actions only")
 
-    # Generate truth tuples
-    iaction_truth = []
-    for i in range(len(actions)):
-        truth_values = ['False'] * len(actions)
-        truth_values[i] = 'True'
-        iaction_truth.append(tuple(truth_values))
-
-    # Load the ProbLog program
-    program = CounterfactualProgram("", [input_cbn])
-    config.config["knowledge_compiler"] = "sharpsat-td"
-    aspmc_logger.setLevel("ERROR")
+    analyzer = QueryAnalyzer.from_program(input_cbn, actions)
+    with open(input_csv, newline='') as f:
+        rows = list(csv.DictReader(f))
+    answers = {}
+    for row in rows:
+        static = analyzer.answer(row)
+        if static is not None:
+            answers[id(row)] = (static[0], 0.0, static[1])
+    report_impossible(sum(answer[2] == ANSWER_IMPOSSIBLE for answer in answers.values()))
+    queried = [row for row in rows if id(row) not in answers]
 
-    results = []
     elapsed_times = []
+    records = {}
+    if strategy == NATIVE_STRATEGY:
+        from lookup_table import load_lookup_table, lookup_rows
 
-    with open(input_csv, newline='') as f:
-        reader = csv.DictReader(f)
-        for row_num, row in enumerate(reader, start=1):
-            # Evidence
-            evidence = {}
-            for key in ['action', 'curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W', 'latent_collision']:
-                value = row[key]
-                phase = False if value == "True" else True
-                if key == 'action':
-                    evidence[f'action({value})'] = phase
-                else:
-                    evidence[key] = phase
-
-            # Interventions
-            iaction = row['iaction']
-            try:
-                action_idx = actions.index(iaction)
-            except ValueError:
-                prob = 1.0
-                elapsed_time = 0.0
-                results.append(tuple([
-                    row['action'], row['curr_lane'], row['free_E'], row['free_NE'], row['free_NW'],
-                    row['free_SE'], row['free_SW'], row['free_W'], row['orig_label_lc'], row['latent_collision'],
-                    iaction, prob, elapsed_time, fold
-                ]))
-                continue
-
-            interventions = {f'action({a})': (False if v == "True" else True)
-                             for a, v in zip(actions, iaction_truth[action_idx])}
+        # A precomputed lookup table (lookup_table.py) answers by indexing;
+        # rows it does not cover go through the twin network
+        start_time = time.time()
+        with QueryTimer() as timer:
+            compiled = None
+            with phase('parse'):
+                table = load_lookup_table(input_cbn)
+            with phase('evaluate'):
+                probs = lookup_rows(table, queried) if table is not None and queried else np.full(len(queried), np.nan)
+            missing = np.flatnonzero(np.isnan(probs))
+            if len(missing):
+                compiled = compile_cbn(input_cbn)
+                if compiled is None:
+                    raise RuntimeError(f"The {NATIVE_STRATEGY} strategy cannot handle {input_cbn}")
+                probs[missing], _ = native_query_rows(compiled, [queried[r] for r in missing])
+        elapsed_time = (time.time() - start_time) / max(len(queried), 1)
+        if compiled is not None:
+            circuit_size = compiled.structure.assignments.size
+        else:
+            circuit_size = table.size if table is not None else None
+        report_impossible(np.isnan(probs).sum())
+        for row, prob in zip(queried, probs.tolist()):
+            answered_by = ANSWER_IMPOSSIBLE if np.isnan(prob) else ANSWER_TWIN_NETWORK
+            answers[id(row)] = (prob, elapsed_time, answered_by)
+            elapsed_times.append(elapsed_time)
+            records[id(row)] = timer.record(row, fold, answered_by, circuit_size, share=len(queried))
+    elif queried:
+        # Load the ProbLog program only once a query needs it
+        with QueryTimer() as setup:
+            compiled = compile_cbn(input_cbn) if compile_once else None
+            program = lazy_program(input_cbn, strategy)
+            if compiled is None and result_store is None:
+                program()
+            fingerprint = program_fingerprint(input_cbn) if result_store is not None else None
 
+        for row in queried:
             # Query
-            queries = ["latent_collision"]
-            start_time = time.time()
-            output_query = program.single_query(interventions, evidence, queries, strategy=config.config["knowledge_compiler"])
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            prob = float(output_query[0])
+            prob = None
+            answered_by = ANSWER_TWIN_NETWORK
+            with QueryTimer() as timer:
+                if compiled is not None:
+                    start_time = time.time()
+                    with phase('evaluate'):
+                        prob = compiled.query({key: row[key] for key in EVIDENCE_KEYS}, row['iaction'])
+                    end_time = time.time()
+                    elapsed_time = end_time - start_time
+                if prob is None:
+                    prob, elapsed_time, stored = stored_single_query(program, actions, row, result_store,
+                                                                     fingerprint, strategy)
+                    if np.isnan(prob):
+                        answered_by = ANSWER_IMPOSSIBLE
+                    else:
+                        answered_by = ANSWER_STORED if stored else ANSWER_COMPILER
 
             elapsed_times.append(elapsed_time)
+            answers[id(row)] = (prob, elapsed_time, answered_by)
+            if answered_by == ANSWER_TWIN_NETWORK:
+                circuit_size = compiled.structure.assignments.size
+            elif answered_by == ANSWER_COMPILER:
+                circuit_size = program.loaded[0].circuit_size() if program.loaded else None
+            elif answered_by == ANSWER_STORED:
+                circuit_size = None
+            else:
+                report_impossible(1)
+                circuit_size = None
+            # One-off set-up is charged to the first query
+            if setup is not None:
+                timer.absorb(setup)
+                setup = None
+            records[id(row)] = timer.record(row, fold, answered_by, circuit_size)
 
-            results.append(tuple([
-                row['action'], row['curr_lane'], row['free_E'], row['free_NE'], row['free_NW'],
-                row['free_SE'], row['free_SW'], row['free_W'], row['orig_label_lc'], row['latent_collision'],
-                iaction, prob, elapsed_time, fold
-            ]))
+    if profile is not None:
+        for row in rows:
+            profile.append(records.get(id(row)) or static_record(row, fold, answers[id(row)][2]))
 
+    results = []
+    for row in rows:
+        prob, elapsed_time, answered_by = answers[id(row)]
+        results.append(tuple([row[key] for key in RESULT_KEYS] + [prob, elapsed_time, fold, answered_by]))
     return results, elapsed_times
 
+
+def load_query_table(input_csvs):
+    """
+    Reads test_fold_<i>.csv files into a query table for run_whatif_batch:
+    a dict of NumPy arrays keyed by CSV column (RESULT_KEYS) plus 'fold',
+    one entry per query. input_csvs maps fold -> test CSV path.
+    """
+    table = {key: [] for key in ['fold'] + RESULT_KEYS}
+    for fold, input_csv in input_csvs.items():
+        with open(input_csv, newline='') as f:
+            for row in csv.DictReader(f):
+                table['fold'].append(fold)
+                for key in RESULT_KEYS:
+                    table[key].append(row[key])
+    return {key: np.array(values) for key, values in table.items()}
+
+def run_whatif_batch(programs, queries, result_store=None, strategy=None):
+    """
+    Runs a whole query table (e.g. every fold of a rep/percentage) with
+    vectorized sweeps instead of one call per row. Folds whose programs share
+    a DAG structure are evaluated together in one sweep over their stacked
+    weight tables. programs maps fold -> cBN_i.pl path and queries is a table
+    built by load_query_table. Returns (results, elapsed_times) like
+    run_whatif, in query-table order; the elapsed time of a query is its
+    share of the compile and sweep time of its structure group. Rows left
+    to single_query go through result_store like in run_whatif; with
+    NATIVE_STRATEGY no row is left to single_query.
+    """
+    strategy = strategy or KNOWLEDGE_COMPILER
+
+    num_queries = len(queries['fold'])
+    probs = np.full(num_queries, np.nan)
+    elapsed = np.zeros(num_queries)
+    answered = np.zeros(num_queries, dtype=bool)
+    tags = np.full(num_queries, ANSWER_TWIN_NETWORK, dtype=object)
+
+    # Group the folds by compiled structure
+    groups = {}
+    for fold, input_cbn in programs.items():
+        rows = np.flatnonzero(queries['fold'] == fold)
+        if len(rows) == 0:
+            continue
+        start_time = time.time()
+        compiled = compile_cbn(input_cbn)
+        actions = compiled.actions if compiled is not None else read_actions(input_cbn)
+
+        # Queries fixed by the program graph need no sweep
+        static_probs, static_tags = QueryAnalyzer.from_program(input_cbn, actions).answer_batch(
+            queries['action'][rows], queries['latent_collision'][rows], queries['iaction'][rows])
+        static = np.array([tag is not None for tag in static_tags], dtype=bool)
+        report_impossible(np.sum(static_tags == ANSWER_IMPOSSIBLE))
+        probs[rows[static]] = static_probs[static]
+        tags[rows[static]] = static_tags[static]
+        rows = rows[~static]
+
+        group_key = id(compiled.structure) if compiled is not None else ('fold', fold)
+        group = groups.setdefault(group_key, {'compiled': [], 'rows': [], 'programs': [], 'time': 0.0})
+        group['compiled'].append(compiled)
+        group['rows'].append(rows)
+        group['programs'].append((input_cbn, actions))
+        group['time'] += time.time() - start_time
+
+    for group in groups.values():
+        start_time = time.time()
+        rows = np.concatenate(group['rows'])
+        if len(rows) == 0:
+            continue
+        structure = group['compiled'][0].structure if group['compiled'][0] is not None else None
+        if structure is not None:
+            tables = stack_tables([c.tables for c in group['compiled']])
+            program_index = np.concatenate([np.full(len(r), i) for i, r in enumerate(group['rows'])])
+            evidence = {key: queries[key][rows] for key in EVIDENCE_KEYS}
+            probs[rows] = structure.query_batch(tables, evidence, queries['iaction'][rows], program_index)
+
+        for (input_cbn, actions), fold_rows in zip(group['programs'], group['rows']):
+            pending = fold_rows[np.isnan(probs[fold_rows])]
+            if len(pending) == 0:
+                continue
+            if strategy == NATIVE_STRATEGY:
+                if structure is None:
+                    raise RuntimeError(f"The {NATIVE_STRATEGY} strategy cannot handle {input_cbn}")
+                report_impossible(len(pending))
+                tags[pending] = ANSWER_IMPOSSIBLE
+                continue
+            program = lazy_program(input_cbn, strategy)
+            fingerprint = program_fingerprint(input_cbn) if result_store is not None else None
+            for r in pending:
+                row = {key: str(queries[key][r]) for key in RESULT_KEYS}
+                probs[r], _, stored = stored_single_query(program, actions, row, result_store, fingerprint, strategy)
+                tags[r] = ANSWER_STORED if stored else ANSWER_COMPILER
+            impossible = pending[np.isnan(probs[pending])]
+            report_impossible(len(impossible))
+            tags[impossible] = ANSWER_IMPOSSIBLE
+        end_time = time.time()
+
+        elapsed[rows] = (group['time'] + end_time - start_time) / len(rows)
+        answered[rows] = True
+
+    results = []
+    for r in range(num_queries):
+        results.append(tuple([str(queries[key][r]) for key in RESULT_KEYS] +
+                             [float(probs[r]), float(elapsed[r]), int(queries['fold'][r]), tags[r]]))
+    return results, elapsed[answered].tolist()
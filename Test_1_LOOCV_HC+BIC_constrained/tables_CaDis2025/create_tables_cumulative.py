@@ -1,9 +1,9 @@
 import os
-import re
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import defaultdict
 import statistics
+from contingency_data import load_contingency, JSON_NAME
 
 # Configuration
 percentages = ['01', '25', '50', '75', '90']
@@ -27,12 +27,6 @@ all_crash_safety_data = []
 all_no_crash_transition_counts = []
 all_final_summary = []
 
-def safe_int_convert(value_str):
-    try:
-        return int(value_str.strip())
-    except:
-        return 0
-
 # Track missing files
 missing_files = []
 
@@ -53,97 +47,48 @@ for base_dir in base_dirs:
 
     # Process files for this repetition
     for p in percentages:
-        file_name = "contingency_table.txt"
         dir_path = os.path.join(base_dir, p, 'cBNs')
-        file_path = os.path.join(dir_path, file_name)
-
-        # Check file existence
-        if not os.path.exists(file_path):
-            print(f"Warning: Missing file {file_path}")
-            missing_files.append(file_path)
-            continue
 
+        # Counts from contingency.json (or from the text report of older runs)
         try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-                sections = re.split(r'=== (CRASH SECTION|NO CRASH SECTION|FINAL SUMMARY) ===', content)
-                sections = [s.strip() for s in sections if s.strip()]
-
-                # ----------- CRASH SECTION -----------
-                if len(sections) > 1 and 'CRASH SECTION' in sections[0]:
-                    crash_content = sections[1]
-                    for j in range(6):
-                        match = re.search(rf'Number of groups with exactly\s+{j+1}\s+best interventions:\s+(\d+)', crash_content)
-                        if match:
-                            crash_ties_data[p][j] += safe_int_convert(match.group(1))
-
-                    action_block_match = re.search(
-                        r'Number of actions selected for each intervention type:(.*?)Total safe/unsafe actions:',
-                        crash_content, re.DOTALL)
-                    if action_block_match:
-                        action_block = action_block_match.group(1)
-                        for line in action_block.split('\n'):
-                            if ':' in line:
-                                for action in valid_actions:
-                                    if action in line:
-                                        nums = re.findall(r'\d+', line)
-                                        if len(nums) >= 3:
-                                            crash_actions_data[p][action] += safe_int_convert(nums[0])
-                                            crash_action_safety_data[p][action] += safe_int_convert(nums[1])
-
-                    safe_match = re.search(r'True -> False:\s+(\d+)', crash_content)
-                    if safe_match:
-                        crash_safety_data[p]['Safe'] += safe_int_convert(safe_match.group(1))
-                    unsafe_match = re.search(r'True -> True:\s+(\d+)', crash_content)
-                    if unsafe_match:
-                        crash_safety_data[p]['Unsafe'] += safe_int_convert(unsafe_match.group(1))
-
-                # ----------- NO CRASH SECTION -----------
-                if len(sections) > 3 and 'NO CRASH SECTION' in sections[2]:
-                    no_crash_content = sections[3]
-                    for j in range(6):
-                        match = re.search(rf'Number of groups with exactly\s+{j+1}\s+best interventions:\s+(\d+)', no_crash_content)
-                        if match:
-                            no_crash_ties_data[p][j] += safe_int_convert(match.group(1))
-
-                    action_block_match = re.search(
-                        r'Number of actions selected for each intervention type:(.*?)Total safe/unsafe actions:',
-                        no_crash_content, re.DOTALL)
-                    if action_block_match:
-                        action_block = action_block_match.group(1)
-                        for line in action_block.split('\n'):
-                            if ':' in line:
-                                for action in valid_actions:
-                                    if action in line:
-                                        nums = re.findall(r'\d+', line)
-                                        if len(nums) >= 3:
-                                            no_crash_actions_data[p][action] += safe_int_convert(nums[0])
-                                            no_crash_action_safety_data[p][action] += safe_int_convert(nums[1])
-
-                    safe_match = re.search(r'False -> False:\s+(\d+)', no_crash_content)
-                    if safe_match:
-                        no_crash_transition_counts[p]['False_False'] += safe_int_convert(safe_match.group(1))
-                    unsafe_match = re.search(r'False -> True:\s+(\d+)', no_crash_content)
-                    if unsafe_match:
-                        no_crash_transition_counts[p]['False_True'] += safe_int_convert(unsafe_match.group(1))
-
-                # ----------- FINAL SUMMARY -----------
-                if len(sections) > 5 and 'FINAL SUMMARY' in sections[4]:
-                    summary_content = sections[5]
-                    patterns = {
-                        'True_True': r'Crash before \(True\) and after intervention \(True\):\s+(\d+)',
-                        'True_False': r'Crash before \(True\) and after intervention \(False\):\s+(\d+)',
-                        'False_True': r'Crash before \(False\) and after intervention \(True\):\s+(\d+)',
-                        'False_False': r'Crash before \(False\) and after intervention \(False\):\s+(\d+)',
-                    }
-                    for key, pattern in patterns.items():
-                        match = re.search(pattern, summary_content)
-                        if match:
-                            final_summary[key] += safe_int_convert(match.group(1))
-
+            data = load_contingency(dir_path)
         except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+            print(f"Error processing {dir_path}: {e}")
+            continue
+        if data is None:
+            file_path = os.path.join(dir_path, JSON_NAME)
+            print(f"Warning: Missing file {file_path}")
+            missing_files.append(file_path)
             continue
+        sections = data['sections']
+
+        # ----------- CRASH SECTION -----------
+        if 'crash' in sections:
+            crash = sections['crash']
+            for j in range(6):
+                crash_ties_data[p][j] += crash['ties'][j]
+            for action, counts in crash['actions'].items():
+                if action in valid_actions:
+                    crash_actions_data[p][action] += counts['selected']
+                    crash_action_safety_data[p][action] += counts['safe']
+            crash_safety_data[p]['Safe'] += crash['transitions']['True_False']['rows']
+            crash_safety_data[p]['Unsafe'] += crash['transitions']['True_True']['rows']
+
+        # ----------- NO CRASH SECTION -----------
+        if 'no_crash' in sections:
+            no_crash = sections['no_crash']
+            for j in range(6):
+                no_crash_ties_data[p][j] += no_crash['ties'][j]
+            for action, counts in no_crash['actions'].items():
+                if action in valid_actions:
+                    no_crash_actions_data[p][action] += counts['selected']
+                    no_crash_action_safety_data[p][action] += counts['safe']
+            no_crash_transition_counts[p]['False_False'] += no_crash['transitions']['False_False']['rows']
+            no_crash_transition_counts[p]['False_True'] += no_crash['transitions']['False_True']['rows']
+
+        # ----------- FINAL SUMMARY -----------
+        for key in final_summary:
+            final_summary[key] += data['final_summary'].get(key, 0)
 
     # Store data for this repetition
     all_crash_ties_data.append(crash_ties_data)
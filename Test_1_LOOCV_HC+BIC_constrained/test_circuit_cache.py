@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""On-disk circuit cache: keys, hits, misses and LRU eviction."""
+
+import os
+import time
+from functools import partial
+
+import circuit_cache
+import run_WhatIf_V4
+from circuit_cache import cache_key, load_circuit, store_circuit, _entry_path
+from twin_network import parse_cbn, TwinNetworkStructure
+from test_twin_network import PROGRAM
+
+SIGNATURE = ('latent_collision', 'action')
+
+
+def test_keys_ignore_formatting_and_mask_probabilities():
+    reformatted = "% comment\n" + PROGRAM.replace("0.4::u1.", "0.40::u1.   ")
+    assert cache_key(reformatted, SIGNATURE) == cache_key(PROGRAM, SIGNATURE)
+    other = PROGRAM.replace("0.4::u1.", "0.5::u1.")
+    assert cache_key(other, SIGNATURE) != cache_key(PROGRAM, SIGNATURE)
+    assert cache_key(other, SIGNATURE, parametric=True) == cache_key(PROGRAM, SIGNATURE, parametric=True)
+    assert cache_key(PROGRAM, SIGNATURE[:1]) != cache_key(PROGRAM, SIGNATURE)
+
+
+def test_miss_then_hit(tmp_path):
+    key = cache_key(PROGRAM, SIGNATURE, parametric=True)
+    assert load_circuit(key, cache_dir=str(tmp_path)) is None
+    structure = TwinNetworkStructure(parse_cbn(PROGRAM))
+    store_circuit(key, structure, cache_dir=str(tmp_path))
+    cached = load_circuit(key, cache_dir=str(tmp_path))
+    assert cached is not structure
+    assert cached.matches(parse_cbn(PROGRAM))
+    assert (cached.assignments == structure.assignments).all()
+
+
+def test_unreadable_entry_is_discarded(tmp_path):
+    key = cache_key(PROGRAM, SIGNATURE)
+    path = _entry_path(key, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"not a pickle")
+    assert load_circuit(key, cache_dir=str(tmp_path)) is None
+    assert not os.path.exists(path)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    payload = b"x" * 1000
+    keys = [cache_key(PROGRAM, (str(i),)) for i in range(3)]
+    for age, key in zip([30, 20], keys):
+        store_circuit(key, payload, cache_dir=str(tmp_path), max_bytes=10 ** 6)
+        stamp = time.time() - age
+        os.utime(_entry_path(key, str(tmp_path)), (stamp, stamp))
+    # Reading the oldest entry makes it the most recently used
+    assert load_circuit(keys[0], cache_dir=str(tmp_path)) == payload
+    store_circuit(keys[2], payload, cache_dir=str(tmp_path), max_bytes=2500)
+    assert load_circuit(keys[1], cache_dir=str(tmp_path)) is None
+    assert load_circuit(keys[0], cache_dir=str(tmp_path)) == payload
+    assert load_circuit(keys[2], cache_dir=str(tmp_path)) == payload
+
+
+def test_compile_structure_goes_through_the_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(circuit_cache, 'load_circuit', partial(load_circuit, cache_dir=str(tmp_path)))
+    monkeypatch.setattr(circuit_cache, 'store_circuit', partial(store_circuit, cache_dir=str(tmp_path)))
+    monkeypatch.setattr(run_WhatIf_V4, '_structures', {})
+    model = parse_cbn(PROGRAM)
+    built = run_WhatIf_V4.compile_structure(PROGRAM, model)
+    key = cache_key(PROGRAM, run_WhatIf_V4.QUERY_SIGNATURE, parametric=True)
+    assert os.path.exists(_entry_path(key, str(tmp_path)))
+
+    # A new process finds the structure on disk instead of compiling it
+    monkeypatch.setattr(run_WhatIf_V4, '_structures', {})
+    def compile_again(*args, **kwargs):
+        raise AssertionError("compiled although the structure is cached")
+    monkeypatch.setattr(run_WhatIf_V4, 'TwinNetworkStructure', compile_again)
+    loaded = run_WhatIf_V4.compile_structure(PROGRAM.replace("0.4::u1.", "0.3::u1."), model)
+    assert loaded is not built and loaded.matches(model)
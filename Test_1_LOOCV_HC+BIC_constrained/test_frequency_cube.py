@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Frequency counts from the cube against a plain groupby of the CSV."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import frequency_cube
+from frequency_cube import load_cube, load_frequency_counts, cube_path, CUBE_SHAPE
+from variables import ACTIONS_LIST, STATE_KEYS
+from state_codec import encode
+
+GROUP_KEYS = ['action'] + STATE_KEYS
+
+
+def write_db(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({key: np.where(rng.random(n) < 0.3, "True", "False") for key in STATE_KEYS})
+    # Few actions and skewed states, so that most groups have several rows
+    df['action'] = rng.choice(ACTIONS_LIST[:3], n)
+    df['latent_collision'] = np.where(rng.random(n) < 0.1, "True", "False")
+    df['orig_label_lc'] = "False"
+    df.to_csv(path, index=False)
+    return df
+
+
+def test_counts_match_groupby(tmp_path, monkeypatch):
+    monkeypatch.setattr(frequency_cube, 'CHUNK_ROWS', 700)
+    csv_path = str(tmp_path / "complete_DB_discrete.csv")
+    df = write_db(csv_path, 5000)
+    counts = load_frequency_counts(csv_path)
+
+    expected = df.groupby(GROUP_KEYS).size()
+    assert (counts[encode(df)] == expected.loc[pd.MultiIndex.from_frame(df[GROUP_KEYS])].to_numpy()).all()
+    assert counts.sum() == len(df)
+
+    cube = load_cube(csv_path)
+    assert cube.shape == CUBE_SHAPE
+    collisions = (df['latent_collision'] == "True").groupby([df[k] for k in GROUP_KEYS]).transform('sum')
+    assert (cube.reshape(-1, 2)[encode(df).astype(np.int64), 1] == collisions.to_numpy()).all()
+
+
+def test_invalid_rows_are_not_counted(tmp_path):
+    csv_path = str(tmp_path / "complete_DB_discrete.csv")
+    df = write_db(csv_path, 200)
+    df.loc[0, 'action'] = 'fly'
+    df.loc[1, 'latent_collision'] = ''
+    df.to_csv(csv_path, index=False)
+    assert load_cube(csv_path).sum() == len(df) - 2
+
+
+def test_cube_is_rebuilt_when_the_csv_changes(tmp_path):
+    csv_path = str(tmp_path / "complete_DB_discrete.csv")
+    write_db(csv_path, 300)
+    assert load_cube(csv_path).sum() == 300
+    assert os.path.exists(cube_path(csv_path))
+    write_db(csv_path, 400, seed=1)
+    assert load_cube(csv_path).sum() == 400
+
+
+def test_missing_data(tmp_path):
+    assert load_frequency_counts(str(tmp_path / "missing.csv")) is None
+    csv_path = str(tmp_path / "no_actions.csv")
+    write_db(csv_path, 10).drop(columns=['action']).to_csv(csv_path, index=False)
+    assert load_frequency_counts(csv_path) is None
+
+
+def test_unchanged_csv_is_not_hashed(tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "complete_DB_discrete.csv")
+    write_db(csv_path, 300)
+    assert load_cube(csv_path).sum() == 300
+    def file_digest(path):
+        raise AssertionError("hashed an unchanged CSV")
+    monkeypatch.setattr(frequency_cube, 'file_digest', file_digest)
+    assert load_cube(csv_path).sum() == 300
+
+
+def test_touched_csv_is_hashed_but_not_recounted(tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "complete_DB_discrete.csv")
+    write_db(csv_path, 300)
+    load_cube(csv_path)
+    stamp = os.path.getmtime(csv_path) + 10
+    os.utime(csv_path, (stamp, stamp))
+    def build_cube(path):
+        raise AssertionError("recounted a CSV whose content did not change")
+    monkeypatch.setattr(frequency_cube, 'build_cube', build_cube)
+    assert load_cube(csv_path).sum() == 300
+    # The new mtime is saved, so the next load does not hash it again
+    monkeypatch.setattr(frequency_cube, 'file_digest', build_cube)
+    assert load_cube(csv_path).sum() == 300
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""The merged-twin program answers like CounterfactualProgram and the twin network."""
+
+from itertools import product
+
+import pytest
+
+pytest.importorskip("aspmc")
+pytest.importorskip("pysdd")
+counterfactualprogram = pytest.importorskip("counterfactuals.counterfactualprogram")
+
+import run_WhatIf_V4
+from twin_network import parse_cbn, CompiledTwinNetwork
+from test_program_slicer import PROGRAM, OBSERVED, ACTIONS
+
+STRATEGY = "pysdd"
+
+
+@pytest.fixture(scope="module")
+def programs():
+    MergedCounterfactualProgram = run_WhatIf_V4.load_aspmc(STRATEGY)
+    return (MergedCounterfactualProgram(PROGRAM, []),
+            counterfactualprogram.CounterfactualProgram(PROGRAM, []))
+
+
+def test_only_descendants_of_action_are_twinned(programs):
+    merged, plain = programs
+    for atom in ['free_NE', 'free_W', 'free_E']:
+        assert merged.evidence_atoms[atom] == merged.intervention_atoms[atom]
+    for atom in ['action(cruise)', 'action(keep)', 'brake', 'latent_collision']:
+        assert merged.evidence_atoms[atom] != merged.intervention_atoms[atom]
+    assert len(merged._deriv) < len(plain._deriv)
+
+
+def test_answers_match(programs):
+    merged, plain = programs
+    twin = CompiledTwinNetwork(parse_cbn(PROGRAM))
+    for values in product(['False', 'True'], ['False', 'True'], ACTIONS, ['False', 'True'], ['False', 'True']):
+        row = dict(zip(OBSERVED, values), free_E='True')
+        for iaction in ACTIONS:
+            interventions = run_WhatIf_V4.make_interventions(ACTIONS, iaction)
+            # The twin network conditions on the observed action being true
+            evidence = {key: row[key] != "True" for key in OBSERVED if key != 'action'}
+            evidence.update({'free_E': False, f"action({row['action']})": False})
+            expected = twin.query(row, iaction)
+            for program in (merged, plain):
+                prob = program.multi_query(interventions, evidence, ["latent_collision"], strategy=STRATEGY)[0]
+                assert float(prob) == pytest.approx(expected, abs=1e-9)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Round trips and edge cases of the bit-packed action/state keys."""
+
+import numpy as np
+import pandas as pd
+
+from variables import ACTIONS_LIST, STATE_KEYS
+from state_codec import STATE_BITS, KEY_SPACE, INVALID_KEY, encode, key_set, count_keys, missing_columns
+
+
+def random_frame(n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({key: np.where(rng.random(n) < 0.5, "True", "False") for key in STATE_KEYS})
+    df['action'] = rng.choice(ACTIONS_LIST, n)
+    return df
+
+
+def test_keys_decode_to_action_and_state():
+    df = random_frame(500)
+    keys = encode(df)
+    assert keys.dtype == np.uint16
+    assert (keys < KEY_SPACE).all() and (keys != INVALID_KEY).all()
+    actions = keys >> STATE_BITS
+    assert [ACTIONS_LIST[a] for a in actions] == df['action'].tolist()
+    for bit, key in enumerate(reversed(STATE_KEYS)):
+        assert ((keys >> bit) & 1 == 1).tolist() == (df[key] == "True").tolist()
+
+
+def test_keys_are_unique_per_pair():
+    df = random_frame(2000)
+    pairs = df[['action'] + STATE_KEYS].apply(tuple, axis=1)
+    keys = pd.Series(encode(df))
+    assert keys.groupby(pairs.to_numpy()).nunique().eq(1).all()
+    assert pairs.groupby(keys.to_numpy()).nunique().eq(1).all()
+
+
+def test_boolean_columns_match_strings():
+    df = random_frame(100)
+    typed = df.copy()
+    for key in STATE_KEYS:
+        typed[key] = typed[key] == "True"
+    assert (encode(typed) == encode(df)).all()
+
+
+def test_unknown_values_get_invalid_key():
+    df = random_frame(3)
+    df.loc[0, 'action'] = 'fly'
+    df.loc[1, STATE_KEYS[0]] = np.nan
+    keys = encode(df)
+    assert keys[0] == INVALID_KEY and keys[1] == INVALID_KEY and keys[2] != INVALID_KEY
+    assert not key_set(keys)[INVALID_KEY]
+    assert count_keys(keys)[INVALID_KEY] == 0
+
+
+def test_key_set_and_counts():
+    df = random_frame(1000, seed=1)
+    keys = encode(df)
+    assert np.flatnonzero(key_set(keys)).tolist() == sorted(set(keys.tolist()))
+    counts = count_keys(keys)
+    assert counts.sum() == len(df)
+    assert dict(enumerate(counts)) == {**dict.fromkeys(range(KEY_SPACE), 0),
+                                       **pd.Series(keys).value_counts().to_dict()}
+
+
+def test_missing_columns():
+    df = random_frame(1).drop(columns=['free_W'])
+    assert missing_columns(df) == ['free_W']
+    assert missing_columns(df, action_col='iaction') == ['iaction', 'free_W']
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Twin network answers against brute-force enumeration of the exogenous variables."""
+
+from itertools import product
+
+import numpy as np
+import pytest
+
+from twin_network import parse_cbn, CompiledTwinNetwork
+
+# free_NE -> free_W -> action -> brake -> latent_collision, action -> latent_collision;
+# u6 leaves probability mass 0.1 to no action at all
+PROGRAM = """
+0.4::u1.
+free_NE :- u1.
+0.7::u2.
+free_W :- u2, free_NE.
+0.2::u3.
+free_W :- u3, \\+ free_NE.
+0.6::u5(cruise); 0.4::u5(keep).
+action(V) :- u5(V), free_W.
+0.2::u6(cruise); 0.7::u6(keep).
+action(V) :- u6(V), \\+ free_W.
+0.9::u7.
+brake :- u7, action(cruise).
+0.15::u8.
+brake :- u8, action(keep).
+0.9::u9.
+latent_collision :- u9, action(cruise), brake.
+0.2::u10.
+latent_collision :- u10, action(cruise), \\+ brake.
+0.5::u11.
+latent_collision :- u11, action(keep), brake.
+0.05::u12.
+latent_collision :- u12, action(keep), \\+ brake.
+"""
+BOOLEAN_FACTS = {'u1': 0.4, 'u2': 0.7, 'u3': 0.2, 'u7': 0.9, 'u8': 0.15,
+                 'u9': 0.9, 'u10': 0.2, 'u11': 0.5, 'u12': 0.05}
+U5 = {'cruise': 0.6, 'keep': 0.4}
+U6 = {'cruise': 0.2, 'keep': 0.7, None: 0.1}
+VARIABLES = ['free_NE', 'free_W', 'action', 'brake', 'latent_collision']
+ACTIONS = ['cruise', 'keep']
+
+
+def derive(u, do=None):
+    """The world fixed by the exogenous values u, with action set to do if given."""
+    free_NE = u['u1']
+    free_W = u['u2'] if free_NE else u['u3']
+    action = do if do is not None else (u['u5'] if free_W else u['u6'])
+    brake = (action == 'cruise' and u['u7']) or (action == 'keep' and u['u8'])
+    if action == 'cruise':
+        collision = u['u9'] if brake else u['u10']
+    elif action == 'keep':
+        collision = u['u11'] if brake else u['u12']
+    else:
+        collision = False
+    return (free_NE, free_W, action, brake, collision)
+
+
+def brute_force():
+    """P(latent_collision | world, do(action)) for every possible world, by enumeration."""
+    likelihood = {}
+    hits = {}
+    names = list(BOOLEAN_FACTS)
+    for bits in product([False, True], repeat=len(names)):
+        for u5, u6 in product(U5, U6):
+            u = dict(zip(names, bits), u5=u5, u6=u6)
+            weight = U5[u5] * U6[u6]
+            for name, bit in zip(names, bits):
+                weight *= BOOLEAN_FACTS[name] if bit else 1.0 - BOOLEAN_FACTS[name]
+            world = derive(u)
+            likelihood[world] = likelihood.get(world, 0.0) + weight
+            for iaction in ACTIONS:
+                if derive(u, iaction)[-1]:
+                    hits[world, iaction] = hits.get((world, iaction), 0.0) + weight
+    return {(world, iaction): hits.get((world, iaction), 0.0) / p
+            for world, p in likelihood.items() if p > 0.0 and world[2] is not None
+            for iaction in ACTIONS}
+
+
+def evidence_of(world):
+    return {v: str(value) for v, value in zip(VARIABLES, world)}
+
+
+def test_query_matches_brute_force():
+    expected = brute_force()
+    twin = CompiledTwinNetwork(parse_cbn(PROGRAM))
+    assert len(expected) == 2 * 2 * 2 * 2 * 2 * len(ACTIONS)
+    for (world, iaction), prob in expected.items():
+        assert twin.query(evidence_of(world), iaction) == pytest.approx(prob, abs=1e-12)
+
+
+def test_query_batch_matches_query():
+    twin = CompiledTwinNetwork(parse_cbn(PROGRAM))
+    worlds = list(product([False, True], [False, True], ACTIONS, [False, True], [False, True]))
+    queries = [(world, iaction) for world in worlds for iaction in ACTIONS]
+    evidence = {v: np.array([str(world[k]) for world, _ in queries]) for k, v in enumerate(VARIABLES)}
+    probs = twin.query_batch(evidence, np.array([iaction for _, iaction in queries]))
+    for (world, iaction), prob in zip(queries, probs):
+        single = twin.query(evidence_of(world), iaction)
+        if single is None:
+            assert np.isnan(prob)
+        else:
+            assert prob == pytest.approx(single, abs=1e-12)
+
+
+def test_unanswerable_queries():
+    twin = CompiledTwinNetwork(parse_cbn(PROGRAM))
+    world = {'free_NE': 'True', 'free_W': 'True', 'action': 'cruise', 'brake': 'True', 'latent_collision': 'True'}
+    assert twin.query(world, 'keep') is not None
+    assert twin.query(world, 'swerve_left') is None
+    assert twin.query(dict(world, action='swerve_left'), 'keep') is None
+    assert twin.query({'free_NE': 'True'}, 'keep') is None
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Random choice of one best intervention per group.
+
+Tied best interventions (ranking == 1) are broken at random, reproducibly:
+the generator is seeded from the (rep, percentage) pair with a stable hash,
+so every run and every worker process picks the same rows (Python's hash()
+of a string changes from process to process). Every candidate row draws a
+random key and the row with the smallest key wins its group, which is one
+groupby over the candidates instead of a loop over the groups.
+"""
+
+import zlib
+import numpy as np
+import pandas as pd
+
+
+def tie_break_seed(rep_num, perc):
+    """Stable 32-bit seed of a (rep, percentage) pair."""
+    return zlib.crc32(f"{rep_num}_{perc}".encode())
+
+
+def choose_best(candidates, seed):
+    """Returns the index labels of one random row of candidates per group_id, in the order of candidates."""
+    if candidates.empty:
+        return candidates.index
+    keys = pd.Series(np.random.default_rng(seed).random(len(candidates)), index=candidates.index)
+    chosen = keys.groupby(candidates['group_id'].to_numpy()).idxmin()
+    return candidates.index[candidates.index.isin(chosen)]
+
+
+def mark_best(df, best_int, column='best_intervention'):
+    """Marks with '*' the rows of df with the group_id and iaction of a chosen row."""
+    pairs = pd.MultiIndex.from_frame(best_int[['group_id', 'iaction']])
+    chosen = pd.MultiIndex.from_frame(df[['group_id', 'iaction']]).isin(pairs)
+    df.loc[chosen, column] = '*'
+    return df
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Compiled twin networks for the cBN_i.pl programs written by CBNs_LOOCV_training.R.
+
+Every cBN program is a discrete Bayesian network encoded with one exogenous
+fact (or annotated disjunction) per parent configuration:
+
+    0.9990010::u7.
+    latent_collision :- u7, action(change_to_left), \\+ free_NE, \\+ free_W.
+
+Since each parent configuration owns its own exogenous variable, a fully
+observed factual world fixes the exogenous variables of the active
+configurations and leaves every other one at its prior. The counterfactual
+world therefore only has to be enumerated over the descendants of the
+intervened variable, which is what CompiledTwinNetwork does. The program is
+parsed and compiled once per fold and every (evidence, intervention) pair is
+then answered from the compiled tables.
+
+Compilation is parametric: TwinNetworkStructure depends only on the DAG and
+the variable domains, while the probabilities are plugged in as weight
+tables (TwinNetworkStructure.bind). Folds whose programs share a structure
+share one compiled structure and can be evaluated in a single sweep.
+"""
+
+import re
+from itertools import product
+
+import numpy as np
+
+QUERY_ATOM = "latent_collision"
+INTERVENED_ATOM = "action"
+
+BOOLEAN_VALUES = [False, True]
+
+LITERAL_RE = re.compile(r"^(\\\+\s*)?(\w+)(?:\((\w+)\))?$")
+
+
+def _parse_literal(literal):
+    """Return (atom, value) for literals like 'free_E', '\\+ free_E' or 'action(keep)'."""
+    match = LITERAL_RE.match(literal.strip())
+    if match is None:
+        raise ValueError(f"Unsupported literal in cBN program: {literal!r}")
+    negated, atom, arg = match.groups()
+    if arg is not None:
+        return atom, arg
+    return atom, not negated
+
+
+def _value_index(values, value):
+    if values == BOOLEAN_VALUES:
+        if isinstance(value, str):
+            value = value == "True"
+        return values.index(bool(value))
+    return values.index(value)
+
+
+def _split_body(body):
+    """Split a rule body on the commas that separate literals."""
+    return [lit for lit in re.split(r",\s*(?![^()]*\))", body) if lit.strip()]
+
+
+class CausalModel:
+    """Discrete causal model recovered from a cBN program.
+
+    Boolean variables take the values [False, True]. Multi-valued variables
+    (action) take the values listed in their annotated disjunctions plus a
+    trailing None, which carries the probability mass left over when the
+    rounded probabilities do not add up to one (no value is derived).
+    """
+
+    def __init__(self):
+        self.values = {}     # variable -> list of values
+        self.parents = {}    # variable -> list of parent variables
+        self.cpt = {}        # variable -> {tuple of parent value indices: list of probabilities}
+
+    def index(self, variable, value):
+        """Return the index of value (a bool or its CSV string) in the domain of variable."""
+        return _value_index(self.values[variable], value)
+
+    def topological_order(self):
+        """Return the variables ordered so that parents precede their children."""
+        order = []
+        pending = {v: set(p) for v, p in self.parents.items()}
+        while pending:
+            ready = sorted(v for v, p in pending.items() if not p & set(pending))
+            if not ready:
+                raise ValueError("cBN program contains a cycle")
+            order.extend(ready)
+            for v in ready:
+                del pending[v]
+        return order
+
+    def descendants(self, variable):
+        """Return the set of strict descendants of variable."""
+        children = {v: [] for v in self.parents}
+        for child, parents in self.parents.items():
+            for parent in parents:
+                children.setdefault(parent, []).append(child)
+        found = set()
+        stack = list(children.get(variable, []))
+        while stack:
+            node = stack.pop()
+            if node not in found:
+                found.add(node)
+                stack.extend(children.get(node, []))
+        return found
+
+    def distribution(self, variable, config):
+        """Return P(variable | parents = config), config given as value indices."""
+        dist = self.cpt[variable].get(config)
+        if dist is not None:
+            return dist
+        # Configurations without a rule (e.g. a parent with no derived value)
+        # derive nothing: Boolean heads are false, multi-valued heads take None.
+        dist = [0.0] * len(self.values[variable])
+        dist[0 if self.values[variable] == BOOLEAN_VALUES else -1] = 1.0
+        return dist
+
+
+def parse_cbn(text):
+    """Parse the text of a cBN_i.pl program into a CausalModel."""
+    facts = {}          # exogenous atom -> {value: probability}
+    rules = []          # (head, multi_valued, exogenous atom, [(parent, value), ...])
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("%"):
+            continue
+        if not line.endswith("."):
+            raise ValueError(f"Unterminated clause in cBN program: {line!r}")
+        line = line[:-1]
+
+        if ":-" in line:
+            head, body = line.split(":-", 1)
+            head = head.strip()
+            multi_valued = head.endswith("(V)")
+            head = head[:-3] if multi_valued else head
+            literals = _split_body(body)
+            exogenous = literals[0].strip()
+            exogenous = exogenous[:-3] if exogenous.endswith("(V)") else exogenous
+            conditions = [_parse_literal(lit) for lit in literals[1:]]
+            rules.append((head, multi_valued, exogenous, conditions))
+        elif "::" in line:
+            for part in line.split(";"):
+                prob, atom = part.split("::")
+                name, value = _parse_literal(atom)
+                facts.setdefault(name, {})[value] = float(prob)
+        else:
+            raise ValueError(f"Unsupported clause in cBN program: {line!r}")
+
+    model = CausalModel()
+
+    # Domains and parent sets come first: parent value indices are needed below.
+    for head, multi_valued, exogenous, conditions in rules:
+        if exogenous not in facts:
+            raise ValueError(f"Rule for {head} uses undefined exogenous atom {exogenous}")
+        if multi_valued:
+            values = model.values.setdefault(head, [])
+            for value in facts[exogenous]:
+                if value not in values:
+                    values.append(value)
+        else:
+            model.values[head] = BOOLEAN_VALUES
+        parents = [parent for parent, _ in conditions]
+        known = model.parents.setdefault(head, parents)
+        if sorted(known) != sorted(parents):
+            raise ValueError(f"Inconsistent parent sets for {head}: {known} vs {parents}")
+    for variable, values in model.values.items():
+        if values is not BOOLEAN_VALUES:
+            values.append(None)
+
+    for head, multi_valued, exogenous, conditions in rules:
+        assignment = dict(conditions)
+        config = tuple(model.index(p, assignment[p]) for p in model.parents[head])
+        dist = facts[exogenous]
+        if multi_valued:
+            probs = [dist.get(value, 0.0) for value in model.values[head][:-1]]
+            probs.append(max(0.0, 1.0 - sum(probs)))
+        else:
+            probs = [1.0 - dist[True], dist[True]]
+        model.cpt.setdefault(head, {})[config] = probs
+
+    for variable, parents in model.parents.items():
+        for parent in parents:
+            if parent not in model.values:
+                raise ValueError(f"Parent {parent} of {variable} is not defined in the program")
+    return model
+
+
+def load_cbn(input_cbn):
+    """Read and parse a cBN_i.pl file."""
+    with open(input_cbn, "r") as file:
+        return parse_cbn(file.read())
+
+
+class TwinNetworkStructure:
+    """Parametric twin network compiled from the structure of a CausalModel.
+
+    Holds everything that does not depend on the probabilities: topological
+    order, domains, mixed-radix strides of the parent configurations, the
+    descendant chain of the intervened variable and its joint assignments.
+    The probabilities enter as weight tables produced by bind().
+    """
+
+    def __init__(self, model, query=QUERY_ATOM, intervened=INTERVENED_ATOM):
+        if query not in model.values or intervened not in model.values:
+            raise ValueError(f"Program does not define both {query} and {intervened}")
+        self.query_atom = query
+        self.intervened = intervened
+        self.values = {v: list(values) for v, values in model.values.items()}
+        self.parents = {v: list(parents) for v, parents in model.parents.items()}
+        self.variables = model.topological_order()
+        descendants = model.descendants(intervened)
+        # Only descendants of the intervened variable can differ between the
+        # factual and the counterfactual world.
+        self.chain = [v for v in self.variables if v in descendants]
+        self.query_index = _value_index(self.values[query], True)
+
+        # Parent configurations are indexed with mixed-radix strides (last
+        # parent fastest), matching the row order of the weight tables.
+        self.sizes = {v: len(self.values[v]) for v in self.variables}
+        self.strides = {}
+        for v in self.variables:
+            strides = []
+            stride = 1
+            for p in reversed(self.parents[v]):
+                strides.insert(0, stride)
+                stride *= self.sizes[p]
+            self.strides[v] = strides
+        # Every joint assignment of the descendant chain, one row each.
+        self.assignments = np.array(list(product(*(range(self.sizes[v]) for v in self.chain))),
+                                    dtype=np.int64).reshape(-1, len(self.chain))
+
+    @property
+    def actions(self):
+        """Values the intervened variable can be set to."""
+        return [v for v in self.values[self.intervened] if v is not None]
+
+    def matches(self, model):
+        """Whether model has this structure (same domains and parent sets)."""
+        return model.values == self.values and model.parents == self.parents
+
+    def bind(self, model):
+        """Return the weight tables of model: {variable: array (configs, values)}."""
+        if not self.matches(model):
+            raise ValueError("Model does not match the compiled twin network structure")
+        tables = {}
+        for v in self.variables:
+            configs = product(*(range(self.sizes[p]) for p in self.parents[v]))
+            tables[v] = np.array([model.distribution(v, c) for c in configs], dtype=float)
+        return tables
+
+    def encode(self, variable, values):
+        """Map an array of raw values to value indices, -1 for unknown values."""
+        values = np.asarray(values)
+        uniques, inverse = np.unique(values, return_inverse=True)
+        codes = []
+        for value in uniques.tolist():
+            try:
+                codes.append(_value_index(self.values[variable], value))
+            except ValueError:
+                codes.append(-1)
+        return np.array(codes, dtype=np.int64)[inverse.reshape(-1)]
+
+    def query_batch(self, tables, evidence, interventions, program=None):
+        """Vectorized counterfactual queries against stacked weight tables.
+
+        tables maps every variable to an array (programs, configs, values),
+        i.e. the bind() tables of several programs stacked on a first axis,
+        and program gives the table index of each query (default 0). evidence
+        maps every variable to an array of values and interventions is an
+        array of values of the intervened variable. Returns an array of
+        probabilities with NaN for queries that cannot be answered (missing
+        variables, unknown values or zero-probability evidence).
+        """
+        n = len(interventions)
+        if any(v not in evidence for v in self.variables):
+            return np.full(n, np.nan)
+        program = np.zeros(n, dtype=np.int64) if program is None else np.asarray(program)
+        observed = {v: self.encode(v, evidence[v]) for v in self.variables}
+        intervened = self.encode(self.intervened, interventions)
+        valid = intervened >= 0
+        for v in self.variables:
+            valid &= observed[v] >= 0
+        observed = {v: np.where(valid, codes, 0) for v, codes in observed.items()}
+        intervened = np.where(valid, intervened, 0)
+
+        # Abduction: factual configurations and their likelihood.
+        factual = {}
+        for v in self.variables:
+            config = np.zeros(n, dtype=np.int64)
+            for p, stride in zip(self.parents[v], self.strides[v]):
+                config += observed[p] * stride
+            valid &= tables[v][program, config, observed[v]] > 0.0
+            factual[v] = config
+
+        if self.query_atom not in self.chain:
+            probs = (observed[self.query_atom] == self.query_index).astype(float)
+        else:
+            # Action and prediction: the leaf weights of every (query, chain
+            # assignment) pair are gathered from the tables at once.
+            position = {v: i for i, v in enumerate(self.chain)}
+            weight = np.ones((n, len(self.assignments)))
+            for i, v in enumerate(self.chain):
+                config = np.zeros(weight.shape, dtype=np.int64)
+                for p, stride in zip(self.parents[v], self.strides[v]):
+                    if p == self.intervened:
+                        config += intervened[:, None] * stride
+                    elif p in position:
+                        config += self.assignments[None, :, position[p]] * stride
+                    else:
+                        config += observed[p][:, None] * stride
+                value = np.broadcast_to(self.assignments[None, :, i], weight.shape)
+                same = config == factual[v][:, None]
+                leaf = tables[v][program[:, None], config, value]
+                weight *= np.where(same, value == observed[v][:, None], leaf)
+            hits = self.assignments[:, position[self.query_atom]] == self.query_index
+            probs = weight[:, hits].sum(axis=1)
+
+        probs[~valid] = np.nan
+        return probs
+
+
+class CompiledTwinNetwork:
+    """Twin network of a CausalModel compiled for P(query | evidence, do(intervened)).
+
+    A TwinNetworkStructure bound to the weight tables of one program; pass
+    structure to reuse an already compiled structure. Evidence must observe
+    every variable of the model; query() returns None for evidence it cannot
+    answer (missing variables, unknown values or zero probability) so callers
+    can fall back to the knowledge compiler.
+    """
+
+    def __init__(self, model, query=QUERY_ATOM, intervened=INTERVENED_ATOM, structure=None):
+        if structure is None:
+            structure = TwinNetworkStructure(model, query, intervened)
+        self.structure = structure
+        self.tables = structure.bind(model)
+
+    @property
+    def actions(self):
+        """Values the intervened variable can be set to."""
+        return self.structure.actions
+
+    def query(self, evidence, intervention):
+        """Return P(query | evidence, do(intervened = intervention)) or None."""
+        st = self.structure
+        try:
+            observed = {v: _value_index(st.values[v], evidence[v]) for v in st.variables}
+        except (KeyError, ValueError):
+            return None
+        if intervention is None or intervention not in st.values[st.intervened]:
+            return None
+
+        # Abduction: the factual world is fully observed, so it only has to be
+        # possible; the exogenous variables of active configurations are fixed.
+        factual = {}
+        for v in st.variables:
+            config = sum(observed[p] * stride for p, stride in zip(st.parents[v], st.strides[v]))
+            if self.tables[v][config, observed[v]] <= 0.0:
+                return None
+            factual[v] = config
+
+        if st.query_atom not in st.chain:
+            return 1.0 if observed[st.query_atom] == st.query_index else 0.0
+
+        # Action and prediction over the descendant chain.
+        world = dict(observed)
+        world[st.intervened] = st.values[st.intervened].index(intervention)
+        return self._predict(world, observed, factual, 0)
+
+    def query_batch(self, evidence, interventions):
+        """Vectorized query(): NaN marks the queries query() would answer with None."""
+        tables = {v: table[None] for v, table in self.tables.items()}
+        return self.structure.query_batch(tables, evidence, interventions)
+
+    def _predict(self, world, observed, factual, position):
+        st = self.structure
+        if position == len(st.chain):
+            return 1.0 if world[st.query_atom] == st.query_index else 0.0
+        v = st.chain[position]
+        config = sum(world[p] * stride for p, stride in zip(st.parents[v], st.strides[v]))
+        if config == factual[v]:
+            # Same configuration as in the factual world: same exogenous value.
+            branches = [(observed[v], 1.0)]
+        else:
+            branches = enumerate(self.tables[v][config].tolist())
+        total = 0.0
+        for value, prob in branches:
+            if prob <= 0.0:
+                continue
+            world[v] = value
+            total += prob * self._predict(world, observed, factual, position + 1)
+        world[v] = observed[v]
+        return total
+
+
+def stack_tables(bound):
+    """Stack the bind() tables of several programs sharing one structure."""
+    return {v: np.stack([tables[v] for tables in bound]) for v in bound[0]}
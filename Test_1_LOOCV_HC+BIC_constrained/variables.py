@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Actions and columns of the driving data, shared by the query scripts
+(run_WhatIf_V4, lookup_table) and the post-processing modules (state_codec,
+results_io, frequency_cube). Plain constants with no imports, so the
+post-processing never loads the twin network or aspmc toolchain.
+"""
+
+ACTIONS_LIST = ["change_to_left", "change_to_right", "cruise", "keep", "swerve_left", "swerve_right"]
+# Perception variables, in the bit order of lookup_table and state_codec (first key most significant)
+STATE_KEYS = ['curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W']
+NUM_STATES = 2 ** len(STATE_KEYS)
+EVIDENCE_KEYS = ['action', 'curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W', 'latent_collision']
+RESULT_KEYS = ['action', 'curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W',
+               'orig_label_lc', 'latent_collision', 'iaction']
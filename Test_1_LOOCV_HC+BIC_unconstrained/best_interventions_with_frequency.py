@@ -2,86 +2,49 @@
 
 import sys
 import os
+import time
+import multiprocessing
 import pandas as pd
 import numpy as np
-import csv
-from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from results_io import read_results, write_typed, text_order
+from contingency import ContingencyCube, write_contingency_table, write_atomized_table, write_contingency_json
+from tie_breaking import tie_break_seed, choose_best, mark_best
+from state_codec import missing_columns, encode, key_set
+from frequency_cube import load_frequency_counts
 
 # Path to no_crashes dataset used to decide potential_crash_before/after
 NO_CRASHES_PATH = "./Shared_CSVs/no_crashes.csv"
 # Path to complete database for frequency lookup
 COMPLETE_DB_PATH = "./Shared_CSVs/complete_DB_discrete.csv"
 
-# Tolerance for floating equality when detecting ties (equal probabilities)
-EPS = 1e-12
+# Worker processes used by main (1 processes the configurations in this process)
+NUM_WORKERS = os.cpu_count() or 1
 
-def make_key_from_df(df, cols):
-    """Return a Series of string keys by concatenating values in cols (all cast to str)."""
-    return df[cols].astype(str).agg("_".join, axis=1)
+# Read-only lookup arrays of a worker process, set by _init_worker
+_no_crashes_set = None
+_frequency_counts = None
 
-def load_frequency_data():
-    """Load and prepare frequency data from complete_DB_discrete.csv"""
-    print("Loading frequency data from:", COMPLETE_DB_PATH)
-    if not os.path.exists(COMPLETE_DB_PATH):
-        print(f"[Warning] Complete DB file not found at {COMPLETE_DB_PATH}. Frequency column will be NA.")
-        return None
-    
-    freq_df = pd.read_csv(COMPLETE_DB_PATH, dtype=str)
-    
-    # Create frequency mapping for action-state pairs
-    # Columns to use for state: curr_lane, free_E, free_NE, free_NW, free_SE, free_SW, free_W
-    state_cols = ['curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W']
-    
-    # Check which state columns exist in the frequency data
-    available_state_cols = [col for col in state_cols if col in freq_df.columns]
-    if 'action' not in freq_df.columns:
-        print("[Warning] 'action' column not found in frequency data. Cannot compute frequencies.")
-        return None
-    
-    if not available_state_cols:
-        print("[Warning] No state columns found in frequency data. Cannot compute frequencies.")
-        return None
-    
-    print(f"Using state columns for frequency: {available_state_cols}")
-    
-    # Create key for frequency lookup (action + state)
-    freq_df['freq_key'] = make_key_from_df(freq_df[['action'] + available_state_cols], ['action'] + available_state_cols)
-    
-    # Count frequencies
-    freq_counts = freq_df.groupby('freq_key').size().reset_index(name='frequency')
-    
-    return freq_counts.set_index('freq_key')['frequency'].to_dict()
-
-def add_frequency_column(df, frequency_dict):
+def add_frequency_column(df, frequency_counts):
     """Add frequency column to dataframe based on action-state pairs"""
-    if frequency_dict is None:
+    if frequency_counts is None or missing_columns(df):
         df['frequency'] = 'NA'
         return df
     
-    # Columns to use for state
-    state_cols = ['curr_lane', 'free_E', 'free_NE', 'free_NW', 'free_SE', 'free_SW', 'free_W']
-    available_state_cols = [col for col in state_cols if col in df.columns]
-    
-    if 'action' not in df.columns or not available_state_cols:
-        df['frequency'] = 'NA'
-        return df
-    
-    # Create frequency key for each row
-    df['freq_key'] = make_key_from_df(df[['action'] + available_state_cols], ['action'] + available_state_cols)
-    
     # Map frequencies - only for ranking == 1, others get 'NA'
     df['frequency'] = 'NA'
-    mask_ranking1 = df['ranking'] == 1
-    df.loc[mask_ranking1, 'frequency'] = df.loc[mask_ranking1, 'freq_key'].map(
-        lambda x: str(frequency_dict.get(x, 0)) if pd.notna(x) else '0'
-    )
-    
-    # Remove temporary column
-    df.drop('freq_key', axis=1, inplace=True, errors='ignore')
+    mask_ranking1 = (df['ranking'] == 1).to_numpy()
+    keys = encode(df.loc[mask_ranking1])
+    df.loc[mask_ranking1, 'frequency'] = frequency_counts[keys].astype(str)
     
     return df
 
-def process_rep_perc(rep_num, perc, no_crashes_df):
+def process_rep_perc(rep_num, perc, no_crashes_set, frequency_counts):
+    """
+    Ranks, annotates and summarizes the results of one (rep, percentage).
+    no_crashes_set is the state_codec key_set of no_crashes.csv. Returns the
+    counts of the final summary, or None if the input is missing.
+    """
     base_dir = os.getcwd()
     cbn_dir = os.path.join(base_dir, f"rep_{rep_num}", perc, "cBNs")
     input_csv = os.path.join(cbn_dir, "twin_networks_results.csv")
@@ -89,19 +52,22 @@ def process_rep_perc(rep_num, perc, no_crashes_df):
     ds_csv = os.path.join(cbn_dir, "data_sorted.csv")
     ct_txt = os.path.join(cbn_dir, "contingency_table.txt")
     ct_atom_txt = os.path.join(cbn_dir, "contingency_table_atomized.txt")
+    ct_json = os.path.join(cbn_dir, "contingency.json")
 
     if not os.path.exists(input_csv):
         print(f"[Warning] Input file not found: {input_csv}. Skipping.", flush=True)
-        return
+        return None
 
     print(f"\nProcessing rep: {rep_num} percentage: {perc}")
     print("Loading:", input_csv)
 
-    # Load frequency data once per process
-    frequency_dict = load_frequency_data()
-
     # Read results
-    df = pd.read_csv(input_csv, dtype=str)  # read as strings first
+    # Typed frame, from the Parquet copy if up to date; the rest of the
+    # script compares and groups action names as plain strings
+    df = read_results(input_csv)
+    for col in ['action', 'iaction']:
+        if col in df.columns:
+            df[col] = df[col].astype(str)
     # convert numeric columns
     if 'probability' in df.columns:
         df['probability'] = pd.to_numeric(df['probability'], errors='coerce')
@@ -115,58 +81,22 @@ def process_rep_perc(rep_num, perc, no_crashes_df):
 
     # --- Sort and compute ranking (dense rank by probability within group) ---
     # ORGANIZE BY group_id AND ranking (Feature 1)
-    df = df.sort_values(['group_id', 'probability'], ascending=[True, True]).reset_index(drop=True)
+    df = df.sort_values(['group_id', 'probability'], ascending=[True, True], key=text_order).reset_index(drop=True)
     # dense rank per group
     df['ranking'] = df.groupby('group_id')['probability'].rank(method='dense', ascending=True).astype(int)
 
     # ADD FREQUENCY COLUMN (Feature 2)
-    df = add_frequency_column(df, frequency_dict)
-
-    # Prepare ds_temp columns: same logic as your R code:
-    # remove latent collision and iaction/probability/elapsed_time/group_id/ranking for existence checks.
-    # Identify columns to exclude for state-key
-    exclude_cols = set(['iaction', 'probability', 'elapsed_time', 'group_id', 'ranking', 'best_intervention', 'frequency'])
-    # also exclude any label or latent collision as in your R code
-    for to_ex in ['latent_collision', 'labeled_lc', 'orig_label_lc']:
-        if to_ex in df.columns:
-            exclude_cols.add(to_ex)
-
-    state_cols = [c for c in df.columns if c not in exclude_cols]
-
-    # Ensure 'action' is present in state_cols (we will overwrite it for after intervention)
-    if 'action' not in state_cols:
-        # if no 'action' column found, try 'iaction' presence etc.
-        raise RuntimeError("'action' column not found in input CSV. Required for state key generation.")
-
-    # Create keys for before intervention (action = observed action)
-    before_key = make_key_from_df(df[state_cols], state_cols)
-
-    # Create lookup set for no_crashes keys
-    # Read no_crashes_df columns matching state_cols (if no_crashes doesn't have same set, try intersection)
-    no_crashes_cols = [c for c in state_cols if c in no_crashes_df.columns]
-    if len(no_crashes_cols) < len(state_cols):
-        # If some state columns are missing in no_crashes, use intersection but warn
-        missing = set(state_cols) - set(no_crashes_cols)
-        if len(missing) > 0:
-            print(f"[Warning] no_crashes.csv missing columns {missing}. Matching on intersection of columns.", flush=True)
-
-    if len(no_crashes_cols) == 0:
-        raise RuntimeError("no_crashes.csv has no columns in common with state columns; cannot compute potential_crash_*.")
-
-    no_crashes_key = make_key_from_df(no_crashes_df[no_crashes_cols], no_crashes_cols)
-    no_crashes_set = set(no_crashes_key.values)
-
-    # Map before membership
-    # To compare keys we must ensure same columns order/selection. Build comparable keys from df using no_crashes_cols.
-    before_key_match = make_key_from_df(df[no_crashes_cols], no_crashes_cols)
-    df['potential_crash_before_intervention'] = np.where(before_key_match.isin(no_crashes_set), 'False', 'True')
-
-    # For after intervention, replace 'action' with 'iaction' and recompute keys
-    df_after_keys = df[no_crashes_cols].copy()
-    if 'action' in df_after_keys.columns and 'iaction' in df.columns:
-        df_after_keys['action'] = df['iaction'].astype(str)
-    after_key = make_key_from_df(df_after_keys, no_crashes_cols)
-    df['potential_crash_after_intervention'] = np.where(after_key.isin(no_crashes_set), 'False', 'True')
+    df = add_frequency_column(df, frequency_counts)
+
+    # Existence checks use the observed (or intervened) action and the state
+    # columns, as in your R code (latent collision and the rest are left out)
+    missing = missing_columns(df)
+    if missing:
+        raise RuntimeError(f"Input CSV lacks columns {missing}. Required for state key generation.")
+
+    # Before intervention the key uses the observed action, after it the intervened one
+    df['potential_crash_before_intervention'] = np.where(no_crashes_set[encode(df)], 'False', 'True')
+    df['potential_crash_after_intervention'] = np.where(no_crashes_set[encode(df, 'iaction')], 'False', 'True')
 
     # Restore True for rows where action == iaction (original action)
     if 'action' in df.columns:
@@ -179,43 +109,20 @@ def process_rep_perc(rep_num, perc, no_crashes_df):
     # Candidate rows are those with ranking == 1 (lowest probability)
     candidates = df[df['ranking'] == 1].copy()
 
-    # Count how many candidate rows per group (ties)
-    candidate_counts = candidates.groupby('group_id').size().rename('num_best').reset_index()
-
-    # For reproducible tie-breaking, seed with a combination of rep and perc
-    seed_int = hash((rep_num, perc)) & 0xffffffff
-    rng = np.random.default_rng(seed_int)
-
-    # For each group, pick one random candidate (if multiple)
-    chosen_idx = []
-    # We'll also build best_int dataframe like R's best_int (selected rows)
-    best_int_rows = []
-    for gid, group_df in candidates.groupby('group_id'):
-        if len(group_df) == 1:
-            chosen = group_df.index[0]
-        else:
-            chosen = rng.choice(group_df.index.values, size=1)[0]
-        chosen_idx.append(chosen)
-        best_int_rows.append(df.loc[chosen].copy())
-
-    if len(best_int_rows) > 0:
-        best_int = pd.DataFrame(best_int_rows).reset_index(drop=True)
-    else:
-        best_int = pd.DataFrame(columns=df.columns)
+    # For each group, pick one random candidate (if multiple), reproducibly
+    # for the (rep, perc) pair; best_int holds the selected rows like R's best_int
+    chosen_idx = choose_best(candidates, tie_break_seed(rep_num, perc))
+    best_int = df.loc[chosen_idx].reset_index(drop=True)
 
-    # Mark best intervention in df
-    # match by group_id and iaction
-    # best_int contains one chosen row per group (selected best action)
-    for _, row_sel in best_int.iterrows():
-        mask = (df['group_id'] == row_sel['group_id']) & (df['iaction'] == row_sel['iaction'])
-        df.loc[mask, 'best_intervention'] = '*'
+    # Mark best intervention in df, matching by group_id and iaction
+    mark_best(df, best_int)
 
     # ORGANIZE OUTPUT FILES BY group_id AND ranking (Feature 1)
-    df_sorted = df.sort_values(['group_id', 'ranking']).reset_index(drop=True)
+    df_sorted = df.sort_values(['group_id', 'ranking'], key=text_order).reset_index(drop=True)
 
     # Save best_interventions (selected ones) to CSV (drop helper columns if needed)
     # Match R's best_int selection: remove some columns as they did (-group_id, -ranking, -elapsed_time, -best_intervention)
-    to_drop = [c for c in ['group_id', 'ranking', 'elapsed_time', 'best_intervention'] if c in best_int.columns]
+    to_drop = [c for c in ['group_id', 'ranking', 'elapsed_time', 'best_intervention', 'answered_by'] if c in best_int.columns]
     best_int_save = best_int.drop(columns=to_drop, errors='ignore')
     # Sort best_int by group_id for consistent output
     if 'group_id' in best_int_save.columns:
@@ -226,435 +133,136 @@ def process_rep_perc(rep_num, perc, no_crashes_df):
     # Save full annotated sorted data (similar to data_sorted in R)
     # keep the same column order if possible
     df_sorted.to_csv(ds_csv, index=False)
+    write_typed(df_sorted, ds_csv)
     print("Saved sorted data to", ds_csv)
 
     # --------------------------
-    # Build contingency report (text file) matching R format and labels
+    # Build contingency reports (text files) matching R format and labels,
+    # from one aggregation pass over the annotated data
     # --------------------------
-    with open(ct_txt, "w") as out:
-        def wln(s=""):
-            out.write(s + "\n")
-
-        # Crash and no-crash partitions based on potential_crash_before_intervention
-        crash_data = df_sorted[df_sorted['potential_crash_before_intervention'] == 'True']
-        no_crash_data = df_sorted[df_sorted['potential_crash_before_intervention'] == 'False']
-
-        # Header
-        wln("=== CRASH SECTION ===")
-        wln("(Data from rows where potential_crash_before_intervention is True)\n")
-
-        # Counting results: number of groups with exactly i best interventions (i=1..6)
-        # we need counts over groups of how many ranking==1 rows they had (ties)
-        group_best_counts = (candidates
-                             .groupby('group_id')
-                             .size()
-                             .rename('count_ranking1')
-                             .reset_index())
-
-        # For crash_data we only consider those groups that are in crash_data and ranking==1 rows in crash_data
-        crash_ranking1 = (crash_data[crash_data['ranking'] == 1]
-                          .groupby('group_id')
-                          .size()
-                          .rename('n')
-                          .reset_index())
-
-        # Count how many groups have exactly i best interventions in crash_data
-        for i in range(1, 7):
-            num = int((crash_ranking1['n'] == i).sum()) if not crash_ranking1.empty else 0
-            wln(f"Number of groups with exactly {i} best interventions: {num}")
-
-        # Action counts for crash section (only ranking == 1 rows)
-        action_counts_crash = (crash_data[crash_data['ranking'] == 1]
-                               .groupby('iaction', as_index=False)
-                               .agg(total_selected=('iaction', 'size'),
-                                    safe_count=('potential_crash_after_intervention', lambda x: (x == 'False').sum()),
-                                    unsafe_count=('potential_crash_after_intervention', lambda x: (x == 'True').sum()))
-                               ).sort_values('iaction')
-
-        wln("\nNumber of actions selected for each intervention type:")
-        if action_counts_crash.shape[0] == 0:
-            wln("(none)\n")
-        else:
-            for _, r in action_counts_crash.iterrows():
-                wln(f"{r['iaction']} : Selected {int(r['total_selected'])} times, Safe {int(r['safe_count'])} times, Unsafe {int(r['unsafe_count'])} times")
-
-        # Totals
-        total_safe_crash = int((crash_data[crash_data['ranking'] == 1]['potential_crash_after_intervention'] == 'False').sum())
-        total_unsafe_crash = int((crash_data[crash_data['ranking'] == 1]['potential_crash_after_intervention'] == 'True').sum())
-
-        wln("\nTotal safe/unsafe actions:")
-        wln(f"Total safe actions: {total_safe_crash}")
-        wln(f"Total unsafe actions: {total_unsafe_crash}")
-
-        # Transition matrix for crash section (before -> after), using ranking==1 rows
-        wln("\nTransition matrix (before -> after):")
-        # build contingency using ranking==1 rows
-        cr = crash_data[crash_data['ranking'] == 1]
-        # Ensure keys exist
-        before_levels = ['True', 'False']
-        after_levels = ['True', 'False']
-        trans = pd.crosstab(cr['potential_crash_before_intervention'], cr['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-        # Write two lines as R did (True->True, True->False)
-        true_true = int(trans.loc['True','True']) if ('True' in trans.index and 'True' in trans.columns) else 0
-        true_false = int(trans.loc['True','False']) if ('True' in trans.index and 'False' in trans.columns) else 0
-        # number of groups contributing:
-        n_tt_groups = int(cr[(cr['potential_crash_before_intervention']=='True') & (cr['potential_crash_after_intervention']=='True')]['group_id'].nunique())
-        n_tf_groups = int(cr[(cr['potential_crash_before_intervention']=='True') & (cr['potential_crash_after_intervention']=='False')]['group_id'].nunique())
-        wln(f"    True -> True: {true_true} (from {n_tt_groups} groups)")
-        wln(f"    True -> False: {true_false} (from {n_tf_groups} groups)")
-
-        # Detailed transition matrices by number of ties for CRASH SECTION
-        wln("\nDetailed transition matrices by number of ties (CRASH SECTION):")
-        # For i in 1..6
-        # For groups with exactly i tied best interventions (i.e., groups with exactly i ranking==1 rows),
-        # compute transition counts (before->after)
-        if cr.empty:
-            wln("(no ranking==1 rows in crash section)\n")
-        else:
-            # compute number of ranking==1 rows per group (in crash_data ranking==1 only)
-            cr_group_counts = cr.groupby('group_id').size().rename('nrows').reset_index()
-            for i in range(1,7):
-                groups_with_i = cr_group_counts[cr_group_counts['nrows'] == i]['group_id'].tolist()
-                if len(groups_with_i) == 0:
-                    continue
-                tied_data = cr[cr['group_id'].isin(groups_with_i)]
-                wln(f"\nFor groups with {i} tied best interventions:")
-                wln("  - Transition matrix (before -> after):")
-                tr = pd.crosstab(tied_data['potential_crash_before_intervention'], tied_data['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-                t_tt = int(tr.loc['True','True']) if ('True' in tr.index and 'True' in tr.columns) else 0
-                t_tf = int(tr.loc['True','False']) if ('True' in tr.index and 'False' in tr.columns) else 0
-                # group counts
-                group_counts = tied_data.groupby(['potential_crash_before_intervention','potential_crash_after_intervention'])['group_id'].nunique().reset_index(name='n_groups')
-                def get_group_count(b,a):
-                    found = group_counts[(group_counts['potential_crash_before_intervention']==b) & (group_counts['potential_crash_after_intervention']==a)]
-                    return int(found['n_groups'].iloc[0]) if not found.empty else 0
-                g_tt = get_group_count('True','True')
-                g_tf = get_group_count('True','False')
-                wln(f"    True -> True: {t_tt} (from {g_tt} groups)")
-                wln(f"    True -> False: {t_tf} (from {g_tf} groups)")
-
-        # NO CRASH SECTION
-        wln("\n\n=== NO CRASH SECTION ===")
-        wln("(Data from rows where potential_crash_before_intervention is False)\n")
-
-        # Counting results for no_crash section (ranking==1)
-        nc = no_crash_data[no_crash_data['ranking'] == 1]
-        nc_group_counts = nc.groupby('group_id').size().rename('n').reset_index()
-        for i in range(1,7):
-            num = int((nc_group_counts['n'] == i).sum()) if not nc_group_counts.empty else 0
-            wln(f"Number of groups with exactly {i} best interventions: {num}")
-
-        # Action counts for no_crash section
-        action_counts_no_crash = (nc
-                                  .groupby('iaction', as_index=False)
-                                  .agg(total_selected=('iaction','size'),
-                                       safe_count=('potential_crash_after_intervention', lambda x: (x == 'False').sum()),
-                                       unsafe_count=('potential_crash_after_intervention', lambda x: (x == 'True').sum()))
-                                  ).sort_values('iaction')
-
-        wln("\nNumber of actions selected for each intervention type:")
-        if action_counts_no_crash.shape[0] == 0:
-            wln("(none)\n")
-        else:
-            for _, r in action_counts_no_crash.iterrows():
-                wln(f"{r['iaction']} : Selected {int(r['total_selected'])} times, Safe {int(r['safe_count'])} times, Unsafe {int(r['unsafe_count'])} times")
-
-        total_safe_no_crash = int((nc['potential_crash_after_intervention'] == 'False').sum())
-        total_unsafe_no_crash = int((nc['potential_crash_after_intervention'] == 'True').sum())
-
-        wln("\nTotal safe/unsafe actions:")
-        wln(f"Total safe actions: {total_safe_no_crash}")
-        wln(f"Total unsafe actions: {total_unsafe_no_crash}")
-
-        # Transition matrix for no_crash section (ranking==1 rows)
-        wln("\nTransition matrix (before -> after):")
-        tr_nc = pd.crosstab(nc['potential_crash_before_intervention'], nc['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-        f_t = int(tr_nc.loc['False','True']) if ('False' in tr_nc.index and 'True' in tr_nc.columns) else 0
-        f_f = int(tr_nc.loc['False','False']) if ('False' in tr_nc.index and 'False' in tr_nc.columns) else 0
-        g_ft = int(nc[(nc['potential_crash_before_intervention']=='False') & (nc['potential_crash_after_intervention']=='True')]['group_id'].nunique())
-        g_ff = int(nc[(nc['potential_crash_before_intervention']=='False') & (nc['potential_crash_after_intervention']=='False')]['group_id'].nunique())
-        wln(f"    False -> True: {f_t} (from {g_ft} groups)")
-        wln(f"    False -> False: {f_f} (from {g_ff} groups)")
-
-        # Detailed transition matrices by number of ties (NO CRASH SECTION)
-        wln("\n\nDetailed transition matrices by number of ties (NO CRASH SECTION):")
-        if nc.empty:
-            wln("(no ranking==1 rows in no-crash section)\n")
-        else:
-            nc_group_counts = nc.groupby('group_id').size().rename('nrows').reset_index()
-            for i in range(1,7):
-                groups_with_i = nc_group_counts[nc_group_counts['nrows']==i]['group_id'].tolist()
-                if len(groups_with_i) == 0:
-                    continue
-                tied_data = nc[nc['group_id'].isin(groups_with_i)]
-                wln(f"\nFor groups with {i} tied best interventions:")
-                wln("  - Transition matrix (before -> after):")
-                tr = pd.crosstab(tied_data['potential_crash_before_intervention'], tied_data['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-                aa = int(tr.loc['False','True']) if ('False' in tr.index and 'True' in tr.columns) else 0
-                bb = int(tr.loc['False','False']) if ('False' in tr.index and 'False' in tr.columns) else 0
-                group_counts = tied_data.groupby(['potential_crash_before_intervention','potential_crash_after_intervention'])['group_id'].nunique().reset_index(name='n_groups')
-                def get_group_count2(b,a):
-                    found = group_counts[(group_counts['potential_crash_before_intervention']==b) & (group_counts['potential_crash_after_intervention']==a)]
-                    return int(found['n_groups'].iloc[0]) if not found.empty else 0
-                g_at = get_group_count2('False','True')
-                g_af = get_group_count2('False','False')
-                wln(f"    False -> True: {aa} (from {g_at} groups)")
-                wln(f"    False -> False: {bb} (from {g_af} groups)")
-
-        # Final summary section (random selection outcomes from best_int)
-        wln("\n\n=== FINAL SUMMARY ===")
-        # best_int contains chosen best rows per group
-        bt = best_int.copy()
-        if bt.empty:
-            wln("Random selection - no best_int rows found.")
-        else:
-            random_true_true = int(((bt['potential_crash_before_intervention']=='True') & (bt['potential_crash_after_intervention']=='True')).sum())
-            random_false_false = int(((bt['potential_crash_before_intervention']=='False') & (bt['potential_crash_after_intervention']=='False')).sum())
-            random_true_false = int(((bt['potential_crash_before_intervention']=='True') & (bt['potential_crash_after_intervention']=='False')).sum())
-            random_false_true = int(((bt['potential_crash_before_intervention']=='False') & (bt['potential_crash_after_intervention']=='True')).sum())
-            wln(f"Random selection - Crash before (True) and after intervention (True): {random_true_true}")
-            wln(f"Random selection - Crash before (False) and after intervention (False): {random_false_false}")
-            wln(f"Random selection - Crash before (True) and after intervention (False): {random_true_false}")
-            wln(f"Random selection - Crash before (False) and after intervention (True): {random_false_true}")
-
+    cube = ContingencyCube(df_sorted)
+    write_contingency_table(cube, ct_txt)
     print("Saved contingency table to", ct_txt)
 
-    # --------------------------
-    # Build ATOMIZED contingency report (Feature 3)
-    # --------------------------
-    with open(ct_atom_txt, "w") as out:
-        def wln(s=""):
-            out.write(s + "\n")
-
-        # Split data by frequency (0 occurrences vs >=1 occurrences)
-        # Convert frequency to numeric for comparison, handling 'NA' values
-        def safe_numeric_freq(x):
-            try:
-                return int(x) if x != 'NA' else -1
-            except (ValueError, TypeError):
-                return -1
-
-        crash_data_zero = crash_data[crash_data['frequency'].apply(safe_numeric_freq) == 0]
-        crash_data_nonzero = crash_data[crash_data['frequency'].apply(safe_numeric_freq) > 0]
-        no_crash_data_zero = no_crash_data[no_crash_data['frequency'].apply(safe_numeric_freq) == 0]
-        no_crash_data_nonzero = no_crash_data[no_crash_data['frequency'].apply(safe_numeric_freq) > 0]
-
-        # CRASH SECTION - ZERO OCCURRENCES
-        wln("=== CRASH SECTION - ZERO OCCURRENCES ===")
-        wln("(Data from rows where potential_crash_before_intervention is True and frequency = 0)\n")
-
-        crash_zero_ranking1 = (crash_data_zero[crash_data_zero['ranking'] == 1]
-                              .groupby('group_id')
-                              .size()
-                              .rename('n')
-                              .reset_index())
-
-        for i in range(1, 7):
-            num = int((crash_zero_ranking1['n'] == i).sum()) if not crash_zero_ranking1.empty else 0
-            wln(f"Number of groups with exactly {i} best interventions: {num}")
-
-        # Action counts for crash zero section
-        action_counts_crash_zero = (crash_data_zero[crash_data_zero['ranking'] == 1]
-                                   .groupby('iaction', as_index=False)
-                                   .agg(total_selected=('iaction', 'size'),
-                                        safe_count=('potential_crash_after_intervention', lambda x: (x == 'False').sum()),
-                                        unsafe_count=('potential_crash_after_intervention', lambda x: (x == 'True').sum()))
-                                   ).sort_values('iaction')
-
-        wln("\nNumber of actions selected for each intervention type:")
-        if action_counts_crash_zero.shape[0] == 0:
-            wln("(none)\n")
-        else:
-            for _, r in action_counts_crash_zero.iterrows():
-                wln(f"{r['iaction']} : Selected {int(r['total_selected'])} times, Safe {int(r['safe_count'])} times, Unsafe {int(r['unsafe_count'])} times")
-
-        total_safe_crash_zero = int((crash_data_zero[crash_data_zero['ranking'] == 1]['potential_crash_after_intervention'] == 'False').sum())
-        total_unsafe_crash_zero = int((crash_data_zero[crash_data_zero['ranking'] == 1]['potential_crash_after_intervention'] == 'True').sum())
-
-        wln("\nTotal safe/unsafe actions:")
-        wln(f"Total safe actions: {total_safe_crash_zero}")
-        wln(f"Total unsafe actions: {total_unsafe_crash_zero}")
-
-        # Transition matrix for crash zero section
-        wln("\nTransition matrix (before -> after):")
-        cr_zero = crash_data_zero[crash_data_zero['ranking'] == 1]
-        if not cr_zero.empty:
-            trans_zero = pd.crosstab(cr_zero['potential_crash_before_intervention'], cr_zero['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-            true_true_zero = int(trans_zero.loc['True','True']) if ('True' in trans_zero.index and 'True' in trans_zero.columns) else 0
-            true_false_zero = int(trans_zero.loc['True','False']) if ('True' in trans_zero.index and 'False' in trans_zero.columns) else 0
-            n_tt_groups_zero = int(cr_zero[(cr_zero['potential_crash_before_intervention']=='True') & (cr_zero['potential_crash_after_intervention']=='True')]['group_id'].nunique())
-            n_tf_groups_zero = int(cr_zero[(cr_zero['potential_crash_before_intervention']=='True') & (cr_zero['potential_crash_after_intervention']=='False')]['group_id'].nunique())
-            wln(f"    True -> True: {true_true_zero} (from {n_tt_groups_zero} groups)")
-            wln(f"    True -> False: {true_false_zero} (from {n_tf_groups_zero} groups)")
-        else:
-            wln("    (no data)")
-
-        # CRASH SECTION - NON-ZERO OCCURRENCES (>=1)
-        wln("\n\n=== CRASH SECTION - NON-ZERO OCCURRENCES (>=1) ===")
-        wln("(Data from rows where potential_crash_before_intervention is True and frequency >= 1)\n")
-
-        crash_nonzero_ranking1 = (crash_data_nonzero[crash_data_nonzero['ranking'] == 1]
-                                 .groupby('group_id')
-                                 .size()
-                                 .rename('n')
-                                 .reset_index())
-
-        for i in range(1, 7):
-            num = int((crash_nonzero_ranking1['n'] == i).sum()) if not crash_nonzero_ranking1.empty else 0
-            wln(f"Number of groups with exactly {i} best interventions: {num}")
-
-        # Action counts for crash nonzero section
-        action_counts_crash_nonzero = (crash_data_nonzero[crash_data_nonzero['ranking'] == 1]
-                                      .groupby('iaction', as_index=False)
-                                      .agg(total_selected=('iaction', 'size'),
-                                           safe_count=('potential_crash_after_intervention', lambda x: (x == 'False').sum()),
-                                           unsafe_count=('potential_crash_after_intervention', lambda x: (x == 'True').sum()))
-                                      ).sort_values('iaction')
-
-        wln("\nNumber of actions selected for each intervention type:")
-        if action_counts_crash_nonzero.shape[0] == 0:
-            wln("(none)\n")
-        else:
-            for _, r in action_counts_crash_nonzero.iterrows():
-                wln(f"{r['iaction']} : Selected {int(r['total_selected'])} times, Safe {int(r['safe_count'])} times, Unsafe {int(r['unsafe_count'])} times")
-
-        total_safe_crash_nonzero = int((crash_data_nonzero[crash_data_nonzero['ranking'] == 1]['potential_crash_after_intervention'] == 'False').sum())
-        total_unsafe_crash_nonzero = int((crash_data_nonzero[crash_data_nonzero['ranking'] == 1]['potential_crash_after_intervention'] == 'True').sum())
-
-        wln("\nTotal safe/unsafe actions:")
-        wln(f"Total safe actions: {total_safe_crash_nonzero}")
-        wln(f"Total unsafe actions: {total_unsafe_crash_nonzero}")
-
-        # Transition matrix for crash nonzero section
-        wln("\nTransition matrix (before -> after):")
-        cr_nonzero = crash_data_nonzero[crash_data_nonzero['ranking'] == 1]
-        if not cr_nonzero.empty:
-            trans_nonzero = pd.crosstab(cr_nonzero['potential_crash_before_intervention'], cr_nonzero['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-            true_true_nonzero = int(trans_nonzero.loc['True','True']) if ('True' in trans_nonzero.index and 'True' in trans_nonzero.columns) else 0
-            true_false_nonzero = int(trans_nonzero.loc['True','False']) if ('True' in trans_nonzero.index and 'False' in trans_nonzero.columns) else 0
-            n_tt_groups_nonzero = int(cr_nonzero[(cr_nonzero['potential_crash_before_intervention']=='True') & (cr_nonzero['potential_crash_after_intervention']=='True')]['group_id'].nunique())
-            n_tf_groups_nonzero = int(cr_nonzero[(cr_nonzero['potential_crash_before_intervention']=='True') & (cr_nonzero['potential_crash_after_intervention']=='False')]['group_id'].nunique())
-            wln(f"    True -> True: {true_true_nonzero} (from {n_tt_groups_nonzero} groups)")
-            wln(f"    True -> False: {true_false_nonzero} (from {n_tf_groups_nonzero} groups)")
-        else:
-            wln("    (no data)")
-
-        # NO CRASH SECTION - ZERO OCCURRENCES
-        wln("\n\n=== NO CRASH SECTION - ZERO OCCURRENCES ===")
-        wln("(Data from rows where potential_crash_before_intervention is False and frequency = 0)\n")
-
-        nc_zero = no_crash_data_zero[no_crash_data_zero['ranking'] == 1]
-        nc_zero_group_counts = nc_zero.groupby('group_id').size().rename('n').reset_index()
-        for i in range(1,7):
-            num = int((nc_zero_group_counts['n'] == i).sum()) if not nc_zero_group_counts.empty else 0
-            wln(f"Number of groups with exactly {i} best interventions: {num}")
-
-        # Action counts for no_crash zero section
-        action_counts_nc_zero = (nc_zero
-                                .groupby('iaction', as_index=False)
-                                .agg(total_selected=('iaction','size'),
-                                     safe_count=('potential_crash_after_intervention', lambda x: (x == 'False').sum()),
-                                     unsafe_count=('potential_crash_after_intervention', lambda x: (x == 'True').sum()))
-                                ).sort_values('iaction')
-
-        wln("\nNumber of actions selected for each intervention type:")
-        if action_counts_nc_zero.shape[0] == 0:
-            wln("(none)\n")
-        else:
-            for _, r in action_counts_nc_zero.iterrows():
-                wln(f"{r['iaction']} : Selected {int(r['total_selected'])} times, Safe {int(r['safe_count'])} times, Unsafe {int(r['unsafe_count'])} times")
-
-        total_safe_nc_zero = int((nc_zero['potential_crash_after_intervention'] == 'False').sum())
-        total_unsafe_nc_zero = int((nc_zero['potential_crash_after_intervention'] == 'True').sum())
-
-        wln("\nTotal safe/unsafe actions:")
-        wln(f"Total safe actions: {total_safe_nc_zero}")
-        wln(f"Total unsafe actions: {total_unsafe_nc_zero}")
-
-        # Transition matrix for no_crash zero section
-        wln("\nTransition matrix (before -> after):")
-        if not nc_zero.empty:
-            trans_nc_zero = pd.crosstab(nc_zero['potential_crash_before_intervention'], nc_zero['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-            f_t_zero = int(trans_nc_zero.loc['False','True']) if ('False' in trans_nc_zero.index and 'True' in trans_nc_zero.columns) else 0
-            f_f_zero = int(trans_nc_zero.loc['False','False']) if ('False' in trans_nc_zero.index and 'False' in trans_nc_zero.columns) else 0
-            g_ft_zero = int(nc_zero[(nc_zero['potential_crash_before_intervention']=='False') & (nc_zero['potential_crash_after_intervention']=='True')]['group_id'].nunique())
-            g_ff_zero = int(nc_zero[(nc_zero['potential_crash_before_intervention']=='False') & (nc_zero['potential_crash_after_intervention']=='False')]['group_id'].nunique())
-            wln(f"    False -> True: {f_t_zero} (from {g_ft_zero} groups)")
-            wln(f"    False -> False: {f_f_zero} (from {g_ff_zero} groups)")
-        else:
-            wln("    (no data)")
-
-        # NO CRASH SECTION - NON-ZERO OCCURRENCES (>=1)
-        wln("\n\n=== NO CRASH SECTION - NON-ZERO OCCURRENCES (>=1) ===")
-        wln("(Data from rows where potential_crash_before_intervention is False and frequency >= 1)\n")
-
-        nc_nonzero = no_crash_data_nonzero[no_crash_data_nonzero['ranking'] == 1]
-        nc_nonzero_group_counts = nc_nonzero.groupby('group_id').size().rename('n').reset_index()
-        for i in range(1,7):
-            num = int((nc_nonzero_group_counts['n'] == i).sum()) if not nc_nonzero_group_counts.empty else 0
-            wln(f"Number of groups with exactly {i} best interventions: {num}")
-
-        # Action counts for no_crash nonzero section
-        action_counts_nc_nonzero = (nc_nonzero
-                                   .groupby('iaction', as_index=False)
-                                   .agg(total_selected=('iaction','size'),
-                                        safe_count=('potential_crash_after_intervention', lambda x: (x == 'False').sum()),
-                                        unsafe_count=('potential_crash_after_intervention', lambda x: (x == 'True').sum()))
-                                   ).sort_values('iaction')
-
-        wln("\nNumber of actions selected for each intervention type:")
-        if action_counts_nc_nonzero.shape[0] == 0:
-            wln("(none)\n")
-        else:
-            for _, r in action_counts_nc_nonzero.iterrows():
-                wln(f"{r['iaction']} : Selected {int(r['total_selected'])} times, Safe {int(r['safe_count'])} times, Unsafe {int(r['unsafe_count'])} times")
-
-        total_safe_nc_nonzero = int((nc_nonzero['potential_crash_after_intervention'] == 'False').sum())
-        total_unsafe_nc_nonzero = int((nc_nonzero['potential_crash_after_intervention'] == 'True').sum())
-
-        wln("\nTotal safe/unsafe actions:")
-        wln(f"Total safe actions: {total_safe_nc_nonzero}")
-        wln(f"Total unsafe actions: {total_unsafe_nc_nonzero}")
-
-        # Transition matrix for no_crash nonzero section
-        wln("\nTransition matrix (before -> after):")
-        if not nc_nonzero.empty:
-            trans_nc_nonzero = pd.crosstab(nc_nonzero['potential_crash_before_intervention'], nc_nonzero['potential_crash_after_intervention']).reindex(index=before_levels, columns=after_levels, fill_value=0)
-            f_t_nonzero = int(trans_nc_nonzero.loc['False','True']) if ('False' in trans_nc_nonzero.index and 'True' in trans_nc_nonzero.columns) else 0
-            f_f_nonzero = int(trans_nc_nonzero.loc['False','False']) if ('False' in trans_nc_nonzero.index and 'False' in trans_nc_nonzero.columns) else 0
-            g_ft_nonzero = int(nc_nonzero[(nc_nonzero['potential_crash_before_intervention']=='False') & (nc_nonzero['potential_crash_after_intervention']=='True')]['group_id'].nunique())
-            g_ff_nonzero = int(nc_nonzero[(nc_nonzero['potential_crash_before_intervention']=='False') & (nc_nonzero['potential_crash_after_intervention']=='False')]['group_id'].nunique())
-            wln(f"    False -> True: {f_t_nonzero} (from {g_ft_nonzero} groups)")
-            wln(f"    False -> False: {f_f_nonzero} (from {g_ff_nonzero} groups)")
-        else:
-            wln("    (no data)")
-
+    # ATOMIZED contingency report (Feature 3): sections split by zero / non-zero frequency
+    write_atomized_table(cube, ct_atom_txt)
     print("Saved atomized contingency table to", ct_atom_txt)
 
+    # The same counts, machine-readable, for the table and graph scripts
+    write_contingency_json(cube, ct_json)
+    print("Saved contingency counts to", ct_json, flush=True)
+
+    summary = {'groups': len(best_int)}
+    for before in ['True', 'False']:
+        for after in ['True', 'False']:
+            summary[f"{before}_{after}"] = cube.count(before, after, chosen=True)
+    return summary
+
+
+def _init_worker(no_crashes_set, frequency_counts):
+    """Pool initializer: keeps the lookup arrays built by the parent."""
+    global _no_crashes_set, _frequency_counts
+    _no_crashes_set = no_crashes_set
+    _frequency_counts = frequency_counts
+
+
+def _run_config(rep_num, perc):
+    """Processes one configuration; returns (summary or None, error message or None, seconds)."""
+    start = time.time()
+    try:
+        return process_rep_perc(rep_num, perc, _no_crashes_set, _frequency_counts), None, time.time() - start
+    except Exception as e:
+        print(f"[Error] processing rep {rep_num} perc {perc}: {e}", flush=True)
+        return None, str(e), time.time() - start
+
+
+def process_all(configs, no_crashes_set, frequency_counts, workers=1):
+    """
+    Processes the (rep, percentage) configurations and returns their
+    _run_config results by configuration. With workers > 1 they run
+    concurrently in forked worker processes, each writing the outputs of its
+    configurations. The lookup arrays are built once by the caller; forked
+    workers share their pages copy-on-write (they are only read), and where
+    fork is unavailable they are pickled to each worker once, a few KB.
+    """
+    _init_worker(no_crashes_set, frequency_counts)
+    workers = min(workers, len(configs))
+    if workers <= 1:
+        return {config: _run_config(*config) for config in configs}
+
+    # Explicitly fork: newer Pythons default to forkserver/spawn on every platform
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(no_crashes_set, frequency_counts)) as executor:
+        futures = {executor.submit(_run_config, *config): config for config in configs}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+def print_summary(configs, results):
+    """Final summary: randomly selected best interventions of every configuration."""
+    print("\n=== SUMMARY ===")
+    print(f"{'config':<10} {'groups':>6} {'T->T':>6} {'T->F':>6} {'F->F':>6} {'F->T':>6} {'time':>8}")
+    failed = 0
+    for rep, perc in configs:
+        summary, error, seconds = results[(rep, perc)]
+        name = f"rep_{rep}/{perc}"
+        if error is not None:
+            failed += 1
+            print(f"{name:<10} [Error] {error}")
+        elif summary is None:
+            print(f"{name:<10} skipped (no twin_networks_results.csv)")
+        else:
+            print(f"{name:<10} {summary['groups']:>6} " +
+                  " ".join(f"{summary[key]:>6}" for key in ['True_True', 'True_False', 'False_False', 'False_True']) +
+                  f" {seconds:>7.2f}s")
+    return failed
+
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python3 summarize_twin_networks.py <num_reps> <percentages_comma_separated>")
-        print("Example: python3 summarize_twin_networks.py 5 01,25,50,75,90")
+    args = sys.argv[1:]
+    workers = NUM_WORKERS
+    # --workers N processes N configurations at a time (1: serially)
+    if "--workers" in args:
+        idx = args.index("--workers")
+        try:
+            workers = int(args[idx + 1])
+        except (IndexError, ValueError):
+            workers = 0
+        del args[idx:idx + 2]
+    if len(args) != 2 or workers < 1:
+        print("Usage: python3 best_interventions_with_frequency.py <num_reps> <percentages_comma_separated> [--workers N]")
+        print("Example: python3 best_interventions_with_frequency.py 5 01,25,50,75,90 --workers 8")
         sys.exit(1)
 
-    num_reps = int(sys.argv[1])
-    percentages = sys.argv[2].split(",")
+    num_reps = int(args[0])
+    percentages = args[1].split(",")
+    configs = [(rep, perc) for rep in range(1, num_reps + 1) for perc in percentages]
 
     # Load no_crashes
     if not os.path.exists(NO_CRASHES_PATH):
         print(f"[Error] no_crashes file not found at {NO_CRASHES_PATH}. Please update NO_CRASHES_PATH in the script or place the file there.")
         sys.exit(1)
     no_crashes_df = pd.read_csv(NO_CRASHES_PATH, dtype=str)
+    # Keys of the (action, state) pairs; every state column must be in no_crashes.csv
+    missing = missing_columns(no_crashes_df)
+    if missing:
+        print(f"[Error] no_crashes.csv lacks columns {missing}; cannot compute potential_crash_*.")
+        sys.exit(1)
+    no_crashes_set = key_set(encode(no_crashes_df))
+
+    # Frequencies of complete_DB_discrete.csv, counted once into the cached frequency cube
+    frequency_counts = load_frequency_counts(COMPLETE_DB_PATH)
 
-    for rep in range(1, num_reps + 1):
-        for perc in percentages:
-            try:
-                process_rep_perc(rep, perc, no_crashes_df)
-            except Exception as e:
-                print(f"[Error] processing rep {rep} perc {perc}: {e}", flush=True)
+    start_all = time.time()
+    results = process_all(configs, no_crashes_set, frequency_counts, workers=workers)
+    failed = print_summary(configs, results)
 
-    print("\nAll processing done.")
+    print(f"\nAll processing done in {time.time() - start_all:.2f}s"
+          + (f", {failed} configurations failed." if failed else "."))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Aggregation cube behind contingency_table.txt and contingency_table_atomized.txt.
+
+Every number of the contingency reports counts best interventions (rows with
+ranking == 1) or the groups they belong to. ContingencyCube counts them in a
+single pass over the annotated results into
+
+    rows[before, bucket, ties, iaction, after, chosen]
+    groups[before, bucket, ties, after]
+
+where before / after are potential_crash_before/after_intervention (index 0
+is 'True', 1 is 'False'), bucket is the frequency bucket of BUCKETS, ties the
+number of best interventions of the row's group, iaction an index of
+self.actions (sorted names) and chosen whether the row is the randomly
+selected best intervention of its group. groups counts distinct groups, and
+group_sizes[before, bucket, ties] the groups of each cell. A group's rows
+share the observed action and state, hence before and bucket, so summing
+group counts over those axes counts every group once.
+
+The report writers only read the cube; write_contingency_json saves the same
+numbers as contingency.json for the table and graph scripts.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+
+LEVELS = ['True', 'False']
+# Frequency of the observed action and state: unknown ('NA'), 0 or >= 1
+BUCKETS = ['NA', 'zero', 'nonzero']
+# Tie counts reported, "groups with exactly i best interventions"
+MAX_TIES = 6
+
+
+def _level(values):
+    """Index in LEVELS of a column of "True"/"False" strings (or booleans)."""
+    return np.where(values.astype(str).to_numpy() == 'True', 0, 1)
+
+
+def _bucket(frequency):
+    numbers = pd.to_numeric(frequency, errors='coerce').to_numpy()
+    return np.where(np.isnan(numbers) | (numbers < 0), 0, np.where(numbers == 0, 1, 2))
+
+
+class ContingencyCube:
+    """Counts of the best interventions of one annotated results frame."""
+
+    def __init__(self, df):
+        best = df[df['ranking'] == 1]
+        self.actions = sorted(best['iaction'].astype(str).unique())
+        n = len(best)
+        before = _level(best['potential_crash_before_intervention'])
+        after = _level(best['potential_crash_after_intervention'])
+        if 'frequency' in best.columns:
+            bucket = _bucket(best['frequency'])
+        else:
+            bucket = np.zeros(n, dtype=np.int64)
+        if 'best_intervention' in best.columns:
+            chosen = (best['best_intervention'] == '*').to_numpy().astype(np.int64)
+        else:
+            chosen = np.zeros(n, dtype=np.int64)
+        iaction = pd.Categorical(best['iaction'].astype(str), categories=self.actions).codes.astype(np.int64)
+        group = pd.factorize(best['group_id'])[0]
+
+        # Best interventions per (group, before, bucket) cell
+        cell = (group * len(LEVELS) + before) * len(BUCKETS) + bucket
+        _, inverse, sizes = np.unique(cell, return_inverse=True, return_counts=True)
+        ties = sizes[inverse]
+        max_ties = max(MAX_TIES, int(ties.max()) if n else 0)
+
+        shape = (len(LEVELS), len(BUCKETS), max_ties + 1, len(self.actions), len(LEVELS), 2)
+        flat = np.ravel_multi_index((before, bucket, ties, iaction, after, chosen), shape)
+        self.rows = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+
+        group_shape = shape[:3] + (len(LEVELS),)
+        flat = np.unique(group * np.prod(group_shape) + np.ravel_multi_index((before, bucket, ties, after), group_shape))
+        self.groups = np.bincount(flat % np.prod(group_shape), minlength=int(np.prod(group_shape))).reshape(group_shape)
+        first = np.unique(cell, return_index=True)[1]
+        self.group_sizes = np.zeros(shape[:3], dtype=np.int64)
+        np.add.at(self.group_sizes, (before[first], bucket[first], ties[first]), 1)
+
+    @staticmethod
+    def _index(before, bucket, ties):
+        return (LEVELS.index(before),
+                slice(None) if bucket is None else BUCKETS.index(bucket),
+                slice(None) if ties is None else ties)
+
+    def count(self, before, after=None, bucket=None, ties=None, chosen=None):
+        """Best interventions with the given values (None: any)."""
+        rows = self.rows[self._index(before, bucket, ties)]
+        rows = rows if after is None else rows[..., LEVELS.index(after), :]
+        rows = rows if chosen is None else rows[..., int(chosen)]
+        return int(rows.sum())
+
+    def count_groups(self, before, after, bucket=None, ties=None):
+        """Groups with a best intervention going from before to after."""
+        return int(self.groups[self._index(before, bucket, ties) + (LEVELS.index(after),)].sum())
+
+    def groups_with_ties(self, before, ties, bucket=None):
+        """Groups with exactly ties best interventions."""
+        return int(self.group_sizes[self._index(before, bucket, ties)].sum())
+
+    def action_counts(self, before, bucket=None):
+        """[(iaction, selected, safe, unsafe)] of the iactions selected at least once."""
+        if not self.actions:
+            return []
+        rows = self.rows[self._index(before, bucket, None)]
+        # Leaves iaction x after
+        per_action = rows.sum(axis=-1).reshape(-1, len(self.actions), len(LEVELS)).sum(axis=0)
+        return [(action, int(unsafe + safe), int(safe), int(unsafe))
+                for action, (unsafe, safe) in zip(self.actions, per_action) if unsafe + safe]
+
+
+def _write_section(wln, cube, before, bucket=None):
+    """Tie counts, action counts and totals of a section."""
+    for i in range(1, MAX_TIES + 1):
+        wln(f"Number of groups with exactly {i} best interventions: {cube.groups_with_ties(before, i, bucket)}")
+
+    wln("\nNumber of actions selected for each intervention type:")
+    actions = cube.action_counts(before, bucket)
+    if not actions:
+        wln("(none)\n")
+    for action, selected, safe, unsafe in actions:
+        wln(f"{action} : Selected {selected} times, Safe {safe} times, Unsafe {unsafe} times")
+
+    wln("\nTotal safe/unsafe actions:")
+    wln(f"Total safe actions: {cube.count(before, 'False', bucket)}")
+    wln(f"Total unsafe actions: {cube.count(before, 'True', bucket)}")
+
+
+def _write_transitions(wln, cube, before, bucket=None, ties=None):
+    for after in LEVELS:
+        wln(f"    {before} -> {after}: {cube.count(before, after, bucket, ties)} "
+            f"(from {cube.count_groups(before, after, bucket, ties)} groups)")
+
+
+def write_contingency_table(cube, path):
+    """Writes contingency_table.txt (crash and no crash sections, final summary)."""
+    with open(path, "w") as out:
+        def wln(s=""):
+            out.write(s + "\n")
+
+        for before, title, name, gap in [('True', "CRASH SECTION", "crash", "\n"),
+                                         ('False', "NO CRASH SECTION", "no-crash", "\n\n")]:
+            if before == 'False':
+                wln("\n")
+            wln(f"=== {title} ===")
+            wln(f"(Data from rows where potential_crash_before_intervention is {before})\n")
+            _write_section(wln, cube, before)
+
+            wln("\nTransition matrix (before -> after):")
+            _write_transitions(wln, cube, before)
+
+            wln(f"{gap}Detailed transition matrices by number of ties ({title}):")
+            if not cube.count(before):
+                wln(f"(no ranking==1 rows in {name} section)\n")
+                continue
+            for i in range(1, MAX_TIES + 1):
+                if not cube.groups_with_ties(before, i):
+                    continue
+                wln(f"\nFor groups with {i} tied best interventions:")
+                wln("  - Transition matrix (before -> after):")
+                _write_transitions(wln, cube, before, ties=i)
+
+        wln("\n\n=== FINAL SUMMARY ===")
+        if not cube.count('True', chosen=True) + cube.count('False', chosen=True):
+            wln("Random selection - no best_int rows found.")
+        else:
+            for before, after in [('True', 'True'), ('False', 'False'), ('True', 'False'), ('False', 'True')]:
+                wln(f"Random selection - Crash before ({before}) and after intervention ({after}): "
+                    f"{cube.count(before, after, chosen=True)}")
+
+
+def write_atomized_table(cube, path):
+    """Writes contingency_table_atomized.txt (sections split by zero / non-zero frequency)."""
+    with open(path, "w") as out:
+        def wln(s=""):
+            out.write(s + "\n")
+
+        first = True
+        for before, title in [('True', "CRASH SECTION"), ('False', "NO CRASH SECTION")]:
+            for bucket, heading, condition in [('zero', "ZERO OCCURRENCES", "frequency = 0"),
+                                               ('nonzero', "NON-ZERO OCCURRENCES (>=1)", "frequency >= 1")]:
+                if not first:
+                    wln("\n")
+                first = False
+                wln(f"=== {title} - {heading} ===")
+                wln(f"(Data from rows where potential_crash_before_intervention is {before} and {condition})\n")
+                _write_section(wln, cube, before, bucket)
+
+                wln("\nTransition matrix (before -> after):")
+                if cube.count(before, bucket=bucket):
+                    _write_transitions(wln, cube, before, bucket)
+                else:
+                    wln("    (no data)")
+
+
+# Sections of contingency.json: key, potential_crash_before_intervention
+SECTIONS = [('crash', 'True'), ('no_crash', 'False')]
+
+
+def _section(cube, before, bucket=None):
+    """Counts of one section, keyed like the text report."""
+    transitions = {f"{before}_{after}": {"rows": cube.count(before, after, bucket),
+                                         "groups": cube.count_groups(before, after, bucket)}
+                   for after in LEVELS}
+    return {
+        "ties": [cube.groups_with_ties(before, i, bucket) for i in range(1, MAX_TIES + 1)],
+        "actions": {action: {"selected": selected, "safe": safe, "unsafe": unsafe}
+                    for action, selected, safe, unsafe in cube.action_counts(before, bucket)},
+        "totals": {"safe": cube.count(before, 'False', bucket), "unsafe": cube.count(before, 'True', bucket)},
+        "transitions": transitions,
+    }
+
+
+def contingency_summary(cube, atomized=True):
+    """
+    The numbers of both reports as a dict: sections (crash / no_crash, with
+    the transitions per tie count), atomized (the same sections per zero /
+    nonzero frequency bucket) and final_summary (the randomly chosen rows).
+    """
+    summary = {"sections": {}, "final_summary": {}}
+    for key, before in SECTIONS:
+        section = _section(cube, before)
+        section["ties_transitions"] = {
+            str(i): {f"{before}_{after}": {"rows": cube.count(before, after, ties=i),
+                                           "groups": cube.count_groups(before, after, ties=i)}
+                     for after in LEVELS}
+            for i in range(1, MAX_TIES + 1) if cube.groups_with_ties(before, i)}
+        summary["sections"][key] = section
+        for after in LEVELS:
+            summary["final_summary"][f"{before}_{after}"] = cube.count(before, after, chosen=True)
+    if atomized:
+        summary["atomized"] = {key: {bucket: _section(cube, before, bucket) for bucket in ['zero', 'nonzero']}
+                               for key, before in SECTIONS}
+    return summary
+
+
+def write_contingency_json(cube, path, atomized=True):
+    """Writes contingency.json, read by the table and graph scripts instead of the text reports."""
+    with open(path, "w") as out:
+        json.dump(contingency_summary(cube, atomized), out, indent=1)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Per-fold checkpoints of a test_cBNs.py configuration.
+
+Every finished fold is pickled atomically to CHECKPOINT_DIR/fold_<i>.pkl
+inside the configuration's cBNs directory and recorded in the manifest of
+the process that ran it (manifest.<node>.json next to it), so an
+interrupted run resumes with the folds that are still missing. The
+manifest records content hashes of the fold's inputs (cBN_<i>.pl and
+test_fold_<i>.csv), and a checkpoint only counts as complete while they
+still match: retraining re-evaluates exactly the folds whose program
+changed, and the others are reused. Once every fold is in, ConfigWriter
+merges the checkpoints in group_id order into the configuration's
+outputs, splicing re-evaluated folds in with the reused ones.
+
+Several processes, on one machine or on several machines sharing the rep
+directories over NFS, can work on the same configurations: a process
+claims a fold by creating fold_<i>.lease with O_EXCL before running it
+and removes it once the checkpoint is written. A lease whose file has not
+been touched for LEASE_SECONDS is considered abandoned (its process
+crashed) and can be taken over. Races on expired leases can at worst make
+two processes run the same fold; checkpoints are written atomically, so
+the outputs are not affected. A process keeps its leases alive with
+renew(), or with keep_alive() around work done in the calling thread.
+
+Every process writes its own manifest, so they pile up over reruns and
+shards; the process that merges a configuration folds them into its own
+with compact(). clear() refuses to remove the checkpoints while another
+process holds a live lease on the configuration.
+"""
+
+import os
+import glob
+import hashlib
+import json
+import time
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+
+CHECKPOINT_DIR = ".folds"
+MANIFEST_PREFIX = "manifest"
+# Age after which an untouched lease is considered abandoned
+LEASE_SECONDS = 30 * 60
+# Identifies this process in leases and manifests
+NODE_ID = f"{socket.gethostname()}.{os.getpid()}"
+
+
+def file_digest(path):
+    """sha256 of the bytes of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _atomic_write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FoldCheckpoints:
+    """Checkpoint directory of one (rep, percentage) configuration."""
+
+    def __init__(self, models_subdir):
+        self.dir = os.path.join(models_subdir, CHECKPOINT_DIR)
+        self.manifest_path = os.path.join(self.dir, f"{MANIFEST_PREFIX}.{NODE_ID}.json")
+        os.makedirs(self.dir, exist_ok=True)
+        self.manifest = {"folds": {}}
+        self.held = set()
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads the manifests of every process, picking up folds finished elsewhere."""
+        manifests = [self.manifest]
+        for path in glob.glob(os.path.join(self.dir, f"{MANIFEST_PREFIX}*.json")):
+            try:
+                with open(path) as f:
+                    manifests.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        # The latest entry of a fold describes its current checkpoint
+        self.finished = {}
+        for manifest in manifests:
+            for fold, entry in manifest.get("folds", {}).items():
+                if entry.get("saved", 0) >= self.finished.get(fold, {}).get("saved", 0):
+                    self.finished[fold] = entry
+
+    def path(self, fold):
+        return os.path.join(self.dir, f"fold_{fold}.pkl")
+
+    def completed(self, fold, inputs, hashes):
+        """
+        Whether fold has a checkpoint for inputs with the content hashes
+        hashes (a dict). Entries without hashes, from older manifests, are
+        complete while the checkpoint is newer than every path in inputs.
+        """
+        entry = self.finished.get(str(fold))
+        if entry is None or not os.path.exists(self.path(fold)):
+            return False
+        if all(key in entry for key in hashes):
+            return all(entry[key] == value for key, value in hashes.items())
+        try:
+            saved = os.path.getmtime(self.path(fold))
+            return all(os.path.getmtime(p) <= saved for p in inputs)
+        except OSError:
+            return False
+
+    def save(self, fold, output, hashes):
+        """Checkpoints the run_fold output of fold, then records it with its input hashes in the manifest."""
+        _atomic_write(self.path(fold), pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL))
+        entry = {"queries": len(output[0]), "elapsed": output[2], "saved": time.time()}
+        entry.update(hashes)
+        self.manifest["folds"][str(fold)] = entry
+        _atomic_write(self.manifest_path, json.dumps(self.manifest, indent=1).encode())
+        self.finished[str(fold)] = entry
+
+    def load(self, fold):
+        with open(self.path(fold), "rb") as f:
+            return pickle.load(f)
+
+    def clear(self):
+        """
+        Forgets every checkpoint of the configuration; returns False, and
+        leaves them alone, while other processes hold live leases on it.
+        """
+        if self.live_leases():
+            return False
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir, exist_ok=True)
+        self.manifest = {"folds": {}}
+        self.finished = {}
+        self.held = set()
+        return True
+
+    def compact(self):
+        """
+        Moves the latest entry of every checkpointed fold into this process's
+        manifest and removes the manifests of the other processes.
+        """
+        self.refresh()
+        self.manifest["folds"] = {fold: entry for fold, entry in self.finished.items()
+                                  if os.path.exists(self.path(fold))}
+        _atomic_write(self.manifest_path, json.dumps(self.manifest, indent=1).encode())
+        for path in glob.glob(os.path.join(self.dir, f"{MANIFEST_PREFIX}*.json")):
+            if path != self.manifest_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.refresh()
+
+    def live_leases(self):
+        """Units leased by other processes whose leases have not expired."""
+        units = []
+        for path in glob.glob(os.path.join(self.dir, "fold_*.lease")):
+            try:
+                with open(path) as f:
+                    holder = f.read().strip()
+                if holder != NODE_ID and time.time() - os.path.getmtime(path) < LEASE_SECONDS:
+                    units.append(os.path.basename(path)[len("fold_"):-len(".lease")])
+            except OSError:
+                continue
+        return units
+
+    def lease_path(self, unit):
+        return os.path.join(self.dir, f"fold_{unit}.lease")
+
+    def claim(self, unit):
+        """
+        Takes the lease of unit (a fold, or "merge"); returns False if another
+        live process holds it.
+        """
+        path = self.lease_path(unit)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) < LEASE_SECONDS:
+                        return False
+                    # Abandoned: whoever renames it away first takes it over
+                    stale = f"{path}.{NODE_ID}.stale"
+                    os.rename(path, stale)
+                    os.remove(stale)
+                except OSError:
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{NODE_ID}\n")
+            self.held.add(unit)
+            return True
+        return False
+
+    def renew(self, unit):
+        """Keeps a held lease from expiring."""
+        if unit in self.held:
+            try:
+                os.utime(self.lease_path(unit))
+            except OSError:
+                pass
+
+    @contextmanager
+    def keep_alive(self, unit, interval=LEASE_SECONDS / 3):
+        """Renews the lease of unit from a timer thread while the with block runs."""
+        stop = threading.Event()
+        def renew_until_stopped():
+            while not stop.wait(interval):
+                self.renew(unit)
+        thread = threading.Thread(target=renew_until_stopped, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, unit):
+        if unit in self.held:
+            self.held.discard(unit)
+            try:
+                # Unless it expired and was taken over meanwhile
+                with open(self.lease_path(unit)) as f:
+                    if f.read().strip() == NODE_ID:
+                        os.remove(self.lease_path(unit))
+            except OSError:
+                pass
+
+    def release_all(self):
+        for unit in list(self.held):
+            self.release(unit)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Mergeable latency histograms.
+
+LatencyHistogram is an HDR-histogram-style summary of per-query times: values
+are counted in log-linear buckets (SUB_BUCKETS linear buckets per power of
+two of microseconds), so any percentile is known to within 1/SUB_BUCKETS of
+its value while the memory use only grows with the range of the latencies,
+not with the number of queries. Histograms of different folds merge by
+adding their bucket counts; the exact mean, standard deviation and maximum
+are carried along.
+
+test_cBNs.py builds one histogram per fold and merges them per (rep,
+percentage) and per cBN structure for testing_numeralia.txt.
+"""
+
+import math
+
+# Linear buckets per power of two (relative error below 1/SUB_BUCKETS)
+SUB_BITS = 7
+SUB_BUCKETS = 1 << SUB_BITS
+# Percentiles reported in testing_numeralia.txt
+PERCENTILES = [50, 90, 99]
+
+
+def _bucket(micros):
+    """Bucket index of a latency in whole microseconds."""
+    if micros < SUB_BUCKETS:
+        return micros
+    shift = micros.bit_length() - SUB_BITS - 1
+    return ((shift + 1) << SUB_BITS) + (micros >> shift) - SUB_BUCKETS
+
+
+def _bucket_upper(index):
+    """Largest latency in microseconds counted in bucket index."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return (((index & (SUB_BUCKETS - 1)) + SUB_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in seconds with exact count, mean, stdev and max."""
+
+    def __init__(self, values=()):
+        self.counts = {}
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = 0.0
+        for value in values:
+            self.add(value)
+
+    def add(self, seconds):
+        """Records one latency in seconds."""
+        index = _bucket(max(int(seconds * 1e6), 0))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        # Welford's running mean and sum of squared deviations
+        self.count += 1
+        delta = seconds - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (seconds - self.mean)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """Adds the latencies of another histogram to this one."""
+        if not other.count:
+            return self
+        for index, n in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + n
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.max = max(self.max, other.max)
+        return self
+
+    def stdev(self):
+        """Sample standard deviation (0 with fewer than two latencies)."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def percentile(self, q):
+        """Latency in seconds below which q percent of the latencies fall."""
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min((_bucket_upper(index) + 1) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        """[p50, p90, p99, max] in seconds."""
+        return [self.percentile(q) for q in PERCENTILES] + [self.max]
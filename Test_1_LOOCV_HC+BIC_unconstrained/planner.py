@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Runtime-aware planning of test_cBNs.py runs.
+
+The cost of a fold is predicted from the size of its cBN program with a
+linear model fitted to earlier runs: every rep_*/*/cBNs/twin_networks_results.csv
+found gives the time of each of its folds (the sum of their elapsed_time)
+next to the size of the fold's cBN_<i>.pl. Only runs of the same strategy
+count, since the knowledge compilers and the twin network differ by orders
+of magnitude; test_cBNs.py records the strategy of a run in strategy.txt
+next to its results. Without any history, costs are proportional to program
+size.
+
+plan() orders the folds longest first (LPT scheduling), which keeps the
+expensive folds from landing at the end of a parallel run, and estimates
+the makespan on a given number of workers; Progress turns the predictions
+into an ETA while the run goes on, rescaled by how fast folds really finish.
+"""
+
+import os
+import glob
+import heapq
+import numpy as np
+
+from results_io import read_results
+
+STRATEGY_FILE = "strategy.txt"
+# Strategy of the runs without STRATEGY_FILE, from before it was recorded
+LEGACY_STRATEGY = "sharpsat-td"
+
+
+def program_size(input_pl):
+    """Size of a cBN program in bytes (0 if missing)."""
+    try:
+        return os.path.getsize(input_pl)
+    except OSError:
+        return 0
+
+
+def read_fold_times(results_csv):
+    """Returns {group_id: seconds} from a twin_networks_results.csv (or its Parquet copy)."""
+    try:
+        df = read_results(results_csv, columns=['group_id', 'elapsed_time'])
+    except (OSError, ValueError):
+        return {}
+    times = df.groupby('group_id')['elapsed_time'].sum()
+    return {int(fold): float(seconds) for fold, seconds in times.items()}
+
+
+def run_strategy(strategy, compile_once=False):
+    """Name of the strategy of a run, as recorded in STRATEGY_FILE."""
+    return f"{strategy}+compile-once" if compile_once else strategy
+
+
+def write_strategy(models_subdir, strategy):
+    with open(os.path.join(models_subdir, STRATEGY_FILE), "w") as f:
+        f.write(strategy + "\n")
+
+
+def read_strategy(models_subdir):
+    """Strategy recorded next to the results of a run, LEGACY_STRATEGY if none was."""
+    try:
+        with open(os.path.join(models_subdir, STRATEGY_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return LEGACY_STRATEGY
+
+
+def collect_history(base_dir, strategy=None):
+    """
+    Returns [(program size, fold seconds)] for every fold of earlier runs
+    under base_dir, only of runs with the given strategy (run_strategy) if
+    one is given.
+    """
+    samples = []
+    for results_csv in glob.glob(os.path.join(base_dir, "rep_*", "*", "cBNs", "twin_networks_results.csv")):
+        models_subdir = os.path.dirname(results_csv)
+        if strategy is not None and read_strategy(models_subdir) != strategy:
+            continue
+        for fold, seconds in read_fold_times(results_csv).items():
+            size = program_size(os.path.join(models_subdir, f"cBN_{fold}.pl"))
+            if size:
+                samples.append((size, seconds))
+    return samples
+
+
+class CostModel:
+    """Predicted seconds of a fold as a linear function of its program size."""
+
+    def __init__(self, samples=()):
+        self.intercept = 0.0
+        self.slope = 1.0
+        self.fitted = False
+        if samples:
+            sizes = np.array([s for s, _ in samples], dtype=float)
+            seconds = np.array([t for _, t in samples], dtype=float)
+            if len(np.unique(sizes)) > 1:
+                self.slope, self.intercept = np.polyfit(sizes, seconds, 1)
+            else:
+                self.slope, self.intercept = seconds.mean() / sizes.mean(), 0.0
+            self.fitted = True
+
+    def predict(self, size):
+        # Never predict less than the smallest positive cost, so that the
+        # order stays meaningful when the fitted line crosses zero
+        return max(self.intercept + self.slope * size, 1e-3)
+
+
+def plan(tasks, costs, workers):
+    """
+    Orders tasks longest first and simulates them on workers; returns
+    (ordered tasks, predicted makespan in seconds).
+    """
+    ordered = sorted(tasks, key=lambda task: costs[task], reverse=True)
+    loads = [0.0] * max(workers, 1)
+    for task in ordered:
+        heapq.heapreplace(loads, loads[0] + costs[task])
+    return ordered, max(loads)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+class Progress:
+    """ETA of a planned run, corrected by the ratio of actual to predicted fold times."""
+
+    def __init__(self, costs, workers):
+        self.costs = costs
+        self.workers = max(workers, 1)
+        self.remaining = sum(costs.values())
+        self.predicted_done = 0.0
+        self.actual_done = 0.0
+
+    def done(self, task, seconds):
+        """Records a finished task; returns the estimated seconds left."""
+        cost = self.costs.get(task, 0.0)
+        self.remaining -= cost
+        self.predicted_done += cost
+        self.actual_done += seconds
+        scale = self.actual_done / self.predicted_done if self.predicted_done else 1.0
+        return max(self.remaining, 0.0) * scale / self.workers
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Per-query phase profiling.
+
+Code paths wrap their stages in phase(name) (perf_counter_ns, exclusive of
+nested phases) and run_whatif takes a QueryTimer around every query, so each
+query gets a record with the time spent in every phase of PHASES since the
+previous one, its CPU time, the size of the circuit that answered it and the
+peak RSS of the process. One-off stages (parsing, grounding, compiling the
+structure) are charged to the query that triggered them.
+
+Phases: parse (program text to model/AST, including slicing), twin
+(twin-network construction), ground (clingo grounding), cnf (CNF/vtree
+generation), compile (knowledge compilation; for the external compilers the
+whole single_query, for pysdd the first multi_query) and evaluate (multi_query
+on an already compiled circuit or the twin-network sweep).
+
+test_cBNs.py writes the records of a configuration to query_profile.parquet
+next to twin_networks_results.csv.
+"""
+
+import os
+import time
+import resource
+from contextlib import contextmanager
+
+PHASES = ['parse', 'twin', 'ground', 'cnf', 'compile', 'evaluate']
+PROFILE_KEYS = (['group_id', 'action', 'iaction', 'answered_by'] + [f'{p}_ns' for p in PHASES] +
+                ['wall_ns', 'cpu_ns', 'circuit_size', 'peak_rss_kb'])
+
+# Exclusive nanoseconds per phase in this process, and the open phases
+_phase_ns = dict.fromkeys(PHASES, 0)
+_open = []
+
+
+@contextmanager
+def phase(name):
+    """Charges the enclosed time, minus nested phases, to phase name."""
+    frame = [time.perf_counter_ns(), 0]
+    _open.append(frame)
+    try:
+        yield
+    finally:
+        _open.pop()
+        total = time.perf_counter_ns() - frame[0]
+        _phase_ns[name] += total - frame[1]
+        if _open:
+            _open[-1][1] += total
+
+
+class QueryTimer:
+    """Context manager measuring the phases, wall time and CPU time of one query."""
+
+    def __enter__(self):
+        self.start_phases = dict(_phase_ns)
+        self.start_cpu = time.process_time_ns()
+        self.start_wall = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_ns = time.perf_counter_ns() - self.start_wall
+        self.cpu_ns = time.process_time_ns() - self.start_cpu
+        self.phase_ns = {p: _phase_ns[p] - self.start_phases[p] for p in PHASES}
+        return False
+
+    def absorb(self, other):
+        """Adds the measurements of another finished timer to this one."""
+        self.wall_ns += other.wall_ns
+        self.cpu_ns += other.cpu_ns
+        for p in PHASES:
+            self.phase_ns[p] += other.phase_ns[p]
+
+    def record(self, row, fold, answered_by, circuit_size=None, share=1):
+        """Returns the profile record of a test row; share splits a batch evenly over its rows."""
+        record = {'group_id': fold, 'action': row['action'], 'iaction': row['iaction'],
+                  'answered_by': answered_by}
+        for p in PHASES:
+            record[f'{p}_ns'] = self.phase_ns[p] // share
+        record['wall_ns'] = self.wall_ns // share
+        record['cpu_ns'] = self.cpu_ns // share
+        record['circuit_size'] = circuit_size
+        record['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return record
+
+
+def static_record(row, fold, answered_by):
+    """Profile record of a query answered without any inference."""
+    record = {key: 0 for key in PROFILE_KEYS}
+    record.update({'group_id': fold, 'action': row['action'], 'iaction': row['iaction'],
+                   'answered_by': answered_by, 'circuit_size': None,
+                   'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+    return record
+
+
+def write_profile(records, path):
+    """Writes profile records to a Parquet file (a CSV next to it if no Parquet engine is installed)."""
+    import pandas as pd
+    df = pd.DataFrame(records, columns=PROFILE_KEYS)
+    df['circuit_size'] = df['circuit_size'].astype('Int64')
+    try:
+        df.to_parquet(path, index=False)
+    except ImportError as e:
+        csv_path = os.path.splitext(path)[0] + ".csv"
+        print(f"[Warning] Cannot write {path} ({str(e).splitlines()[0]}), writing {csv_path} instead")
+        df.to_csv(csv_path, index=False)
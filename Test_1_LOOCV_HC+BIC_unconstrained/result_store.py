@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Persistent store of counterfactual query results.
+
+Results are keyed by (program fingerprint, strategy, evidence tuple,
+intervention), where the fingerprint is circuit_cache.cache_key of the
+program text, so identical programs of different folds, reps and Test_1
+variants share their results; the strategy (knowledge compiler) keeps the
+answers and timings of different compilers apart. run_whatif consults the
+store before calling single_query and writes every new result back right
+away, so reruns after a crash or a change in the table scripts do not pay for
+the knowledge compiler again. Stored answers are tagged result_store in
+twin_networks_results.csv.
+"""
+
+import os
+import sqlite3
+
+# Bump when the answers of single_query or the key change to start a fresh store
+STORE_VERSION = 3
+# Shared by every variant, next to the circuit cache directory (circuit_cache.CACHE_DIR)
+STORE_PATH = os.path.expanduser(f"~/.cache/counterfactuals_evaluation/results.v{STORE_VERSION}.sqlite")
+
+
+class ResultStore:
+    """SQLite-backed map (fingerprint, strategy, evidence, intervention) -> (probability, elapsed_time)."""
+
+    def __init__(self, path=STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # Several processes (workers, variants) may share the store
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " fingerprint TEXT NOT NULL,"
+            " strategy TEXT NOT NULL,"
+            " evidence TEXT NOT NULL,"
+            " intervention TEXT NOT NULL,"
+            " probability REAL NOT NULL,"
+            " elapsed_time REAL NOT NULL,"
+            " PRIMARY KEY (fingerprint, strategy, evidence, intervention))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _evidence_key(evidence):
+        return ",".join(str(v) for v in evidence)
+
+    def get(self, fingerprint, strategy, evidence, intervention):
+        """Return (probability, elapsed_time) of a stored query, or None."""
+        cur = self.conn.execute(
+            "SELECT probability, elapsed_time FROM results"
+            " WHERE fingerprint = ? AND strategy = ? AND evidence = ? AND intervention = ?",
+            (fingerprint, strategy, self._evidence_key(evidence), intervention))
+        return cur.fetchone()
+
+    def put(self, fingerprint, strategy, evidence, intervention, probability, elapsed_time):
+        """Store a query result; elapsed_time is the cost of computing it."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (fingerprint, strategy, self._evidence_key(evidence), intervention,
+             float(probability), float(elapsed_time)))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
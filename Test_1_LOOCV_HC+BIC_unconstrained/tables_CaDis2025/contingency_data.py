@@ -0,0 +1,69 @@
+import os
+import re
+import json
+
+# Written by best_interventions_*.py next to contingency_table.txt
+JSON_NAME = "contingency.json"
+TEXT_NAME = "contingency_table.txt"
+
+SECTION_BANNERS = {'CRASH SECTION': 'crash', 'NO CRASH SECTION': 'no_crash'}
+BEFORE = {'crash': 'True', 'no_crash': 'False'}
+
+
+def _int(match):
+    return int(match.group(1)) if match else 0
+
+
+def parse_contingency_table(file_path):
+    """
+    Reads the counts of a contingency_table.txt into the structure of
+    contingency.json, for results written before contingency.json existed.
+    """
+    with open(file_path, 'r') as f:
+        content = f.read()
+    parts = re.split(r'=== (CRASH SECTION|NO CRASH SECTION|FINAL SUMMARY) ===', content)
+    data = {'sections': {}, 'final_summary': {}}
+    for banner, body in zip(parts[1::2], parts[2::2]):
+        if banner == 'FINAL SUMMARY':
+            for before in ['True', 'False']:
+                for after in ['True', 'False']:
+                    match = re.search(rf'Crash before \({before}\) and after intervention \({after}\):\s+(\d+)', body)
+                    data['final_summary'][f"{before}_{after}"] = _int(match)
+            continue
+        key = SECTION_BANNERS[banner]
+        before = BEFORE[key]
+        # Only the section totals, not the detailed matrices by number of ties
+        main = body.split('Detailed transition matrices')[0]
+        section = {'ties': [], 'actions': {}, 'totals': {}, 'transitions': {}}
+        for i in range(1, 7):
+            match = re.search(rf'Number of groups with exactly\s+{i}\s+best interventions:\s+(\d+)', main)
+            section['ties'].append(_int(match))
+        for action, selected, safe, unsafe in re.findall(
+                r'(\w+)\s*:\s*Selected\s+(\d+)\s*times,\s*Safe\s+(\d+)\s*times,\s*Unsafe\s+(\d+)\s*times', main):
+            section['actions'][action] = {'selected': int(selected), 'safe': int(safe), 'unsafe': int(unsafe)}
+        section['totals']['safe'] = _int(re.search(r'Total safe actions:\s+(\d+)', main))
+        section['totals']['unsafe'] = _int(re.search(r'Total unsafe actions:\s+(\d+)', main))
+        for after in ['True', 'False']:
+            match = re.search(rf'{before} -> {after}:\s+(\d+) \(from (\d+) groups\)', main)
+            section['transitions'][f"{before}_{after}"] = {
+                'rows': int(match.group(1)) if match else 0,
+                'groups': int(match.group(2)) if match else 0}
+        data['sections'][key] = section
+    return data
+
+
+def load_contingency(dir_path):
+    """
+    Returns the contingency counts of a rep_*/<percentage>/cBNs directory:
+    contingency.json if it is up to date, the parsed contingency_table.txt
+    otherwise, None if there is neither.
+    """
+    json_path = os.path.join(dir_path, JSON_NAME)
+    text_path = os.path.join(dir_path, TEXT_NAME)
+    if os.path.exists(json_path) and (not os.path.exists(text_path)
+                                      or os.path.getmtime(json_path) >= os.path.getmtime(text_path)):
+        with open(json_path, 'r') as f:
+            return json.load(f)
+    if os.path.exists(text_path):
+        return parse_contingency_table(text_path)
+    return None
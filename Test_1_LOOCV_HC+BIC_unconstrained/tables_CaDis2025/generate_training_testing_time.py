@@ -20,6 +20,16 @@ def safe_float(s):
     except:
         return np.nan
 
+# Lee twin_networks_results.csv, de su copia Parquet tipada (results_io.py) si está al día
+def read_testing(testing_file):
+    parquet_file = os.path.splitext(testing_file)[0] + '.parquet'
+    try:
+        if os.path.getmtime(parquet_file) >= os.path.getmtime(testing_file):
+            return pd.read_parquet(parquet_file, columns=['elapsed_time'])
+    except (OSError, ImportError, ValueError):
+        pass
+    return pd.read_csv(testing_file)
+
 # Procesar archivos
 for base_dir in base_dirs:
     for p in percentages:
@@ -39,7 +49,7 @@ for base_dir in base_dirs:
         testing_file = os.path.join(base_dir, p, 'cBNs', 'twin_networks_results.csv')
         if os.path.exists(testing_file):
             try:
-                df = pd.read_csv(testing_file)
+                df = read_testing(testing_file)
                 if 'elapsed_time' in df.columns:
                     testing_times[p].extend(df['elapsed_time'].astype(float).tolist())
                 else:
@@ -1,6 +1,6 @@
 import os
-import re
 from collections import defaultdict
+from contingency_data import load_contingency, JSON_NAME
 
 # Configuration
 percentages = ['01', '25', '50', '75', '90']
@@ -18,140 +18,52 @@ crash_safety_data = {p: {'Safe': 0, 'Unsafe': 0} for p in percentages}
 no_crash_transition_counts = {p: {'False_True': 0, 'False_False': 0} for p in percentages}
 final_summary = {'True_True': 0, 'True_False': 0, 'False_True': 0, 'False_False': 0}
 
-def safe_int_convert(value_str):
-    try:
-        return int(value_str.strip())
-    except:
-        return 0
-
 # Process files
 for p in percentages:
-    # Build the correct file path - files are in subdirectories like "01/cBNs/"
+    # Files are in subdirectories like "01/cBNs/"
     dir_path = os.path.join(base_dir, p, 'cBNs')
-    file_name = "contingency_table.csv"    
-    file_path = os.path.join(dir_path, file_name)
-    
-    print(f"Processing file: {file_path}")
-    
-    if not os.path.exists(file_path):
-        print(f"File not found: {file_path}")
+    print(f"Processing directory: {dir_path}")
+
+    # Counts from contingency.json (or from the text report of older runs)
+    try:
+        data = load_contingency(dir_path)
+    except Exception as e:
+        print(f"Error processing {dir_path}: {str(e)}")
+        continue
+    if data is None:
+        print(f"File not found: {os.path.join(dir_path, JSON_NAME)}")
         print(f"Looking in directory: {os.path.abspath(dir_path)}")
         # List files in the directory to debug
         if os.path.exists(dir_path):
             print(f"Files in {dir_path}: {os.listdir(dir_path)}")
         continue
-        
-    try:
-        with open(file_path, 'r') as f:
-            content = f.read()
-            
-            print(f"File size: {len(content)} characters")
-            
-            # Use the robust section parsing
-            sections = re.split(r'=== (CRASH SECTION|NO CRASH SECTION|FINAL SUMMARY) ===', content)
-            sections = [s.strip() for s in sections if s.strip()]
-            
-            print(f"Found {len(sections)} sections")
-            
-            # Process CRASH SECTION
-            crash_content = None
-            no_crash_content = None
-            summary_content = None
-            
-            for i, section in enumerate(sections):
-                if section == 'CRASH SECTION' and i + 1 < len(sections):
-                    crash_content = sections[i + 1]
-                elif section == 'NO CRASH SECTION' and i + 1 < len(sections):
-                    no_crash_content = sections[i + 1]
-                elif section == 'FINAL SUMMARY' and i + 1 < len(sections):
-                    summary_content = sections[i + 1]
-            
-            # Process CRASH SECTION
-            if crash_content:
-                print(f"Processing CRASH SECTION for {p}")
-                
-                # 1. Process ties
-                for j in range(6):
-                    pattern = re.compile(rf'Number of groups with exactly\s+{j+1}\s+best interventions:\s+(\d+)')
-                    match = pattern.search(crash_content)
-                    if match:
-                        crash_ties_data[p][j] = safe_int_convert(match.group(1))
-                        print(f"Found {j+1} ties in crash: {match.group(1)}")
-                    else:
-                        print(f"No match found for {j+1} ties in crash section")
-                
-                # 2. Process actions
-                action_lines = re.findall(r'(\w+(?:_\w+)*)\s*:\s*Selected\s+(\d+)\s*times,\s*Safe\s+(\d+)\s*times,\s*Unsafe\s+(\d+)\s*times', crash_content)
-                for action, count_str, safe_str, unsafe_str in action_lines:
-                    if action in valid_actions:
-                        count = safe_int_convert(count_str)
-                        safe_count = safe_int_convert(safe_str)
-                        crash_actions_data[p][action] = count
-                        crash_action_safety_data[p][action] = safe_count
-                        print(f"Found action {action}: count={count}, safe={safe_count}")
-                
-                # 3. Process safety transitions
-                safe_match = re.search(r'True -> False:\s+(\d+)', crash_content)
-                if safe_match:
-                    crash_safety_data[p]['Safe'] = safe_int_convert(safe_match.group(1))
-                    print(f"Found Safe (True -> False): {safe_match.group(1)}")
-                
-                unsafe_match = re.search(r'True -> True:\s+(\d+)', crash_content)
-                if unsafe_match:
-                    crash_safety_data[p]['Unsafe'] = safe_int_convert(unsafe_match.group(1))
-                    print(f"Found Unsafe (True -> True): {safe_match.group(1)}")
-            
-            # Process NO CRASH SECTION
-            if no_crash_content:
-                print(f"Processing NO CRASH SECTION for {p}")
-                
-                # 1. Process ties
-                for j in range(6):
-                    pattern = re.compile(rf'Number of groups with exactly\s+{j+1}\s+best interventions:\s+(\d+)')
-                    match = pattern.search(no_crash_content)
-                    if match:
-                        no_crash_ties_data[p][j] = safe_int_convert(match.group(1))
-                        print(f"Found {j+1} ties in no crash: {match.group(1)}")
-                
-                # 2. Process actions
-                action_lines = re.findall(r'(\w+(?:_\w+)*)\s*:\s*Selected\s+(\d+)\s*times,\s*Safe\s+(\d+)\s*times,\s*Unsafe\s+(\d+)\s*times', no_crash_content)
-                for action, count_str, safe_str, unsafe_str in action_lines:
-                    if action in valid_actions:
-                        count = safe_int_convert(count_str)
-                        safe_count = safe_int_convert(safe_str)
-                        no_crash_actions_data[p][action] = count
-                        no_crash_action_safety_data[p][action] = safe_count
-                        print(f"Found action {action}: count={count}, safe={safe_count}")
-                
-                # 3. Process transitions
-                safe_match = re.search(r'False -> False:\s+(\d+)', no_crash_content)
-                if safe_match:
-                    no_crash_transition_counts[p]['False_False'] = safe_int_convert(safe_match.group(1))
-                    print(f"Found Safe (False -> False): {safe_match.group(1)}")
-                
-                unsafe_match = re.search(r'False -> True:\s+(\d+)', no_crash_content)
-                if unsafe_match:
-                    no_crash_transition_counts[p]['False_True'] = safe_int_convert(safe_match.group(1))
-                    print(f"Found Unsafe (False -> True): {safe_match.group(1)}")
-            
-            # Process FINAL SUMMARY
-            if summary_content:
-                print(f"Processing FINAL SUMMARY for {p}")
-                
-                for transition in ['True_True', 'True_False', 'False_True', 'False_False']:
-                    before = 'True' if transition.startswith('True') else 'False'
-                    after = 'True' if transition.endswith('True') else 'False'
-                    pattern = re.compile(rf'Random selection - Crash before \({before}\) and after intervention \({after}\):\s+(\d+)')
-                    match = pattern.search(summary_content)
-                    if match:
-                        final_summary[transition] += safe_int_convert(match.group(1))
-                        print(f"Found Final Summary {transition}: {match.group(1)}")
-            
-    except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        continue
+    sections = data['sections']
+
+    # Process CRASH SECTION
+    if 'crash' in sections:
+        crash = sections['crash']
+        crash_ties_data[p] = list(crash['ties'][:6])
+        for action, counts in crash['actions'].items():
+            if action in valid_actions:
+                crash_actions_data[p][action] = counts['selected']
+                crash_action_safety_data[p][action] = counts['safe']
+        crash_safety_data[p]['Safe'] = crash['transitions']['True_False']['rows']
+        crash_safety_data[p]['Unsafe'] = crash['transitions']['True_True']['rows']
+
+    # Process NO CRASH SECTION
+    if 'no_crash' in sections:
+        no_crash = sections['no_crash']
+        no_crash_ties_data[p] = list(no_crash['ties'][:6])
+        for action, counts in no_crash['actions'].items():
+            if action in valid_actions:
+                no_crash_actions_data[p][action] = counts['selected']
+                no_crash_action_safety_data[p][action] = counts['safe']
+        no_crash_transition_counts[p]['False_False'] = no_crash['transitions']['False_False']['rows']
+        no_crash_transition_counts[p]['False_True'] = no_crash['transitions']['False_True']['rows']
+
+    # Process FINAL SUMMARY
+    for transition in final_summary:
+        final_summary[transition] += data['final_summary'].get(transition, 0)
 
 # Print the parsed data to verify
 print("\n=== PARSED DATA ===")
@@ -163,48 +75,6 @@ print("Crash safety data:", crash_safety_data)
 print("No crash transition counts:", no_crash_transition_counts)
 print("Final summary:", final_summary)
 
-# Now let's test with a simple manual parse to see what's wrong
-print("\n=== MANUAL TEST ===")
-# Test with the first percentage
-test_p = '01'
-test_dir_path = os.path.join(base_dir, test_p, 'cBNs')
-test_file_path = os.path.join(test_dir_path, "contingency_table_01.csv")
-
-if os.path.exists(test_file_path):
-    with open(test_file_path, 'r') as f:
-        content = f.read()
-        print(f"First 200 chars of {test_file_path}:")
-        print(content[:200])
-        print("\nLooking for tie patterns:")
-        for j in range(6):
-            pattern = re.compile(rf'Number of groups with exactly\s+{j+1}\s+best interventions:\s+(\d+)')
-            match = pattern.search(content)
-            if match:
-                print(f"Found {j+1} ties: {match.group(1)}")
-            else:
-                print(f"NOT found {j+1} ties")
-        
-        print("\nLooking for action patterns:")
-        action_pattern = re.compile(r'(\w+(?:_\w+)*)\s*:\s*Selected\s+(\d+)\s*times,\s*Safe\s+(\d+)\s*times,\s*Unsafe\s+(\d+)\s*times')
-        matches = action_pattern.findall(content)
-        for match in matches:
-            print(f"Action match: {match}")
-        
-        print("\nLooking for transition patterns:")
-        transitions = ['True -> False', 'True -> True', 'False -> False', 'False -> True']
-        for trans in transitions:
-            pattern = re.compile(rf'{trans}:\s+(\d+)')
-            match = pattern.search(content)
-            if match:
-                print(f"Found {trans}: {match.group(1)}")
-            else:
-                print(f"NOT found {trans}")
-else:
-    print(f"Test file not found: {test_file_path}")
-    print(f"Looking in: {os.path.abspath(test_dir_path)}")
-    if os.path.exists(test_dir_path):
-        print(f"Files in directory: {os.listdir(test_dir_path)}")
-
 def generate_latex_files():
     try:
         # File 1: Detailed results by section
@@ -3,73 +3,441 @@ import sys
 import os
 import csv
 import time
-import statistics
-from run_WhatIf_V4 import run_whatif
+import tempfile
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from run_WhatIf_V4 import run_whatif, load_aspmc, program_fingerprint, KNOWLEDGE_COMPILER, NATIVE_STRATEGY
+from query_analyzer import ANSWER_IMPOSSIBLE
+from result_store import ResultStore
+from query_profile import write_profile
+from latency_histogram import LatencyHistogram
+from circuit_cache import cache_key
+from fold_checkpoints import FoldCheckpoints, LEASE_SECONDS, file_digest
+from results_io import write_typed
+from planner import (collect_history, CostModel, program_size, plan, format_duration, Progress, run_strategy,
+                     write_strategy)
 
-def process(rep_number, percentage):
+NUM_FOLDS = 768
+# Worker processes used by __main__ (1 runs everything in this process)
+NUM_WORKERS = os.cpu_count() or 1
+# Query strategy used by __main__: KNOWLEDGE_COMPILER (aspmc with sharpsat-td),
+# another aspmc knowledge compiler such as pysdd, or NATIVE_STRATEGY; --strategy
+# overrides it
+STRATEGY = KNOWLEDGE_COMPILER
+# Whether __main__ answers queries from a twin network compiled once per fold
+# (run_whatif compile_once) instead of the knowledge compiler; elapsed_time
+# then measures twin network evaluations. --compile-once turns it on
+COMPILE_ONCE = False
+# Whether __main__ keeps the fold checkpoints of an interrupted run (False starts over)
+RESUME = True
+
+RESULT_HEADER = ['action','curr_lane','free_E','free_NE','free_NW','free_SE','free_SW','free_W',
+                 'orig_label_lc','latent_collision','iaction','probability','elapsed_time','group_id',
+                 'answered_by']
+GROUP_COLUMN = RESULT_HEADER.index('group_id')
+ANSWERED_BY_COLUMN = RESULT_HEADER.index('answered_by')
+
+# Per-process result store, opened by the pool initializer or by process_all
+_result_store = None
+
+def config_paths(rep_number, percentage):
+    """Returns the input/output paths of a (rep, percentage) configuration."""
     base_dir = os.getcwd()
     rep_dir = os.path.join(base_dir, f"rep_{rep_number}")
     perc_dir = os.path.join(rep_dir, str(percentage))
-    
-    test_data_dir = os.path.join(rep_dir, "test_data")
     models_subdir = os.path.join(perc_dir, "cBNs")
-    
-    os.makedirs(models_subdir, exist_ok=True)
-
-    output_csv_path = os.path.join(models_subdir, "twin_networks_results.csv")
-    numeralia_path = os.path.join(models_subdir, "testing_numeralia.txt")
-    found_actions_path = os.path.join(models_subdir, "found_actions.txt")
-
-    with open(numeralia_path, "w") as f:
-        f.write(f"Testing numeralia summary for rep_{rep_number}/{percentage}\n\n")
-    with open(found_actions_path, "w") as f:
-        f.write("Fold,Action\n")
-
-    num_folds = 768
-    all_times = []
-
-    with open(output_csv_path, 'w', newline='') as outfile:
-        writer = csv.writer(outfile)
-        writer.writerow(['action','curr_lane','free_E','free_NE','free_NW','free_SE','free_SW','free_W',
-                         'orig_label_lc','latent_collision','iaction','probability','elapsed_time','group_id'])
-
-        for i in range(1, num_folds + 1):
-            input_csv = os.path.join(test_data_dir, f"test_fold_{i}.csv")
-            input_pl = os.path.join(models_subdir, f"cBN_{i}.pl")
-            if not os.path.exists(input_csv) or not os.path.exists(input_pl):
-                print(f"[Warning] Missing input for fold {i}")
-                continue
-
-            start_fold = time.time()
-            results, fold_times = run_whatif(input_csv, input_pl, models_subdir, found_actions_path, i)
-            for row in results:
-                writer.writerow(row)
-            all_times.extend(fold_times)
-            end_fold = time.time()
-            print(f"Fold {i} done in {end_fold - start_fold:.2f}s, {len(results)} queries processed")
-
-    # Write summary
-    if all_times:
-        avg_time = statistics.mean(all_times)
-        std_time = statistics.stdev(all_times) if len(all_times) > 1 else 0.0
+    return {
+        'test_data_dir': os.path.join(rep_dir, "test_data"),
+        'models_subdir': models_subdir,
+        'output_csv': os.path.join(models_subdir, "twin_networks_results.csv"),
+        'impossible_csv': os.path.join(models_subdir, "impossible_evidence.csv"),
+        'numeralia': os.path.join(models_subdir, "testing_numeralia.txt"),
+        'found_actions': os.path.join(models_subdir, "found_actions.txt"),
+        'profile': os.path.join(models_subdir, "query_profile.parquet"),
+    }
+
+def _init_worker(strategy):
+    """Pool initializer: warm up the aspmc imports (unless native) and open the result store."""
+    global _result_store
+    if strategy != NATIVE_STRATEGY:
+        load_aspmc(strategy)
+    _result_store = ResultStore()
+
+def fold_inputs(rep_number, percentage, fold):
+    """Returns the (test CSV, cBN program) paths of a fold."""
+    paths = config_paths(rep_number, percentage)
+    return (os.path.join(paths['test_data_dir'], f"test_fold_{fold}.csv"),
+            os.path.join(paths['models_subdir'], f"cBN_{fold}.pl"))
+
+def structure_id(input_pl):
+    """Short id of the DAG structure of a cBN program (probabilities masked)."""
+    with open(input_pl) as f:
+        return cache_key(f.read(), (), parametric=True)[:12]
+
+def run_fold(rep_number, percentage, fold, compile_once=False, strategy=KNOWLEDGE_COMPILER):
+    """
+    Runs the queries of one fold and returns (results, fold_latency,
+    fold_elapsed, found_actions, profile, structure): the result rows, a
+    LatencyHistogram of the per-query times, the wall time of the whole fold,
+    the line run_whatif wrote for found_actions.txt, the query_profile records
+    of the rows and the structure_id of the fold's cBN.
+    """
+    paths = config_paths(rep_number, percentage)
+    input_csv, input_pl = fold_inputs(rep_number, percentage, fold)
+
+    # Each fold gets its own found-actions file so that the parent can merge them in order
+    fd, actions_path = tempfile.mkstemp(dir=paths['models_subdir'], prefix=".found_actions_", suffix=".txt")
+    os.close(fd)
+    profile = []
+    try:
+        start_fold = time.time()
+        results, fold_times = run_whatif(input_csv, input_pl, paths['models_subdir'], actions_path, fold,
+                                         compile_once=compile_once, result_store=_result_store,
+                                         strategy=strategy, profile=profile)
+        end_fold = time.time()
+        with open(actions_path) as f:
+            found_actions = f.read()
+    finally:
+        os.remove(actions_path)
+    return (results, LatencyHistogram(fold_times), end_fold - start_fold, found_actions, profile,
+            structure_id(input_pl))
+
+class ConfigWriter:
+    """
+    Checkpoints the folds of one configuration as they finish (see
+    fold_checkpoints) and, once every fold is in, merges them in group_id
+    order into the configuration's outputs.
+    """
+
+    def __init__(self, rep_number, percentage, folds, resume=True, strategy=run_strategy(KNOWLEDGE_COMPILER)):
+        self.rep_number = rep_number
+        self.percentage = percentage
+        self.paths = config_paths(rep_number, percentage)
+        self.folds = folds
+        self.checkpoints = FoldCheckpoints(self.paths['models_subdir'])
+        if not resume and not self.checkpoints.clear():
+            print(f"[Warning] rep_{rep_number}/{percentage}: other processes are running folds of it, "
+                  f"resuming from its checkpoints instead of starting over")
+        # Content hashes of the inputs and the strategy (planner.run_strategy),
+        # recorded with each checkpoint: folds run another way are run again
+        self.strategy = strategy
+        self.hashes = {}
+        for i in folds:
+            input_csv, input_pl = fold_inputs(rep_number, percentage, i)
+            self.hashes[i] = {'program': program_fingerprint(input_pl), 'test_data': file_digest(input_csv),
+                              'strategy': strategy}
+        self.done = set()
+        self.refresh()
+        # Folds checkpointed before whose program or test data changed since
+        self.changed = [i for i in self.pending() if str(i) in self.checkpoints.finished]
+        self.reused = len(self.done)
+
+    def refresh(self, folds=None):
+        """Picks up the folds (default all) checkpointed since, by this or any other process."""
+        self.checkpoints.refresh()
+        for i in self.folds if folds is None else folds:
+            if self.checkpoints.completed(i, fold_inputs(self.rep_number, self.percentage, i), self.hashes[i]):
+                self.done.add(i)
+
+    def pending(self):
+        """Folds that still have to be run."""
+        return [i for i in self.folds if i not in self.done]
+
+    def claim(self, fold):
+        """Takes the lease of a fold; False if it is done or another process is running it."""
+        if fold in self.done or not self.checkpoints.claim(fold):
+            return False
+        # It may have been finished while we were not holding the lease
+        self.refresh([fold])
+        if fold in self.done:
+            self.checkpoints.release(fold)
+            return False
+        return True
+
+    def add(self, fold, output):
+        """Checkpoints a finished fold and releases its lease."""
+        self.checkpoints.save(fold, output, self.hashes[fold])
+        self.checkpoints.release(fold)
+        self.done.add(fold)
+
+    def close(self):
+        """Merges the checkpoints into the outputs, if every fold is in and no other process is merging."""
+        self.refresh()
+        missing = len(self.pending())
+        if missing:
+            print(f"[Warning] rep_{self.rep_number}/{self.percentage} has {missing} unfinished folds, "
+                  f"not merged yet (rerun, or let the other shards finish)")
+            return
+        if not self.checkpoints.claim("merge"):
+            print(f"rep_{self.rep_number}/{self.percentage} is being merged by another process")
+            return
+        try:
+            with self.checkpoints.keep_alive("merge"):
+                self.merge()
+        finally:
+            self.checkpoints.release("merge")
+
+    def merge(self):
+        """
+        Writes the outputs and the summary from the checkpoints, in group_id
+        order. Groups with impossible evidence (no counterfactual, probability
+        NaN) go to impossible_evidence.csv instead of the results.
+        """
+        latency = LatencyHistogram()
+        # structure_id -> [folds, LatencyHistogram]
+        structures = {}
+        profile = []
+        rows = []
+        impossible = []
+        with open(self.paths['output_csv'], 'w', newline='') as outfile, \
+                open(self.paths['found_actions'], "w") as actions_file:
+            writer = csv.writer(outfile)
+            writer.writerow(RESULT_HEADER)
+            actions_file.write("Fold,Action\n")
+            for fold in self.folds:
+                results, fold_latency, fold_elapsed, found_actions, fold_profile, structure = self.checkpoints.load(fold)
+                groups = {r[GROUP_COLUMN] for r in results if r[ANSWERED_BY_COLUMN] == ANSWER_IMPOSSIBLE}
+                impossible.extend(r for r in results if r[GROUP_COLUMN] in groups)
+                results = [r for r in results if r[GROUP_COLUMN] not in groups]
+                writer.writerows(results)
+                rows.extend(results)
+                actions_file.write(found_actions)
+                latency.merge(fold_latency)
+                entry = structures.setdefault(structure, [0, LatencyHistogram()])
+                entry[0] += 1
+                entry[1].merge(fold_latency)
+                profile.extend(fold_profile)
+        write_typed(pd.DataFrame(rows, columns=RESULT_HEADER), self.paths['output_csv'])
+        if impossible:
+            with open(self.paths['impossible_csv'], 'w', newline='') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(RESULT_HEADER)
+                writer.writerows(impossible)
+            print(f"[Warning] rep_{self.rep_number}/{self.percentage}: {len(impossible)} queries with impossible "
+                  f"evidence written to {self.paths['impossible_csv']} instead of the results")
+        elif os.path.exists(self.paths['impossible_csv']):
+            os.remove(self.paths['impossible_csv'])
+        write_profile(profile, self.paths['profile'])
+        write_strategy(self.paths['models_subdir'], self.strategy)
+        self.checkpoints.compact()
+
+        avg_time = latency.mean
+        std_time = latency.stdev()
+        p50, p90, p99, max_time = latency.summary()
+
+        with open(self.paths['numeralia'], "w") as f:
+            f.write(f"Testing numeralia summary for rep_{self.rep_number}/{self.percentage}\n\n")
+            f.write(f"Folds: {len(self.folds)} ({self.reused} reused from earlier runs, "
+                    f"{len(self.changed)} re-evaluated after their program or test data changed)\n")
+            if impossible:
+                f.write(f"Impossible evidence: {len(impossible)} queries left out of the results "
+                        f"(see impossible_evidence.csv)\n")
+            f.write(f"Average testing time: {avg_time:.4f} s\n")
+            f.write(f"Standard deviation:   {std_time:.4f} s\n")
+            f.write(f"\nLatency distribution over {latency.count} queries:\n")
+            f.write(f"p50: {p50:.4f} s\n")
+            f.write(f"p90: {p90:.4f} s\n")
+            f.write(f"p99: {p99:.4f} s\n")
+            f.write(f"max: {max_time:.4f} s\n")
+            f.write("\nLatency per cBN structure (slowest p99 first):\n")
+            f.write(f"{'structure':<12} {'folds':>5} {'queries':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}\n")
+            by_p99 = sorted(structures.items(), key=lambda item: item[1][1].percentile(99), reverse=True)
+            for structure, (folds, fold_latency) in by_p99:
+                f.write(f"{structure:<12} {folds:>5} {fold_latency.count:>7} " +
+                        " ".join(f"{t:>8.4f}" for t in fold_latency.summary()) + "\n")
+
+        print(f"rep_{self.rep_number}/{self.percentage} average per query: {avg_time:.4f}s ± {std_time:.4f}s, "
+              f"p99 {p99:.4f}s, max {max_time:.4f}s")
+
+def available_folds(rep_number, percentage):
+    """Returns the folds of a configuration whose test data and cBN program exist."""
+    paths = config_paths(rep_number, percentage)
+    os.makedirs(paths['models_subdir'], exist_ok=True)
+    folds = []
+    for i in range(1, NUM_FOLDS + 1):
+        input_csv, input_pl = fold_inputs(rep_number, percentage, i)
+        if not os.path.exists(input_csv) or not os.path.exists(input_pl):
+            print(f"[Warning] Missing input for rep_{rep_number}/{percentage} fold {i}")
+            continue
+        folds.append(i)
+    return folds
+
+def process_all(configs, workers=1, compile_once=False, strategy=KNOWLEDGE_COMPILER, resume=True, shard=(1, 1)):
+    """
+    Runs every fold of the given (rep, percentage) configurations. With
+    workers > 1 the (rep, percentage, fold) tasks are farmed out to a pool of
+    worker processes; results are still written in group_id order and each
+    fold's timing is measured inside the worker that ran it. With resume,
+    folds checkpointed by an earlier, interrupted run are not run again.
+
+    shard = (k, N) only runs every N-th task starting at the k-th one. Each
+    fold is leased (see fold_checkpoints) right before it is run, so any
+    number of processes, on this or other machines sharing the rep
+    directories, can run process_all on the same configurations at once;
+    whichever finishes the last fold of a configuration merges it.
+
+    Folds are run longest first, as predicted by a planner.CostModel fitted
+    to the elapsed times of earlier runs with the same strategy.
+    """
+    global _result_store
+    k, num_shards = shard
+    label = run_strategy(strategy, compile_once)
+    writers = {}
+    tasks = []
+    for rep, perc in configs:
+        folds = available_folds(rep, perc)
+        writer = ConfigWriter(rep, perc, folds, resume=resume, strategy=label)
+        writers[(rep, perc)] = writer
+        if writer.reused:
+            print(f"rep_{rep}/{perc}: reusing {writer.reused} of {len(folds)} folds from earlier runs")
+        if writer.changed:
+            print(f"rep_{rep}/{perc}: re-evaluating {len(writer.changed)} folds whose program or test data "
+                  f"changed: {','.join(str(i) for i in writer.changed)}")
+        tasks.extend((rep, perc, i) for i in folds)
+    tasks = [task for n, task in enumerate(tasks) if n % num_shards == k - 1]
+    tasks = [(rep, perc, i) for rep, perc, i in tasks if i not in writers[(rep, perc)].done]
+
+    history = collect_history(os.getcwd(), label)
+    model = CostModel(history)
+    costs = {task: model.predict(program_size(fold_inputs(*task)[1])) for task in tasks}
+    tasks, makespan = plan(tasks, costs, workers)
+    if model.fitted:
+        print(f"Planned {len(tasks)} folds on {max(workers, 1)} workers from {len(history)} earlier {label} folds, "
+              f"predicted time {format_duration(makespan)}")
     else:
-        avg_time = std_time = 0.0
+        print(f"Planned {len(tasks)} folds on {max(workers, 1)} workers by program size (no earlier {label} runs)")
+    progress = Progress(costs, workers)
+
+    def claimed():
+        for rep, perc, i in tasks:
+            if writers[(rep, perc)].claim(i):
+                yield rep, perc, i
 
-    with open(numeralia_path, "a") as f:
-        f.write(f"Average testing time: {avg_time:.4f} s\n")
-        f.write(f"Standard deviation:   {std_time:.4f} s\n")
+    def done(rep, perc, i, output):
+        writers[(rep, perc)].add(i, output)
+        eta = progress.done((rep, perc, i), output[2])
+        print(f"rep_{rep}/{perc} fold {i} done in {output[2]:.2f}s, {len(output[0])} queries processed, "
+              f"ETA {format_duration(eta)}")
 
-    print(f"Average per query: {avg_time:.4f}s ± {std_time:.4f}s")
+    try:
+        if workers <= 1:
+            # Results of earlier runs (any rep or variant) with identical programs are reused
+            _result_store = ResultStore()
+            try:
+                for rep, perc, i in claimed():
+                    # The fold runs in this thread, so its lease is renewed from another one
+                    with writers[(rep, perc)].checkpoints.keep_alive(i):
+                        output = run_fold(rep, perc, i, compile_once, strategy)
+                    done(rep, perc, i, output)
+            finally:
+                _result_store.close()
+                _result_store = None
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(strategy,)) as executor:
+                # Folds are claimed only when a worker is free, so that other
+                # processes can take the rest
+                queue = claimed()
+                running = {}
+                def submit_next():
+                    task = next(queue, None)
+                    if task is not None:
+                        running[executor.submit(run_fold, *task, compile_once, strategy)] = task
+                for _ in range(workers):
+                    submit_next()
+                while running:
+                    finished, _ = wait(running, timeout=LEASE_SECONDS / 3, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        rep, perc, i = running.pop(future)
+                        done(rep, perc, i, future.result())
+                        submit_next()
+                    for rep, perc, i in running.values():
+                        writers[(rep, perc)].checkpoints.renew(i)
+    finally:
+        for writer in writers.values():
+            writer.checkpoints.release_all()
+
+    for writer in writers.values():
+        writer.close()
+
+def merge_all(configs, strategy=run_strategy(KNOWLEDGE_COMPILER)):
+    """
+    Merges the checkpoints of configurations whose folds were run by one or
+    more shards with strategy (planner.run_strategy).
+    """
+    for rep, perc in configs:
+        ConfigWriter(rep, perc, available_folds(rep, perc), strategy=strategy).close()
+
+def process(rep_number, percentage, compile_once=False, workers=1, strategy=KNOWLEDGE_COMPILER, resume=True,
+            shard=(1, 1)):
+    process_all([(rep_number, percentage)], workers=workers, compile_once=compile_once, strategy=strategy,
+                resume=resume, shard=shard)
+
+def parse_shard(text):
+    """Parses a --shard value k/N (1 <= k <= N)."""
+    try:
+        k, num_shards = (int(x) for x in text.split("/"))
+    except ValueError:
+        k = num_shards = 0
+    if not 1 <= k <= num_shards:
+        print(f"Invalid shard {text}, expected k/N with 1 <= k <= N")
+        sys.exit(1)
+    return k, num_shards
 
 # Main
 if __name__ == "__main__":
-    reps = range(1, 6)
+    usage = ("Usage: python3 test_cBNs.py [both <num_reps> <percentages_comma_separated> | reps <num_reps> | "
+             "percentages <percentages_comma_separated>] [--shard k/N] [--merge] [--compile-once] "
+             "[--strategy <knowledge compiler or numpy>]")
+    num_reps = 5
     percentages = ["01", "25", "50", "75", "90"]
 
+    # --shard k/N runs one of N disjoint slices of the folds; --merge only
+    # merges the checkpoints written by the shards
+    args = sys.argv[1:]
+    shard = (1, 1)
+    merge = "--merge" in args
+    if merge:
+        args.remove("--merge")
+    compile_once = COMPILE_ONCE or "--compile-once" in args
+    if "--compile-once" in args:
+        args.remove("--compile-once")
+    strategy = STRATEGY
+    if "--strategy" in args:
+        idx = args.index("--strategy")
+        if idx + 1 >= len(args):
+            print(usage)
+            sys.exit(1)
+        strategy = args[idx + 1]
+        del args[idx:idx + 2]
+    if "--shard" in args:
+        idx = args.index("--shard")
+        if idx + 1 >= len(args):
+            print(usage)
+            sys.exit(1)
+        shard = parse_shard(args[idx + 1])
+        del args[idx:idx + 2]
+
+    try:
+        if args and args[0] == "both" and len(args) == 3:
+            num_reps, percentages = int(args[1]), args[2].split(",")
+        elif args and args[0] == "reps" and len(args) == 2:
+            num_reps = int(args[1])
+        elif args and args[0] == "percentages" and len(args) == 2:
+            percentages = args[1].split(",")
+        elif args:
+            raise ValueError
+    except ValueError:
+        print(usage)
+        print("Example: python3 test_cBNs.py both 5 01,25,50,75,90")
+        sys.exit(1)
+    configs = [(rep, perc) for rep in range(1, num_reps + 1) for perc in percentages]
+
+    if merge:
+        merge_all(configs, run_strategy(strategy, compile_once))
+        sys.exit(0)
+
     start_all = time.time()
-    for rep in reps:
-        for perc in percentages:
-            process(rep, perc)
+    process_all(configs, workers=NUM_WORKERS, compile_once=compile_once, strategy=strategy, resume=RESUME,
+                shard=shard)
     end_all = time.time()
     print(f"All testing completed in {(end_all - start_all)/60:.2f} minutes")
-
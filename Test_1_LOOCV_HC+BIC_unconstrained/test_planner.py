@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Fold histories of earlier runs, per strategy, and the longest-first plan."""
+
+import os
+
+import pandas as pd
+
+from planner import (collect_history, run_strategy, write_strategy, read_strategy, plan, CostModel,
+                     LEGACY_STRATEGY)
+
+
+def earlier_run(base_dir, rep, seconds, strategy=None):
+    """Writes a one-fold run of rep_<rep>/01 whose fold took seconds, with its strategy if given."""
+    models_subdir = os.path.join(base_dir, f"rep_{rep}", "01", "cBNs")
+    os.makedirs(models_subdir)
+    with open(os.path.join(models_subdir, "cBN_1.pl"), "w") as f:
+        f.write("x" * 100 * rep)
+    pd.DataFrame({'group_id': [1, 1], 'elapsed_time': [seconds / 2] * 2}).to_csv(
+        os.path.join(models_subdir, "twin_networks_results.csv"), index=False)
+    if strategy is not None:
+        write_strategy(models_subdir, strategy)
+    return models_subdir
+
+
+def test_history_of_the_active_strategy_only(tmp_path):
+    legacy = earlier_run(str(tmp_path), 1, 40.0)
+    earlier_run(str(tmp_path), 2, 0.5, run_strategy("pysdd"))
+    earlier_run(str(tmp_path), 3, 0.1, run_strategy("pysdd", compile_once=True))
+    assert read_strategy(legacy) == LEGACY_STRATEGY
+    assert collect_history(str(tmp_path), LEGACY_STRATEGY) == [(100, 40.0)]
+    assert collect_history(str(tmp_path), "pysdd") == [(200, 0.5)]
+    assert collect_history(str(tmp_path), "pysdd+compile-once") == [(300, 0.1)]
+    assert sorted(collect_history(str(tmp_path))) == [(100, 40.0), (200, 0.5), (300, 0.1)]
+    assert collect_history(str(tmp_path), "numpy") == []
+
+
+def test_longest_first():
+    model = CostModel([(100, 1.0), (300, 3.0)])
+    costs = {task: model.predict(size) for task, size in [('a', 100), ('b', 400), ('c', 200)]}
+    ordered, makespan = plan(list(costs), costs, workers=2)
+    assert ordered == ['b', 'c', 'a']
+    assert makespan == costs['b']
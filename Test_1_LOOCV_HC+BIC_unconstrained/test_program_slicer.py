@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Sliced programs answer every query like the full joint distribution of the programs they come from."""
+
+from itertools import product
+
+import pytest
+
+from twin_network import parse_cbn, CompiledTwinNetwork
+from program_slicer import slice_program
+
+# free_E is barren; free_NE and free_W are d-separated from the query by the evidence
+PROGRAM = """
+% Exogenous variables
+0.4::u1.
+free_NE :- u1.
+0.7::u2.
+free_W :- u2, free_NE.
+0.2::u3.
+free_W :- u3, \\+ free_NE.
+0.3::u4.
+free_E :- u4.
+0.6::u5(cruise); 0.4::u5(keep).
+action(V) :- u5(V), free_W.
+0.2::u6(cruise); 0.7::u6(keep).
+action(V) :- u6(V), \\+ free_W.
+0.9::u7.
+brake :- u7, action(cruise).
+0.15::u8.
+brake :- u8, action(keep).
+0.9::u9.
+latent_collision :- u9, action(cruise), brake.
+0.2::u10.
+latent_collision :- u10, action(cruise), \\+ brake.
+0.5::u11.
+latent_collision :- u11, action(keep), brake.
+0.05::u12.
+latent_collision :- u12, action(keep), \\+ brake.
+"""
+OBSERVED = ['free_NE', 'free_W', 'action', 'brake', 'latent_collision']
+ACTIONS = ['cruise', 'keep']
+BOOLEAN_FACTS = {'u1': 0.4, 'u2': 0.7, 'u3': 0.2, 'u4': 0.3, 'u7': 0.9, 'u8': 0.15,
+                 'u9': 0.9, 'u10': 0.2, 'u11': 0.5, 'u12': 0.05}
+U5 = {'cruise': 0.6, 'keep': 0.4}
+U6 = {'cruise': 0.2, 'keep': 0.7, None: 0.1}
+
+
+def derive(u, iaction=None):
+    """The world of PROGRAM for exogenous values u, optionally under do(action=iaction)."""
+    free_NE = u['u1']
+    free_W = (u['u2'] and free_NE) or (u['u3'] and not free_NE)
+    action = iaction or (u['u5'] if free_W else u['u6'])
+    brake = (u['u7'] and action == 'cruise') or (u['u8'] and action == 'keep')
+    collision = ((u['u9'] and action == 'cruise' and brake) or (u['u10'] and action == 'cruise' and not brake) or
+                 (u['u11'] and action == 'keep' and brake) or (u['u12'] and action == 'keep' and not brake))
+    return {'free_NE': free_NE, 'free_W': free_W, 'action': action, 'brake': brake,
+            'latent_collision': collision, 'free_E': u['u4']}
+
+
+def exogenous_worlds():
+    """(probability, world, collision under do(iaction) per iaction) of every exogenous assignment."""
+    names = list(BOOLEAN_FACTS)
+    for bits in product([False, True], repeat=len(names)):
+        for u5, u6 in product(U5, U6):
+            u = dict(zip(names, bits), u5=u5, u6=u6)
+            weight = U5[u5] * U6[u6]
+            for name, bit in zip(names, bits):
+                weight *= BOOLEAN_FACTS[name] if bit else 1.0 - BOOLEAN_FACTS[name]
+            yield weight, derive(u), {iaction: derive(u, iaction)['latent_collision'] for iaction in ACTIONS}
+
+
+def full_joint(worlds, evidence, iaction):
+    """
+    P(latent_collision | evidence, do(action=iaction)) from the joint
+    distribution of every exogenous variable, free_E's included, or None
+    when the evidence is impossible.
+    """
+    likelihood = hit = 0.0
+    for weight, world, collision in worlds:
+        if all(str(world[key]) == value for key, value in evidence.items()):
+            likelihood += weight
+            hit += weight if collision[iaction] else 0.0
+    return hit / likelihood if likelihood > 0.0 else None
+
+
+def test_slicing_drops_barren_and_d_separated_clauses():
+    model = parse_cbn(slice_program(PROGRAM, OBSERVED))
+    assert 'free_E' not in model.values
+    assert model.parents['free_W'] == []
+    assert model.parents['action'] == []
+    assert model.parents['latent_collision'] == parse_cbn(PROGRAM).parents['latent_collision']
+
+
+def test_sliced_answers_unchanged():
+    original = CompiledTwinNetwork(parse_cbn(PROGRAM))
+    sliced = CompiledTwinNetwork(parse_cbn(slice_program(PROGRAM, OBSERVED)))
+    worlds = list(exogenous_worlds())
+    answered = 0
+    for values in product(['False', 'True'], ['False', 'True'], ACTIONS, ['False', 'True'], ['False', 'True']):
+        for free_E in ['False', 'True']:
+            evidence = dict(zip(OBSERVED, values), free_E=free_E)
+            for iaction in ACTIONS:
+                expected = full_joint(worlds, evidence, iaction)
+                if expected is None:
+                    continue
+                assert sliced.query(evidence, iaction) == pytest.approx(expected, abs=1e-12)
+                assert original.query(evidence, iaction) == pytest.approx(expected, abs=1e-12)
+                answered += 1
+    assert answered == 2 * 2 ** 4 * len(ACTIONS) * len(ACTIONS)
+
+
+def test_unparsable_programs_are_returned_unchanged():
+    assert slice_program("not a cBN program", OBSERVED) == "not a cBN program"
+    without_query = "0.4::u1.\nfree_NE :- u1.\n"
+    assert slice_program(without_query, OBSERVED) == without_query
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Query plumbing of run_WhatIf_V4 that does not need aspmc."""
+
+import os
+import tempfile
+
+import pytest
+
+import query_profile
+import run_WhatIf_V4
+from run_WhatIf_V4 import (scratch_dir, stored_single_query, make_evidence, EVIDENCE_KEYS, ACTIONS_LIST,
+                           KNOWLEDGE_COMPILER, PERSISTENT_COMPILERS)
+from result_store import ResultStore
+
+ROW = dict({key: "False" for key in EVIDENCE_KEYS}, action='cruise', free_W="True", iaction='keep')
+
+
+class FakeProgram:
+    """Stands in for MergedCounterfactualProgram: compiles on the first multi_query."""
+
+    def __init__(self):
+        self.calls = []
+        self.compiled = False
+
+    def circuit_size(self):
+        return 10 if self.compiled else None
+
+    def single_query(self, interventions, evidence, queries, strategy):
+        self.calls.append((interventions, evidence, queries, strategy))
+        return [0.25]
+
+    def multi_query(self, interventions, evidence, queries, strategy):
+        self.compiled = True
+        return self.single_query(interventions, evidence, queries, strategy)
+
+
+def phases_of(query):
+    """Phases that time was charged to while query() ran."""
+    with query_profile.QueryTimer() as timer:
+        query()
+    return {p for p, ns in timer.phase_ns.items() if ns > 0}
+
+
+def test_scratch_dir_is_scoped(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_WhatIf_V4, 'RAM_TEMP_ROOT', str(tmp_path))
+    previous = tempfile.tempdir
+    with scratch_dir(KNOWLEDGE_COMPILER):
+        path = tempfile.gettempdir()
+        assert os.path.dirname(path) == str(tmp_path)
+        with open(os.path.join(path, "program.cnf"), "w") as f:
+            f.write("p cnf 1 1\n")
+    assert tempfile.tempdir == previous
+    assert os.listdir(tmp_path) == []
+
+
+def test_scratch_dir_is_restored_after_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_WhatIf_V4, 'RAM_TEMP_ROOT', str(tmp_path))
+    previous = tempfile.tempdir
+    with pytest.raises(RuntimeError):
+        with scratch_dir(KNOWLEDGE_COMPILER):
+            raise RuntimeError("compiler failed")
+    assert tempfile.tempdir == previous
+    assert os.listdir(tmp_path) == []
+
+
+def test_no_scratch_dir_for_persistent_compilers(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_WhatIf_V4, 'RAM_TEMP_ROOT', str(tmp_path))
+    previous = tempfile.tempdir
+    with scratch_dir(PERSISTENT_COMPILERS[0]):
+        assert tempfile.tempdir == previous
+    with scratch_dir(KNOWLEDGE_COMPILER), scratch_dir(PERSISTENT_COMPILERS[0]):
+        assert os.path.dirname(tempfile.gettempdir()) == str(tmp_path)
+
+
+def test_evidence_asserts_the_observed_action():
+    evidence = make_evidence(ROW)
+    # Phase False: observed true, like the action the twin network conditions on
+    assert evidence['action(cruise)'] is False
+    assert not any(f'action({a})' in evidence for a in ACTIONS_LIST if a != 'cruise')
+    assert evidence['free_W'] is False
+    assert all(evidence[key] is True for key in EVIDENCE_KEYS if key not in ('action', 'free_W'))
+
+
+def test_query_gets_the_evidence_and_interventions_of_the_row(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_WhatIf_V4, 'RAM_TEMP_ROOT', str(tmp_path))
+    program = FakeProgram()
+    prob, elapsed, stored = stored_single_query(lambda: program, ACTIONS_LIST, ROW)
+    assert prob == 0.25 and elapsed >= 0 and not stored
+    interventions, evidence, queries, strategy = program.calls[0]
+    assert interventions == {f'action({a})': a != 'keep' for a in ACTIONS_LIST}
+    assert evidence == make_evidence(ROW)
+    assert queries == ["latent_collision"] and strategy == KNOWLEDGE_COMPILER
+
+
+def test_queries_are_charged_to_compile_then_evaluate(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_WhatIf_V4, 'RAM_TEMP_ROOT', str(tmp_path))
+    external = FakeProgram()
+    for _ in range(2):
+        assert phases_of(lambda: stored_single_query(lambda: external, ACTIONS_LIST, ROW)) == {'compile'}
+    persistent = FakeProgram()
+    query = lambda: stored_single_query(lambda: persistent, ACTIONS_LIST, ROW, strategy=PERSISTENT_COMPILERS[0])
+    assert phases_of(query) == {'compile'}
+    assert phases_of(query) == {'evaluate'}
+
+
+def test_stored_answers_do_not_load_the_program(tmp_path):
+    store = ResultStore(str(tmp_path / "results.sqlite"))
+    program = FakeProgram()
+    strategy = PERSISTENT_COMPILERS[0]
+    first = stored_single_query(lambda: program, ACTIONS_LIST, ROW, store, 'abc', strategy)
+    store.put('abc', strategy, [ROW[key] for key in EVIDENCE_KEYS], ROW['iaction'], first[0], 100.0)
+    def not_loaded():
+        raise AssertionError("program loaded for a stored answer")
+    prob, elapsed, stored = stored_single_query(not_loaded, ACTIONS_LIST, ROW, store, 'abc', strategy)
+    # The hit takes the time of the lookup, not the time stored with the answer
+    assert prob == first[0] and stored and elapsed < 100.0
+    assert len(program.calls) == 1
+
+    # Answers of another compiler are not served
+    assert not stored_single_query(lambda: program, ACTIONS_LIST, ROW, store, 'abc', KNOWLEDGE_COMPILER)[2]
+    assert len(program.calls) == 2
+    store.close()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Reproducible random tie-breaking of the best interventions."""
+
+import pandas as pd
+
+from tie_breaking import tie_break_seed, choose_best, mark_best
+
+
+def results():
+    """Three groups: a two-way tie, a unique best and a three-way tie."""
+    df = pd.DataFrame({
+        'group_id': [1, 1, 1, 2, 2, 3, 3, 3, 3],
+        'iaction': ['cruise', 'keep', 'swerve_left', 'cruise', 'keep', 'cruise', 'keep', 'swerve_left', 'swerve_right'],
+        'ranking': [1, 1, 2, 1, 2, 1, 1, 1, 2],
+    })
+    df['best_intervention'] = ''
+    return df
+
+
+def test_seed_is_stable():
+    # zlib.crc32 of "1_01": the same in every process, unlike hash()
+    assert tie_break_seed(1, "01") == 2158698396
+    assert tie_break_seed(1, "01") != tie_break_seed(1, "25")
+
+
+def test_one_candidate_per_group():
+    df = results()
+    candidates = df[df['ranking'] == 1]
+    for seed in range(50):
+        chosen = choose_best(candidates, seed)
+        assert set(chosen) <= set(candidates.index)
+        assert sorted(df.loc[chosen, 'group_id']) == [1, 2, 3]
+        assert list(chosen) == sorted(chosen)
+        assert chosen.equals(choose_best(candidates, seed))
+
+
+def test_every_tied_candidate_can_win():
+    df = results()
+    candidates = df[df['ranking'] == 1]
+    won = set()
+    for seed in range(200):
+        won.update(choose_best(candidates, seed))
+    assert won == set(candidates.index)
+
+
+def test_empty_candidates():
+    df = results()
+    assert len(choose_best(df[df['ranking'] == 0], 1)) == 0
+
+
+def test_mark_best_marks_the_chosen_pairs():
+    df = results()
+    chosen = choose_best(df[df['ranking'] == 1], tie_break_seed(1, "01"))
+    best_int = df.loc[chosen].reset_index(drop=True)
+    mark_best(df, best_int)
+    assert df.index[df['best_intervention'] == '*'].tolist() == list(chosen)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Precomputed frequencies of complete_DB_discrete.csv.
+
+The frequency column of the best-intervention outputs counts the rows of the
+complete database with the same action and perception state. Instead of
+re-reading the ~2M-row CSV for every (rep, percentage), it is counted once
+into a dense cube
+
+    cube[action, state, latent_collision]
+
+(ACTIONS_LIST indices x the NUM_STATES states of variables.py x
+False/True), saved next to the CSV as <name>_frequency.npz together with the
+sha256, size and mtime of the CSV it was counted from. load_frequency_counts()
+rebuilds the cube whenever the CSV content changes, and returns the counts
+summed over latent_collision per state_codec key, so the frequency of a
+frame is counts[encode(df)]. The CSV is only hashed when its size or mtime
+differ from the saved ones.
+
+Usage: python3 frequency_cube.py [complete_DB_csv]
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+from variables import ACTIONS_LIST, STATE_KEYS, NUM_STATES
+from state_codec import KEY_SPACE, INVALID_KEY, missing_columns, encode
+from fold_checkpoints import file_digest
+
+COMPLETE_DB_PATH = "./Shared_CSVs/complete_DB_discrete.csv"
+CUBE_SHAPE = (len(ACTIONS_LIST), NUM_STATES, 2)
+# Rows read at a time while counting
+CHUNK_ROWS = 500000
+
+
+def cube_path(csv_path):
+    return os.path.splitext(csv_path)[0] + "_frequency.npz"
+
+
+def build_cube(csv_path):
+    """Counts the rows of the CSV into a CUBE_SHAPE array; None if it lacks columns."""
+    cube = np.zeros(np.prod(CUBE_SHAPE), dtype=np.int64)
+    columns = ['action', 'latent_collision'] + STATE_KEYS
+    for chunk in pd.read_csv(csv_path, dtype=str, usecols=lambda c: c in columns, chunksize=CHUNK_ROWS):
+        missing = missing_columns(chunk) + [c for c in ['latent_collision'] if c not in chunk.columns]
+        if missing:
+            print(f"[Warning] Columns {missing} not found in frequency data. Cannot compute frequencies.")
+            return None
+        keys = encode(chunk).astype(np.int64)
+        collision = chunk['latent_collision'].to_numpy()
+        known = (keys != INVALID_KEY) & ((collision == "True") | (collision == "False"))
+        # Valid keys are action * NUM_STATES + state, the first two cube axes
+        cells = keys[known] * 2 + (collision[known] == "True")
+        cube += np.bincount(cells, minlength=len(cube))
+    return cube.reshape(CUBE_SHAPE)
+
+
+def file_stat(path):
+    """(size, mtime_ns) of a file, to notice changes without hashing it."""
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def save_cube(path, cube, digest, stat):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, cube=cube, digest=np.array(digest), stat=stat)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[Warning] Could not save the frequency cube to {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_cube(csv_path=COMPLETE_DB_PATH):
+    """Returns the frequency cube of the CSV, rebuilding and saving it if missing or stale."""
+    if not os.path.exists(csv_path):
+        print(f"[Warning] Complete DB file not found at {csv_path}. Frequency column will be NA.")
+        return None
+    stat = file_stat(csv_path)
+    path = cube_path(csv_path)
+    digest = None
+    try:
+        with np.load(path) as saved:
+            if saved['cube'].shape == CUBE_SHAPE:
+                if 'stat' in saved.files and (saved['stat'] == stat).all():
+                    return saved['cube']
+                # Touched or copied: the content decides
+                digest = file_digest(csv_path)
+                if str(saved['digest']) == digest:
+                    cube = saved['cube']
+                    save_cube(path, cube, digest, stat)
+                    return cube
+    except (OSError, KeyError, ValueError):
+        pass
+
+    print("Counting frequency data from:", csv_path)
+    cube = build_cube(csv_path)
+    if cube is None:
+        return None
+    save_cube(path, cube, digest or file_digest(csv_path), stat)
+    return cube
+
+
+def load_frequency_counts(csv_path=COMPLETE_DB_PATH):
+    """Rows of the CSV per state_codec key (any latent_collision), or None without data."""
+    cube = load_cube(csv_path)
+    if cube is None:
+        return None
+    counts = np.zeros(KEY_SPACE, dtype=np.int64)
+    by_key = cube.sum(axis=2).ravel()
+    counts[:len(by_key)] = by_key
+    return counts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("Usage: python3 frequency_cube.py [complete_DB_csv]")
+        sys.exit(1)
+    csv_path = sys.argv[1] if len(sys.argv) == 2 else COMPLETE_DB_PATH
+    cube = load_cube(csv_path)
+    if cube is not None:
+        print(f"Frequency cube of {csv_path}: {int(cube.sum())} rows in {cube_path(csv_path)}")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Precomputed counterfactual lookup tables.
+
+Every query of a cBN program is determined by the 7 Boolean perception
+variables, the observed action and the intervened action (latent_collision
+is always observed True), so a program has only 128 x 6 x 6 distinct
+queries. This script answers all of them once with the twin network of the
+program and saves them as cBN_<i>_lookup.npy next to cBN_<i>.pl:
+
+    table[state, action, iaction]
+
+state packs STATE_KEYS into 7 bits (first key most significant) and action /
+iaction index ACTIONS_LIST. As in test_cBNs.py, queries with
+zero-probability evidence are NaN (impossible_evidence.csv) and
+interventions on actions missing from the program are 1.0.
+
+Usage: python3 lookup_table.py <num_reps> <percentages_comma_separated>
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from run_WhatIf_V4 import compile_cbn
+from variables import ACTIONS_LIST, STATE_KEYS, NUM_STATES
+NUM_FOLDS = 768
+
+
+def lookup_path(input_cbn):
+    """Returns the path of the lookup table of a cBN_<i>.pl program."""
+    return os.path.splitext(input_cbn)[0] + "_lookup.npy"
+
+
+def state_values(states):
+    """Returns {key: array of "True"/"False"} for an array of state indices."""
+    states = np.asarray(states)
+    width = len(STATE_KEYS)
+    return {key: np.where((states >> (width - 1 - i)) & 1, "True", "False")
+            for i, key in enumerate(STATE_KEYS)}
+
+
+def state_index(columns):
+    """Returns the state indices of rows given as {key: array of "True"/"False"}, -1 if unknown."""
+    index = np.zeros(len(columns[STATE_KEYS[0]]), dtype=np.int64)
+    known = np.ones(len(index), dtype=bool)
+    for key in STATE_KEYS:
+        values = np.asarray(columns[key])
+        known &= (values == "True") | (values == "False")
+        index = index * 2 + (values == "True")
+    return np.where(known, index, -1)
+
+
+def action_index(values):
+    """Returns the ACTIONS_LIST indices of an array of actions, -1 if unknown."""
+    values = np.asarray(values)
+    index = np.full(len(values), -1, dtype=np.int64)
+    for i, action in enumerate(ACTIONS_LIST):
+        index[values == action] = i
+    return index
+
+
+def build_lookup_table(compiled):
+    """Answers every (state, action, iaction) query of a CompiledTwinNetwork in one sweep."""
+    state, action, iaction = np.meshgrid(np.arange(NUM_STATES), np.arange(len(ACTIONS_LIST)),
+                                         np.arange(len(ACTIONS_LIST)), indexing='ij')
+    state, action, iaction = state.ravel(), action.ravel(), iaction.ravel()
+    actions = np.array(ACTIONS_LIST)
+    evidence = state_values(state)
+    evidence['action'] = actions[action]
+    evidence['latent_collision'] = np.full(len(state), "True")
+    probs = compiled.query_batch(evidence, actions[iaction])
+    probs[~np.isin(actions[iaction], compiled.actions)] = 1.0
+    return probs.reshape(NUM_STATES, len(ACTIONS_LIST), len(ACTIONS_LIST))
+
+
+def load_lookup_table(input_cbn):
+    """Returns the lookup table of a program, or None if it is missing or older than the program."""
+    path = lookup_path(input_cbn)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(input_cbn):
+            return None
+        return np.load(path)
+    except (OSError, ValueError):
+        return None
+
+
+def lookup_rows(table, rows):
+    """
+    Answers test rows (dicts of CSV values) by indexing a lookup table.
+    Returns an array with NaN for rows the table does not cover (unknown
+    values or latent_collision not True) and for impossible evidence.
+    """
+    columns = {key: np.array([row[key] for row in rows]) for key in STATE_KEYS + ['action', 'iaction', 'latent_collision']}
+    state = state_index(columns)
+    action = action_index(columns['action'])
+    iaction = action_index(columns['iaction'])
+    covered = (state >= 0) & (action >= 0) & (iaction >= 0) & (columns['latent_collision'] == "True")
+    probs = np.full(len(rows), np.nan)
+    probs[covered] = table[state[covered], action[covered], iaction[covered]]
+    return probs
+
+
+def precompute(input_cbn):
+    """Builds and saves the lookup table of a program; returns False if it cannot be compiled."""
+    compiled = compile_cbn(input_cbn)
+    if compiled is None:
+        return False
+    table = build_lookup_table(compiled)
+    path = lookup_path(input_cbn)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, table)
+    os.replace(tmp_path, path)
+    return True
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python3 lookup_table.py <num_reps> <percentages_comma_separated>")
+        print("Example: python3 lookup_table.py 5 01,25,50,75,90")
+        sys.exit(1)
+
+    num_reps = int(sys.argv[1])
+    percentages = sys.argv[2].split(",")
+
+    start_all = time.time()
+    for rep in range(1, num_reps + 1):
+        for perc in percentages:
+            models_subdir = os.path.join(os.getcwd(), f"rep_{rep}", perc, "cBNs")
+            built = 0
+            for i in range(1, NUM_FOLDS + 1):
+                input_cbn = os.path.join(models_subdir, f"cBN_{i}.pl")
+                if not os.path.exists(input_cbn):
+                    continue
+                if load_lookup_table(input_cbn) is not None or precompute(input_cbn):
+                    built += 1
+                else:
+                    print(f"[Warning] No lookup table for {input_cbn}")
+            print(f"rep_{rep}/{perc}: {built} lookup tables")
+    print(f"All lookup tables done in {(time.time() - start_all)/60:.2f} minutes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Typed Parquet copies of twin_networks_results.csv and data_sorted.csv.
+
+The CSVs stay the canonical outputs (the R scripts read them); next to each
+one the writers also save <name>.parquet with typed columns: 'True'/'False'
+columns become booleans, action names and other repeated labels become
+categoricals and ids become int32. probability and elapsed_time stay
+float64: the best-intervention ranking compares probabilities for equality
+and data_sorted.csv is written back from the frame, so they must keep the
+exact values of the CSV.
+
+read_results() returns the typed frame, from the Parquet copy alone while it
+is at least as new as the CSV, from the CSV otherwise (or when no Parquet
+engine is installed).
+"""
+
+import os
+import pandas as pd
+
+from variables import ACTIONS_LIST
+
+# Columns holding action names share one category set, so they compare
+ACTION_COLS = ['action', 'iaction']
+# Other repeated labels stored as categoricals
+CATEGORY_COLS = ['answered_by', 'best_intervention', 'frequency']
+INT_COLS = ['group_id', 'ranking']
+FLOAT_COLS = ['probability', 'elapsed_time']
+
+_warned = False
+
+
+def parquet_path(csv_path):
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def to_typed(df):
+    """Returns a copy of an all-string (or mixed) results frame with typed columns."""
+    typed = df.copy()
+    names = set()
+    for col in ACTION_COLS:
+        if col in typed.columns:
+            names.update(typed[col].dropna().astype(str))
+    categories = ACTIONS_LIST + sorted(names - set(ACTIONS_LIST))
+    for col in typed.columns:
+        values = typed[col]
+        if col in ACTION_COLS:
+            typed[col] = pd.Categorical(values.astype(str), categories=categories)
+        elif col in CATEGORY_COLS:
+            typed[col] = values.astype('category')
+        elif col in INT_COLS:
+            numbers = pd.to_numeric(values, errors='coerce')
+            if numbers.notna().all():
+                typed[col] = numbers.astype('int32')
+        elif col in FLOAT_COLS:
+            typed[col] = pd.to_numeric(values, errors='coerce').astype('float64')
+        elif values.dtype != bool and values.astype(str).isin(['True', 'False']).all():
+            typed[col] = values.astype(str) == 'True'
+    return typed
+
+
+def text_order(values):
+    """sort_values key sorting group_id as text ('1' < '10' < '2'), the order data_sorted.csv has always had."""
+    return values.astype(str) if values.name == 'group_id' else values
+
+
+def write_typed(df, csv_path):
+    """Saves the typed Parquet copy of a frame written to csv_path; returns False if it cannot."""
+    global _warned
+    try:
+        to_typed(df).to_parquet(parquet_path(csv_path), index=False)
+        return True
+    except ImportError as e:
+        if not _warned:
+            print(f"[Warning] No Parquet copies of the results ({str(e).splitlines()[0]})")
+            _warned = True
+        return False
+
+
+def read_results(csv_path, columns=None):
+    """Reads a results CSV as a typed frame, from its Parquet copy when that is up to date."""
+    pq_path = parquet_path(csv_path)
+    try:
+        if os.path.getmtime(pq_path) >= os.path.getmtime(csv_path):
+            return pd.read_parquet(pq_path, columns=columns)
+    except (OSError, ImportError, ValueError):
+        pass
+    # Floats parsed from their text as the scripts always did, not by the CSV reader
+    dtype = {col: str for col in FLOAT_COLS}
+    return to_typed(pd.read_csv(csv_path, usecols=columns, dtype=dtype))
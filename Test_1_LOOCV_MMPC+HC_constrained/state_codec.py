@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Bit-packed keys of (action, perception state) pairs.
+
+The post-processing scripts match rows of the results against no_crashes.csv
+and complete_DB_discrete.csv by action and perception state. Instead of
+joining the values into strings row by row, encode() packs them into one
+uint16 per row with vectorized bit operations:
+
+    key = action << STATE_BITS | state
+
+state packs STATE_KEYS into STATE_BITS bits with the layout of
+lookup_table.py (first key most significant; see variables.py) and action is the
+ACTIONS_LIST index, in ACTION_BITS bits. Keys therefore index arrays of
+KEY_SPACE entries directly (sets of keys are boolean arrays, counts are
+bincounts), and key >> STATE_BITS and the low STATE_BITS bits give back the action
+and the state. Rows with a missing or unknown value get INVALID_KEY, which
+never matches.
+"""
+
+import numpy as np
+import pandas as pd
+
+from variables import ACTIONS_LIST, STATE_KEYS
+
+STATE_BITS = len(STATE_KEYS)
+ACTION_BITS = 3
+KEY_SPACE = 1 << (STATE_BITS + ACTION_BITS)
+# Action code 7 does not exist, so the last key is free to mark unknown rows
+INVALID_KEY = KEY_SPACE - 1
+
+
+def missing_columns(df, action_col='action'):
+    """Columns encode() needs that df lacks."""
+    return [c for c in [action_col] + STATE_KEYS if c not in df.columns]
+
+
+def _truth(values):
+    """(bits, known) of a column of booleans or "True"/"False" strings."""
+    if values.dtype == bool:
+        bits = values.to_numpy()
+        return bits, np.ones(len(bits), dtype=bool)
+    text = values.astype(str)
+    bits = (text == "True").to_numpy()
+    return bits, bits | (text == "False").to_numpy()
+
+
+def action_codes(values):
+    """ACTIONS_LIST indices of a column of action names, -1 if unknown."""
+    return pd.Index(ACTIONS_LIST).get_indexer(values.astype(str)).astype(np.int16)
+
+
+def encode(df, action_col='action'):
+    """uint16 keys of the rows of df, taking the action from action_col."""
+    state = np.zeros(len(df), dtype=np.uint16)
+    known = np.ones(len(df), dtype=bool)
+    for key in STATE_KEYS:
+        bits, ok = _truth(df[key])
+        state = (state << 1) | bits
+        known &= ok
+    action = action_codes(df[action_col])
+    known &= action >= 0
+    keys = (action.astype(np.uint16) << STATE_BITS) | state
+    return np.where(known, keys, INVALID_KEY).astype(np.uint16)
+
+
+def key_set(keys):
+    """Boolean membership array over KEY_SPACE of the given keys."""
+    member = np.zeros(KEY_SPACE, dtype=bool)
+    member[keys] = True
+    member[INVALID_KEY] = False
+    return member
+
+
+def count_keys(keys):
+    """Number of occurrences of every key, as an array over KEY_SPACE."""
+    counts = np.bincount(keys, minlength=KEY_SPACE)
+    counts[INVALID_KEY] = 0
+    return counts
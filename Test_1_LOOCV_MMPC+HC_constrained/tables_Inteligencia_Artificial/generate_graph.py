@@ -1,8 +1,8 @@
 import os
-import re
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import defaultdict
+from contingency_data import load_contingency, JSON_NAME
 
 # Configuration
 percentages = ['01', '25', '50', '75', '90']
@@ -14,12 +14,6 @@ base_dirs = [
     '../rep_5'
 ]
 
-def safe_int_convert(value_str):
-    try:
-        return int(value_str.strip())
-    except:
-        return 0
-
 # Initialize data structures
 crash_safe_percentages = {p: [] for p in percentages}  # List of percentages for each repetition
 no_crash_safe_percentages = {p: [] for p in percentages}
@@ -32,61 +26,40 @@ for base_dir in base_dirs:
     print(f"Processing directory: {base_dir}")
     
     for p in percentages:
-        # Build the correct file path
-        file_name = "contingency_table.txt"
         dir_path = os.path.join(base_dir, p, 'cBNs')
-        file_path = os.path.join(dir_path, file_name)
-        
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
-            missing_files.append(file_path)
-            continue
-            
+
+        # Counts from contingency.json (or from the text report of older runs)
         try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-                
-                # Split into main sections (only the top-level sections)
-                sections = re.split(r'=== (CRASH SECTION|NO CRASH SECTION) ===', content)
-                sections = [s.strip() for s in sections if s.strip()]
-                
-                # Process CRASH SECTION - only get the first occurrence from the main section
-                if len(sections) > 1 and 'CRASH SECTION' in sections[0]:
-                    crash_content = sections[1]
-                    main_crash_section = crash_content.split('Detailed transition matrices')[0]
-                    
-                    safe_match = re.search(r'True -> False:\s+(\d+)', main_crash_section)
-                    unsafe_match = re.search(r'True -> True:\s+(\d+)', main_crash_section)
-                    
-                    if safe_match and unsafe_match:
-                        safe_count = safe_int_convert(safe_match.group(1))
-                        unsafe_count = safe_int_convert(unsafe_match.group(1))
-                        total = safe_count + unsafe_count
-                        
-                        if total > 0:
-                            safe_percentage = (safe_count / total) * 100
-                            crash_safe_percentages[p].append(safe_percentage)
-                
-                # Process NO CRASH SECTION - only get the first occurrence from the main section
-                if len(sections) > 3 and 'NO CRASH SECTION' in sections[2]:
-                    no_crash_content = sections[3]
-                    main_no_crash_section = no_crash_content.split('Detailed transition matrices')[0]
-                    
-                    safe_match = re.search(r'False -> False:\s+(\d+)', main_no_crash_section)
-                    unsafe_match = re.search(r'False -> True:\s+(\d+)', main_no_crash_section)
-                    
-                    if safe_match and unsafe_match:
-                        safe_count = safe_int_convert(safe_match.group(1))
-                        unsafe_count = safe_int_convert(unsafe_match.group(1))
-                        total = safe_count + unsafe_count
-                        
-                        if total > 0:
-                            safe_percentage = (safe_count / total) * 100
-                            no_crash_safe_percentages[p].append(safe_percentage)
-                            
+            data = load_contingency(dir_path)
         except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
+            print(f"Error processing {dir_path}: {str(e)}")
+            continue
+        if data is None:
+            file_path = os.path.join(dir_path, JSON_NAME)
+            print(f"File not found: {file_path}")
+            missing_files.append(file_path)
             continue
+        sections = data['sections']
+
+        # CRASH SECTION - section totals (True -> False is safe)
+        if 'crash' in sections:
+            transitions = sections['crash']['transitions']
+            safe_count = transitions['True_False']['rows']
+            unsafe_count = transitions['True_True']['rows']
+            total = safe_count + unsafe_count
+            if total > 0:
+                safe_percentage = (safe_count / total) * 100
+                crash_safe_percentages[p].append(safe_percentage)
+
+        # NO CRASH SECTION - section totals (False -> False is safe)
+        if 'no_crash' in sections:
+            transitions = sections['no_crash']['transitions']
+            safe_count = transitions['False_False']['rows']
+            unsafe_count = transitions['False_True']['rows']
+            total = safe_count + unsafe_count
+            if total > 0:
+                safe_percentage = (safe_count / total) * 100
+                no_crash_safe_percentages[p].append(safe_percentage)
 
 # Report missing files
 if missing_files:
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Fold checkpoints, their manifests and fold leases."""
+
+import os
+import time
+
+import fold_checkpoints
+from fold_checkpoints import FoldCheckpoints
+
+HASHES = {'program': 'p1', 'test_data': 't1'}
+
+
+def output(queries=3):
+    """A run_fold-like output: results, latency, elapsed, found actions, profile, structure."""
+    return ([('cruise', 0.5)] * queries, None, 1.5, "['cruise']\n", [], 'abc')
+
+
+def node(monkeypatch, models_subdir, name):
+    """FoldCheckpoints of another process called name, which acts from now on."""
+    monkeypatch.setattr(fold_checkpoints, 'NODE_ID', name)
+    return FoldCheckpoints(str(models_subdir))
+
+
+def test_save_and_load(tmp_path):
+    checkpoints = FoldCheckpoints(str(tmp_path))
+    assert not checkpoints.completed(1, [], HASHES)
+    checkpoints.save(1, output(), HASHES)
+    assert checkpoints.load(1) == output()
+    assert checkpoints.completed(1, [], HASHES)
+    assert not checkpoints.completed(1, [], dict(HASHES, program='p2'))
+    assert not checkpoints.completed(2, [], HASHES)
+
+
+def test_folds_saved_by_other_processes(tmp_path, monkeypatch):
+    first = node(monkeypatch, tmp_path, 'host.1')
+    second = node(monkeypatch, tmp_path, 'host.2')
+    first.save(1, output(), HASHES)
+    second.save(2, output(), HASHES)
+    assert not first.completed(2, [], HASHES)
+    first.refresh()
+    assert first.completed(2, [], HASHES)
+
+    # The latest checkpoint of a fold wins
+    second.save(1, output(5), dict(HASHES, program='p2'))
+    third = node(monkeypatch, tmp_path, 'host.3')
+    assert third.completed(1, [], dict(HASHES, program='p2'))
+    assert third.load(1) == output(5)
+
+
+def test_missing_checkpoint_file_is_not_complete(tmp_path):
+    checkpoints = FoldCheckpoints(str(tmp_path))
+    checkpoints.save(1, output(), HASHES)
+    (tmp_path / fold_checkpoints.CHECKPOINT_DIR / "fold_1.pkl").unlink()
+    assert not checkpoints.completed(1, [], HASHES)
+
+
+def test_clear(tmp_path):
+    checkpoints = FoldCheckpoints(str(tmp_path))
+    checkpoints.save(1, output(), HASHES)
+    assert checkpoints.claim(2)
+    assert checkpoints.clear()
+    assert not FoldCheckpoints(str(tmp_path)).completed(1, [], HASHES)
+
+
+def test_clear_refuses_while_others_hold_leases(tmp_path, monkeypatch):
+    other = node(monkeypatch, tmp_path, 'host.2')
+    other.save(1, output(), HASHES)
+    assert other.claim(2)
+    first = node(monkeypatch, tmp_path, 'host.1')
+    assert first.live_leases() == ['2']
+    assert not first.clear()
+    assert first.completed(1, [], HASHES)
+    assert os.path.exists(other.lease_path(2))
+
+    # Once the lease has expired, the configuration can be cleared
+    expired = time.time() - fold_checkpoints.LEASE_SECONDS - 1
+    os.utime(other.lease_path(2), (expired, expired))
+    assert first.live_leases() == []
+    assert first.clear()
+    assert not FoldCheckpoints(str(tmp_path)).completed(1, [], HASHES)
+
+
+def test_compact_keeps_one_manifest(tmp_path, monkeypatch):
+    for n in range(1, 4):
+        node(monkeypatch, tmp_path, f'host.{n}').save(n, output(n), HASHES)
+    node(monkeypatch, tmp_path, 'host.4').save(1, output(5), dict(HASHES, program='p2'))
+    merger = node(monkeypatch, tmp_path, 'host.5')
+    merger.compact()
+    manifests = sorted(os.listdir(tmp_path / fold_checkpoints.CHECKPOINT_DIR))
+    assert [m for m in manifests if m.endswith(".json")] == ["manifest.host.5.json"]
+    later = node(monkeypatch, tmp_path, 'host.6')
+    assert later.completed(1, [], dict(HASHES, program='p2'))
+    assert later.completed(2, [], HASHES) and later.completed(3, [], HASHES)
+    assert later.load(1) == output(5)
+
+
+def test_lease_is_exclusive(tmp_path, monkeypatch):
+    first = node(monkeypatch, tmp_path, 'host.1')
+    second = node(monkeypatch, tmp_path, 'host.2')
+    assert first.claim(1)
+    assert not second.claim(1)
+    assert not first.claim(1)
+    assert second.claim(2) and second.claim("merge")
+    first.release(1)
+    assert not os.path.exists(first.lease_path(1))
+    assert second.claim(1)
+    second.release_all()
+    assert not any(os.path.exists(second.lease_path(unit)) for unit in [1, 2, "merge"])
+
+
+def test_abandoned_lease_is_taken_over(tmp_path, monkeypatch):
+    crashed = node(monkeypatch, tmp_path, 'host.1')
+    assert crashed.claim(1)
+    expired = time.time() - fold_checkpoints.LEASE_SECONDS - 1
+    os.utime(crashed.lease_path(1), (expired, expired))
+    other = node(monkeypatch, tmp_path, 'host.2')
+    assert other.claim(1)
+    with open(other.lease_path(1)) as f:
+        assert f.read().strip() == 'host.2'
+    # The old holder must not remove the lease it lost
+    monkeypatch.setattr(fold_checkpoints, 'NODE_ID', 'host.1')
+    crashed.release(1)
+    assert os.path.exists(other.lease_path(1))
+
+
+def test_renewed_lease_is_kept(tmp_path, monkeypatch):
+    holder = node(monkeypatch, tmp_path, 'host.1')
+    other = node(monkeypatch, tmp_path, 'host.2')
+    assert holder.claim(1)
+    path = holder.lease_path(1)
+    expired = time.time() - fold_checkpoints.LEASE_SECONDS - 1
+    os.utime(path, (expired, expired))
+    holder.renew(1)
+    assert not other.claim(1)
+
+    os.utime(path, (expired, expired))
+    with holder.keep_alive(1, interval=0.01):
+        deadline = time.time() + 5
+        while os.path.getmtime(path) <= expired and time.time() < deadline:
+            time.sleep(0.01)
+    assert not other.claim(1)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Typed Parquet copies of the results CSVs."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import results_io
+from results_io import write_typed, read_results, parquet_path
+
+pytest.importorskip("pyarrow")
+
+
+def results(n=50, seed=0):
+    """A twin_networks_results-like frame with probabilities that float32 would round."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'group_id': np.repeat(np.arange(1, n // 5 + 1), 5)[:n],
+        'action': rng.choice(['cruise', 'keep', 'swerve_left'], n),
+        'free_W': rng.choice(['True', 'False'], n),
+        'iaction': rng.choice(['cruise', 'keep'], n),
+        'probability': rng.random(n) / 3,
+        'elapsed_time': rng.random(n),
+        'answered_by': 'compiler',
+    })
+
+
+def test_round_trip_reads_only_the_parquet_copy(tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "twin_networks_results.csv")
+    df = results()
+    df.to_csv(csv_path, index=False)
+    assert write_typed(df, csv_path)
+
+    def read_csv(*args, **kwargs):
+        raise AssertionError("the CSV was read although the Parquet copy is up to date")
+    monkeypatch.setattr(results_io.pd, 'read_csv', read_csv)
+    typed = read_results(csv_path)
+    assert typed['probability'].dtype == np.float64
+    assert (typed['probability'].to_numpy() == df['probability'].to_numpy()).all()
+    assert (typed['elapsed_time'].to_numpy() == df['elapsed_time'].to_numpy()).all()
+    assert typed['free_W'].dtype == bool and typed['group_id'].dtype == np.int32
+    assert list(typed['action'].astype(str)) == list(df['action'])
+    assert list(read_results(csv_path, columns=['iaction']).columns) == ['iaction']
+
+
+def test_stale_parquet_copy_falls_back_to_the_csv(tmp_path):
+    csv_path = str(tmp_path / "twin_networks_results.csv")
+    write_typed(results(), csv_path)
+    df = results(seed=1)
+    df.to_csv(csv_path, index=False)
+    stamp = os.path.getmtime(parquet_path(csv_path)) + 10
+    os.utime(csv_path, (stamp, stamp))
+    assert read_results(csv_path)['probability'].to_numpy() == pytest.approx(df['probability'].to_numpy())